@@ -1,109 +1,71 @@
 # import google.generativeai as genai
-from utils.pdf_parser import extract_text_from_pdf
+from utils.pdf_parser import extract_text_from_bytes, extract_text_from_pdf
 from db.connection import get_db
-import os
+from db.vector_store import begin_bulk_load, create_session_table, insert_embeddings, session_table_name
+import logging
+import time
 import uuid
-import nltk
-from google import genai
-# Download punkt data if not already downloaded
-try:
-    nltk.data.find('tokenizers/punkt')
-except LookupError:
-    nltk.download('punkt')
-
-nltk.download('punkt_tab')
-from nltk.tokenize import sent_tokenize
+from agents.gemini_client import EMBEDDING_MODEL, get_client
+from utils.gemini_embeddings import embed_in_windows
+from utils.text_chunking import chunk_text
 from dotenv import load_dotenv
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
 class DocumentProcessorTemp:
     def __init__(self):
-        print(f"Initializing DocumentProcessorTemp")
-        self.client = genai.Client(api_key=os.getenv("GEMINI_API_KEY"))
-        self.model = "gemini-embedding-001"
+        self.client = get_client()
+        self.model = EMBEDDING_MODEL
 
     def chunk_text(self, text, sentences_per_chunk=15, overlap=3):
-        text = ' '.join(text.split())
-        sentences = sent_tokenize(text)
-        chunks = []
-        start = 0
+        return chunk_text(text, sentences_per_chunk, overlap)
 
-        while start < len(sentences):
-            end = start + sentences_per_chunk
-            chunk = " ".join(sentences[start:end])
-            chunks.append(chunk)
-            start += sentences_per_chunk - overlap  # move with overlap
 
-        return chunks
 
+    def process(self, file_path, session_id: str):
+        logger.debug("Processing %s for session %s", file_path, session_id)
+        return self._ingest(lambda: extract_text_from_pdf(file_path), session_id)
 
+    def process_bytes(self, data: bytes, session_id: str):
+        """Same as ``process``, for a document already downloaded into memory."""
+        logger.debug("Processing %d bytes for session %s", len(data), session_id)
+        return self._ingest(lambda: extract_text_from_bytes(data), session_id)
 
-    def process(self, file_path, session_id: str):
+    def _ingest(self, extract_text, session_id: str):
+        started = time.perf_counter()
         try:
-            print(f"Processing document for session inside attached_document_processor")
-            print(f"File path: {file_path}, Session ID: {session_id}")
             # 1. Extract text
-            text = extract_text_from_pdf(file_path)
-            print(f"Length of text in characters: {len(text)}")
+            text = extract_text()
+            logger.debug("Extracted %d characters", len(text))
             if not text.strip():
                 return {"agent": "DocumentProcessor", "status": "error", "result": "No text found in PDF"}
             
-            chunks = self.chunk_text(text)
-            print(f"Total chunks created: {len(chunks)}")
-            # 3. Save to pgvector
-            conn = get_db()
-            cur = conn.cursor()
-            cur.execute(f"""
-                CREATE TABLE IF NOT EXISTS temp_documents_{session_id} (
-                    id UUID PRIMARY KEY,
-                    content TEXT,
-                    embedding vector(3072)
+            # 2. Chunk and embed window by window, without holding a connection
+            table = session_table_name("temp_documents", session_id)
+            rows = []
+            for chunks, embeddings in embed_in_windows(self.client, self.model, self.chunk_text(text)):
+                rows.extend(
+                    (str(uuid.uuid4()), chunk, embedding)
+                    for chunk, embedding in zip(chunks, embeddings)
                 )
-            """)
-            conn.commit()
-            i=0
-
-            for chunk in chunks:
-                i=i+1
-                clean_chunk = chunk.replace("\x00", "")
-                print(f"Processing chunk {i}/{len(chunks)}")
-
-                try:
-                    # Generate embedding using official API
-                    result = self.client.models.embed_content(
-                        model=self.model,
-                        contents=[clean_chunk]  # must be a list
-                    )
-
-                    # Extract embedding
-                    embedding = result.embeddings[0].values
-                    embedding = [float(x) for x in embedding]
-
-                except Exception as e:
-                    return {
-                        "agent": "DocumentProcessor",
-                        "status": "error",
-                        "result": str(e)
-                    }
-
-
-                doc_id = str(uuid.uuid4())
-                cur.execute(
-                    f"INSERT INTO temp_documents_{session_id} (id, content, embedding) VALUES (%s, %s, %s)",
-                    (doc_id, clean_chunk, embedding)
-                )
-                print(f"Inserted chunk {i}/{len(chunks)}")
-
-
-            conn.commit()
-            cur.close()
-            conn.close()
+                logger.debug("Embedded %d chunks (total %d)", len(chunks), len(rows))
+
+            # 3. Save to pgvector in one short transaction
+            with get_db() as conn:
+                conn.autocommit = False
+                with conn.cursor() as cur:
+                    create_session_table(cur, table)
+                    begin_bulk_load(cur)
+                    inserted = insert_embeddings(cur, table, ("id", "content", "embedding"), rows)
+                conn.commit()
+            logger.info("Ingested %d chunks into %s in %.2fs", inserted, table, time.perf_counter() - started)
 
             return {
                 "agent": "TempDocumentProcessor",
                 "status": "success",
-                "result": f"Document processed into {len(chunks)} chunks and saved to temp_documents table"
+                "result": f"Document processed into {inserted} chunks and saved to temp_documents table"
             }
 
         except Exception as e:
-            return {"agent": "TempDocumentProcessor", "status": "error", "result": str(e)}
\ No newline at end of file
+            return {"agent": "TempDocumentProcessor", "status": "error", "result": str(e)}
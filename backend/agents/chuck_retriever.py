@@ -1,13 +1,14 @@
 # import google.generativeai as genai
+import asyncio
 from db.connection import get_db
-import os
-from google import genai
+from agents.gemini_client import EMBEDDING_MODEL, get_client
+from utils.gemini_embeddings import embed_query
 
 class Retriever:
     def __init__(self):
         # Initialize client using API key from environment
-        self.client = genai.Client(api_key=os.getenv("GEMINI_API_KEY"))
-        self.model = "gemini-embedding-001"
+        self.client = get_client()
+        self.model = EMBEDDING_MODEL
 
     def retrieve_chunks(self, question, top_k=5):
         print(f"Retrieved Question inside the chunk retriever: {question}")
@@ -15,34 +16,24 @@ class Retriever:
         Returns top-k most relevant chunks from the database for a question.
         """
         try:
-            # 1. Create embedding for the question
-            result = self.client.models.embed_content(
-                model=self.model,
-                contents=[question]  # must be a list
-            )
-
-            # Extract the embedding vector (first item because we passed one text)
-            question_embedding = result.embeddings[0].values
+            # 1. Create embedding for the question (memoized across requests)
+            question_embedding = embed_query(self.client, self.model, question)
 
             print(f"Question Embedding (first 5 dims): {question_embedding[:5]}...")
 
-            # Ensure it's a float list
-            question_embedding = [float(x) for x in question_embedding]
-
             # 2. Query pgvector
-            conn = get_db()
-            cur = conn.cursor()
-
-            query = """
-                SELECT id, content, embedding <=> %s::vector AS distance
-                FROM documents
-                ORDER BY distance
-                LIMIT %s
-            """
-            cur.execute(query, (question_embedding, top_k))
-            results = cur.fetchall()
-            cur.close()
-            conn.close()
+            with get_db(autocommit=True) as conn:
+                cur = conn.cursor()
+
+                query = """
+                    SELECT id, content, embedding <=> %s::halfvec AS distance
+                    FROM documents
+                    ORDER BY distance
+                    LIMIT %s
+                """
+                cur.execute(query, (question_embedding, top_k))
+                results = cur.fetchall()
+                cur.close()
 
             # 3. Format results
             chunks = [{"id": r[0], "content": r[1], "distance": r[2]} for r in results]
@@ -51,3 +42,10 @@ class Retriever:
 
         except Exception as e:
             return {"status": "error", "message": str(e)}
+
+    async def aretrieve_chunks(self, question, top_k=5):
+        """
+        Async variant of retrieve_chunks. The embedding call and the query are
+        blocking, so they run in a worker thread and the event loop stays free.
+        """
+        return await asyncio.to_thread(self.retrieve_chunks, question, top_k)
@@ -1,90 +1,71 @@
 # import google.generativeai as genai
 from utils.pdf_parser import extract_text_from_pdf
 from db.connection import get_db
-import os
+from db.vector_store import (
+    INDEX_REBUILD_MIN_ROWS,
+    begin_bulk_load,
+    copy_embeddings,
+    drop_vector_indexes,
+    restore_vector_indexes,
+)
+import logging
+import time
 import uuid
-import nltk
-nltk.download('punkt')
-from nltk.tokenize import sent_tokenize
-from google import genai
+from agents.gemini_client import EMBEDDING_MODEL, get_client
+from utils.gemini_embeddings import embed_in_windows
+from utils.text_chunking import chunk_text
+
+logger = logging.getLogger(__name__)
 
 class DocumentProcessor:
     def __init__(self):
-        self.client = genai.Client(api_key=os.getenv("GEMINI_API_KEY"))
-        self.model = "gemini-embedding-001"
+        self.client = get_client()
+        self.model = EMBEDDING_MODEL
 
     def chunk_text(self, text, sentences_per_chunk=15, overlap=3):
-        text = ' '.join(text.split())
-        sentences = sent_tokenize(text)
-        chunks = []
-        start = 0
-
-        while start < len(sentences):
-            end = start + sentences_per_chunk
-            chunk = " ".join(sentences[start:end])
-            chunks.append(chunk)
-            start += sentences_per_chunk - overlap  # move with overlap
-
-        return chunks
+        return chunk_text(text, sentences_per_chunk, overlap)
 
 
 
     def process(self, file_path):
+        started = time.perf_counter()
         try:
             # 1. Extract text
             text = extract_text_from_pdf(file_path)
-            print(f"Length of text in characters: {len(text)}")
+            logger.debug("Extracted %d characters from %s", len(text), file_path)
             if not text.strip():
                 return {"agent": "DocumentProcessor", "status": "error", "result": "No text found in document"}
             
-            chunks = self.chunk_text(text)
-            
-            # 3. Save to pgvector
-            conn = get_db()
-            cur = conn.cursor()
-            i=0
-
-            for chunk in chunks:
-                i=i+1
-                clean_chunk = chunk.replace("\x00", "")
-
-                try:
-                    # Generate embedding using official API
-                    result = self.client.models.embed_content(
-                        model=self.model,
-                        contents=[clean_chunk]  # must be a list
-                    )
-
-                    # Extract embedding
-                    embedding = result.embeddings[0].values
-                    embedding = [float(x) for x in embedding]
-
-                except Exception as e:
-                    return {
-                        "agent": "DocumentProcessor",
-                        "status": "error",
-                        "result": str(e)
-                    }
-
-                # Generate unique doc_id
-                doc_id = str(uuid.uuid4())
-
-                # Insert into DB
-                cur.execute(
-                    "INSERT INTO documents (id, content, embedding) VALUES (%s, %s, %s)",
-                    (doc_id, clean_chunk, embedding)
+            # 2. Chunk and embed window by window, without holding a connection
+            rows = []
+            for chunks, embeddings in embed_in_windows(self.client, self.model, self.chunk_text(text)):
+                rows.extend(
+                    (str(uuid.uuid4()), chunk, embedding)
+                    for chunk, embedding in zip(chunks, embeddings)
                 )
-                print(f"Inserted chunk {i}/{len(chunks)}")
-
-
-            conn.commit()
-            cur.close()
-            conn.close()
+                logger.debug("Embedded %d chunks (total %d)", len(chunks), len(rows))
+
+            # 3. Save to pgvector in one short transaction
+            with get_db() as conn:
+                conn.autocommit = False
+                with conn.cursor() as cur:
+                    begin_bulk_load(cur)
+                    # Large load: build the ANN index once at the end instead of per row.
+                    # DROP INDEX blocks reads of the table until commit, so only the
+                    # write and the rebuild run while it is held, never the embedding calls.
+                    dropped = (
+                        drop_vector_indexes(cur, "documents")
+                        if len(rows) >= INDEX_REBUILD_MIN_ROWS else []
+                    )
+                    inserted = copy_embeddings(cur, "documents", ("id", "content", "embedding"), rows)
+                    restore_vector_indexes(cur, dropped)
+                conn.commit()
+            logger.info("Ingested %d chunks into documents in %.2fs", inserted, time.perf_counter() - started)
 
             return {
                 "agent": "DocumentProcessor",
                 "status": "success",
-                "result": f"Document processed into {len(chunks)} chunks and saved"
+                "result": f"Document processed into {inserted} chunks and saved"
             }
 
         except Exception as e:
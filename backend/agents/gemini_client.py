@@ -0,0 +1,22 @@
+"""Shared google-genai client.
+
+Every agent used to build its own ``genai.Client`` (RecommendationAgent even
+built one per request), each with its own HTTP connection pool. They now share
+a single lazily created client so connections are reused across agents.
+"""
+
+import os
+from functools import lru_cache
+
+from dotenv import load_dotenv
+from google import genai
+
+load_dotenv()
+
+EMBEDDING_MODEL = "gemini-embedding-001"
+
+
+@lru_cache(maxsize=1)
+def get_client() -> genai.Client:
+    """Return the process-wide Gemini client, creating it on first use."""
+    return genai.Client(api_key=os.getenv("GEMINI_API_KEY"))
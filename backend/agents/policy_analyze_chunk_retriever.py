@@ -1,43 +1,29 @@
 # import google.generativeai as genai
-from db.connection import get_db
-import os
-from google import genai
+from db.vector_store import parallel_knn_search_sources
+from agents.gemini_client import EMBEDDING_MODEL, get_client
 
 class PolicyAnalyzeRetriever:
     def __init__(self):
-        self.client = genai.Client(api_key=os.getenv("GEMINI_API_KEY"))
-        self.model = "gemini-embedding-001"
-
-    def retrieve_for_embeddings(self, embeddings, safe_session_id, top_k=1):
-        print(f"Retrieving chunks for multiple embeddings in temp_retriever.")
+        self.client = get_client()
+        self.model = EMBEDDING_MODEL
+
+    def retrieve_multi(self, embeddings, sources, top_k=1):
+        """
+        Search several sources with one query per connection shard.
+
+        Args:
+            embeddings: Query vectors
+            sources: List of (table, filters) pairs, e.g.
+                [("documents", None), ("international_policy", {"policy": "GDPR"})]
+            top_k: Matches per embedding and source
+
+        Returns:
+            {"status": "success", "results": [per-source results]} in the
+            order of ``sources``, each mapping an embedding's index to its
+            matches
+        """
         try:
-            conn = get_db()
-            cur = conn.cursor()
-
-            all_results = {}
-
-            for idx, embedding in enumerate(embeddings):
-                # Ensure float list
-                embedding = [float(x) for x in embedding]
-
-                query = f"""
-                    SELECT id, content, embedding <=> %s::vector AS distance
-                    FROM documents
-                    ORDER BY distance
-                    LIMIT %s
-                """
-                cur.execute(query, (embedding, top_k))
-                rows = cur.fetchall()
-
-                chunks = [
-                    {"id": r[0], "content": r[1], "distance": r[2]}
-                    for r in rows
-                ]
-                all_results[idx] = chunks
-
-            cur.close()
-            conn.close()
-
+            all_results = parallel_knn_search_sources(sources, embeddings, top_k)
             return {"status": "success", "results": all_results}
 
         except Exception as e:
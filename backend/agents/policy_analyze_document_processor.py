@@ -1,46 +1,33 @@
 from utils.pdf_parser import extract_text_from_pdf
 from db.connection import get_db
-import os
+from db.vector_store import begin_bulk_load, create_session_table, insert_embeddings, session_table_name
+import logging
+import time
 import uuid
-import nltk
-from google import genai
-from nltk.tokenize import sent_tokenize
+from agents.gemini_client import EMBEDDING_MODEL, get_client
+from utils.gemini_embeddings import embed_in_windows
+from utils.text_chunking import chunk_text
 from dotenv import load_dotenv
 
-# Download punkt if missing
-try:
-    nltk.data.find('tokenizers/punkt')
-except LookupError:
-    nltk.download('punkt')
-nltk.download('punkt_tab')
-
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
 class AnalyzeDocumentProcessorTemp:
     def __init__(self):
-        print("Initializing DocumentProcessorTemp")
-        self.client = genai.Client(api_key=os.getenv("GEMINI_API_KEY"))
-        self.model = "gemini-embedding-001"
+        self.client = get_client()
+        self.model = EMBEDDING_MODEL
 
     def chunk_text(self, text, sentences_per_chunk=10, overlap=2):
         """Split text into overlapping chunks of sentences."""
-        text = ' '.join(text.split())
-        sentences = sent_tokenize(text)
-        chunks, start = [], 0
-
-        while start < len(sentences):
-            end = start + sentences_per_chunk
-            chunk = " ".join(sentences[start:end])
-            chunks.append(chunk)
-            start += sentences_per_chunk - overlap
-
-        return chunks
+        return chunk_text(text, sentences_per_chunk, overlap)
 
     def process(self, file_path, session_id: str):
+        started = time.perf_counter()
         try:
-            print(f"Processing document for session {session_id}")
+            logger.debug("Processing %s for session %s", file_path, session_id)
             text = extract_text_from_pdf(file_path)
-            print(f"Length of text: {len(text)} chars")
+            logger.debug("Extracted %d characters", len(text))
 
             if not text.strip():
                 return {
@@ -49,55 +36,30 @@ class AnalyzeDocumentProcessorTemp:
                     "result": "No text found in document"
                 }
 
-            chunks = self.chunk_text(text)
-            print(f"Total chunks created: {len(chunks)}")
-
-            conn = get_db()
-            cur = conn.cursor()
-            cur.execute(f"""
-                CREATE TABLE IF NOT EXISTS analyze_documents_{session_id} (
-                    id UUID PRIMARY KEY,
-                    content TEXT,
-                    embedding vector(3072)
-                )
-            """)
-            conn.commit()
-
-            embeddings = []  # <-- collect embeddings here
-            results = []     # <-- collect (chunk, embedding) pairs
-
-            for i, chunk in enumerate(chunks, start=1):
-                clean_chunk = chunk.replace("\x00", "")
-                print(f"Processing chunk {i}/{len(chunks)}")
-
-                try:
-                    # Get embedding
-                    result = self.client.models.embed_content(
-                        model=self.model,
-                        contents=[clean_chunk]
-                    )
-                    embedding = [float(x) for x in result.embeddings[0].values]
-
-                    # Save to DB
-                    doc_id = str(uuid.uuid4())
-                    cur.execute(
-                        f"INSERT INTO analyze_documents_{session_id} (id, content, embedding) VALUES (%s, %s, %s)",
-                        (doc_id, clean_chunk, embedding)
-                    )
-                    embeddings.append(embedding)
-                    results.append({"chunk": clean_chunk, "embedding": embedding})
-
-                except Exception as e:
-                    return {
-                        "agent": "AnalyzeDocumentProcessor",
-                        "status": "error",
-                        "result": str(e)
-                    }
-
-            print(f"Inserted {len(chunks)} chunks into DB")
-            conn.commit()
-            cur.close()
-            conn.close()
+            # Chunk and embed window by window, without holding a connection.
+            # The caller needs every (chunk, embedding) pair, so those are kept.
+            table = session_table_name("analyze_documents", session_id)
+            chunks, embeddings = [], []
+            for window, window_embeddings in embed_in_windows(self.client, self.model, self.chunk_text(text)):
+                chunks.extend(window)
+                embeddings.extend(window_embeddings)
+                logger.debug("Embedded %d chunks (total %d)", len(window), len(chunks))
+
+            # Save in one short transaction
+            rows = [(str(uuid.uuid4()), chunk, embedding) for chunk, embedding in zip(chunks, embeddings)]
+            with get_db() as conn:
+                conn.autocommit = False
+                with conn.cursor() as cur:
+                    create_session_table(cur, table)
+                    begin_bulk_load(cur)
+                    insert_embeddings(cur, table, ("id", "content", "embedding"), rows)
+                conn.commit()
+            logger.info("Ingested %d chunks into %s in %.2fs", len(chunks), table, time.perf_counter() - started)
+
+            results = [  # <-- (chunk, embedding) pairs
+                {"chunk": chunk, "embedding": embedding}
+                for chunk, embedding in zip(chunks, embeddings)
+            ]
 
             return {
                 "agent": "AnalyzeDocumentProcessor",
@@ -8,6 +8,9 @@ except ImportError:
     print("Warning: db.connection module not found. Skipping import.")
     get_db = None
 
+# Roughly 8k tokens of context; keeps prompts (and cost) bounded.
+MAX_CONTEXT_CHARS = int(os.getenv("QUERY_MAX_CONTEXT_CHARS", "32000"))
+
 class QueryAnalyzer:
     """
     A class to analyze user queries against a set of policy documents
@@ -47,8 +50,14 @@ Do not guess, assume, or think outside the given documents.
 
 Never use external knowledge, only the provided context.
 """
-
-    def process(self, query, chunks):
+        # The prompt prefix never changes; build it once instead of per call.
+        # Kept as str rather than pre-encoded bytes: generate_content takes
+        # text, so bytes would mean encoding the context and query and
+        # decoding the result on every call, where one str join copies each
+        # part once.
+        self.prompt_prefix = f"{self.base_prompt}\n\nContext:\n"
+
+    def process(self, query, chunks, max_context_chars=MAX_CONTEXT_CHARS):
         
         """
         Processes a user query by sending it to the Gemini model with
@@ -56,7 +65,9 @@ Never use external knowledge, only the provided context.
 
         Args:
             query (str): The user's question.
-            chunks (list of str): Retrieved policy chunks relevant to the query.
+            chunks (list of str or dict): Retrieved policy chunks relevant to the query.
+                Dicts (as returned by Retriever.retrieve_chunks) use their "content".
+            max_context_chars (int): Upper bound on the context sent to the model.
         Returns:
             dict: A dictionary containing the agent name, status, and result.
         """
@@ -69,10 +80,15 @@ Never use external knowledge, only the provided context.
 
         try:
             # Combine chunks into one string for context.
-            context = "\n\n".join(chunks)
+            context = "\n\n".join(
+                chunk["content"] if isinstance(chunk, dict) else str(chunk)
+                for chunk in chunks
+            )
+            if len(context) > max_context_chars:
+                context = context[:max_context_chars]
      
             # Create the full prompt by combining the base prompt, context, and query.
-            prompt = f"{self.base_prompt}\n\nContext:\n{chunks}\n\nQuestion:\n{query}\nAnswer:"
+            prompt = "".join((self.prompt_prefix, context, "\n\nQuestion:\n", query, "\nAnswer:"))
 
           
 
@@ -1,7 +1,11 @@
-import os
 import json
+import re
 from typing import List, Dict, Any
-from google import genai
+from agents.gemini_client import get_client
+
+# Markdown code fence around the model's JSON answer, and the outermost JSON array
+_FENCE_RE = re.compile(r"^```json\s*|```$")
+_ARRAY_RE = re.compile(r"\[.*\]", re.DOTALL)
 
 class RecommendationAgent:
     def __init__(self):
@@ -18,7 +22,7 @@ class RecommendationAgent:
             Dict containing recommendations, confidence, and reasoning
         """
         try:
-            client = genai.Client(api_key=os.getenv("GEMINI_API_KEY"))
+            client = get_client()
             print("Generating recommendations using Gemini model")
             # Prepare the prompt for recommendation generation
             prompt = self._build_recommendation_prompt(violations_data)
@@ -86,9 +90,9 @@ Return only the JSON array, no additional text.
     
     def _parse_recommendations(self, response_text: str) -> List[Dict[str, Any]]:
         """Parse the LLM response to extract recommendations"""
-        import re
-        
-        cleaned_text = re.sub(r"^```json\s*|```$", "", response_text.strip())
+        cleaned_text = response_text.strip()
+        if cleaned_text.startswith("```") or cleaned_text.endswith("```"):
+            cleaned_text = _FENCE_RE.sub("", cleaned_text)
         
         try:
             recommendations = json.loads(cleaned_text)
@@ -97,7 +101,7 @@ Return only the JSON array, no additional text.
             else:
                 return [recommendations]
         except json.JSONDecodeError:
-            json_match = re.search(r'\[.*\]', cleaned_text, re.DOTALL)
+            json_match = _ARRAY_RE.search(cleaned_text)
             if json_match:
                 try:
                     return json.loads(json_match.group())
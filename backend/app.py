@@ -1,4 +1,6 @@
 
+import logging
+import os
 from flask import Flask
 from flask_cors import CORS
 from routes.document_routes import document_bp
@@ -7,6 +9,12 @@ from routes.recommendation_routes import recommendation_bp
 from routes.policy_routes import policy_bp
 from routes.chat_routes import chat_bp
 from routes.user_routes import user_bp
+from orchestrator.warmup import WARMUP_ON_START, warmup
+
+logging.basicConfig(
+    level=os.getenv("LOG_LEVEL", "INFO").upper(),
+    format="%(asctime)s %(levelname)s [%(name)s] %(message)s"
+)
 
 def create_app():
     app = Flask(__name__)
@@ -28,6 +36,10 @@ def create_app():
     app.register_blueprint(chat_bp, url_prefix="/chat")
     app.register_blueprint(policy_bp, url_prefix="/policies")
     app.register_blueprint(user_bp, url_prefix="/user")
+
+    # Preload chat clients so a worker's first request isn't a cold start
+    if WARMUP_ON_START:
+        warmup()
     
 
     return app
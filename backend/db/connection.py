@@ -1,17 +1,155 @@
 import psycopg2
 from psycopg2.extras import register_uuid
+from psycopg2.extensions import connection as PgConnection
+from psycopg2.pool import PoolError, ThreadedConnectionPool
+from pgvector.psycopg2 import register_vector
+from contextlib import contextmanager
 import os
+import re
+import threading
 from dotenv import load_dotenv
 
 # Load environment variables from .env file
 load_dotenv()
 
-def get_db():
-    conn = psycopg2.connect(
-        dbname=os.getenv("DB_NAME", "postgres"),
-        user=os.getenv("DB_USER", "postgres"),
-        password=os.getenv("DB_PASSWORD", "password"),
-        host=os.getenv("DB_HOST", "localhost"),
-        port=os.getenv("DB_PORT", "5432")
-    )
-    return conn
\ No newline at end of file
+DB_POOL_MIN = int(os.getenv("DB_POOL_MIN", "1"))
+DB_POOL_MAX = max(DB_POOL_MIN, int(os.getenv("DB_POOL_MAX", "20")))
+# ThreadedConnectionPool raises as soon as it is exhausted; borrowers wait
+# up to this many seconds for a connection to be returned instead
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+# Set when DB_HOST/DB_PORT point at PgBouncer in pool_mode=transaction.
+# Consecutive transactions may then run on different server connections, so
+# nothing may rely on session state: per-connection prepared statements are
+# disabled. Autocommit reads and explicit single transactions are both safe,
+# as are transaction-scoped features (SET LOCAL, named cursors iterated
+# before commit). The app does not use LISTEN/NOTIFY or session-level SET.
+DB_PGBOUNCER = os.getenv("DB_PGBOUNCER", "false").lower() in {"1", "true", "yes"}
+# Server-side PREPARE for hot queries, once per physical connection
+DB_USE_PREPARED = (
+    not DB_PGBOUNCER
+    and os.getenv("DB_USE_PREPARED", "true").lower() in {"1", "true", "yes"}
+)
+
+_pool = None
+_pool_lock = threading.Lock()
+_pool_slots = threading.BoundedSemaphore(DB_POOL_MAX)
+
+
+class PooledConnection(PgConnection):
+    """psycopg2 connection that remembers per-connection setup."""
+    vector_registered = False
+    prepared_statements = None
+
+
+def _get_pool():
+    """Create the process-wide connection pool on first use."""
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ThreadedConnectionPool(
+                    DB_POOL_MIN,
+                    DB_POOL_MAX,
+                    dbname=os.getenv("DB_NAME", "postgres"),
+                    user=os.getenv("DB_USER", "postgres"),
+                    password=os.getenv("DB_PASSWORD", "password"),
+                    host=os.getenv("DB_HOST", "localhost"),
+                    port=os.getenv("DB_PORT", "5432"),
+                    connection_factory=PooledConnection
+                )
+    return _pool
+
+
+def _prepare_connection(conn):
+    """One-time setup for a freshly opened pooled connection."""
+    if conn.vector_registered:
+        return
+    # Adapt NumPy embeddings to pgvector's `vector` type. Databases without
+    # the extension (e.g. chat-only setups) still get a usable connection.
+    try:
+        register_vector(conn)
+    except psycopg2.ProgrammingError:
+        pass
+    # End the type lookup's implicit transaction so callers can still
+    # change session settings such as autocommit.
+    conn.rollback()
+    conn.vector_registered = True
+    conn.prepared_statements = set()
+
+
+@contextmanager
+def get_db(autocommit=False):
+    """
+    Borrow a connection from the pool for the duration of a `with` block.
+
+    Uncommitted work is rolled back before the connection is returned, so
+    callers must commit explicitly. When every pooled connection is in use,
+    waits up to DB_POOL_TIMEOUT seconds for one to be returned.
+
+    Args:
+        autocommit: Run each statement on its own, without BEGIN/COMMIT
+            framing. Meant for read-only callers issuing single SELECTs.
+
+    Yields:
+        psycopg2 connection
+
+    Raises:
+        PoolError: No connection became free within DB_POOL_TIMEOUT
+    """
+    pool = _get_pool()
+    if not _pool_slots.acquire(timeout=DB_POOL_TIMEOUT):
+        raise PoolError(f"no database connection free after {DB_POOL_TIMEOUT:g}s")
+    try:
+        conn = pool.getconn()
+    except Exception:
+        _pool_slots.release()
+        raise
+    try:
+        _prepare_connection(conn)
+        if autocommit:
+            conn.autocommit = True
+        yield conn
+    finally:
+        discard = bool(conn.closed)
+        if not discard:
+            try:
+                conn.rollback()
+                if conn.autocommit:
+                    conn.autocommit = False
+            except psycopg2.Error:
+                discard = True
+        try:
+            pool.putconn(conn, close=discard)
+        finally:
+            _pool_slots.release()
+
+
+_PARAM_RE = re.compile(r"\$\d+")
+
+
+def execute_prepared(cursor, name, param_types, statement, params):
+    """
+    Run a statement through a named server-side prepared statement.
+
+    The statement is PREPAREd the first time a pooled connection sees it and
+    EXECUTEd afterwards, skipping parse/plan on every later call. When
+    prepared statements are disabled (DB_USE_PREPARED) it runs as a plain
+    query instead.
+
+    Args:
+        cursor: Cursor on a connection obtained from get_db()
+        name: Statement name, unique per statement text
+        param_types: Postgres types of $1..$n, e.g. ("uuid", "int")
+        statement: SQL using $1..$n placeholders
+        params: Parameter values
+    """
+    conn = cursor.connection
+    prepared = getattr(conn, "prepared_statements", None)
+    if not DB_USE_PREPARED or prepared is None:
+        cursor.execute(_PARAM_RE.sub("%s", statement), params)
+        return
+
+    if name not in prepared:
+        cursor.execute(f"PREPARE {name} ({', '.join(param_types)}) AS {statement}")
+        prepared.add(name)
+    cursor.execute(f"EXECUTE {name} ({', '.join(['%s'] * len(params))})", params)
@@ -0,0 +1,39 @@
+-- Migration: Store embeddings as half-precision vectors
+-- Description: Convert vector(3072) embedding columns to halfvec(3072) (2 bytes per
+--              dimension instead of 4) and add HNSW cosine indexes. Requires pgvector >= 0.7.
+-- Date: 2025-10-20
+-- Note: Plain vector HNSW indexes are limited to 2000 dimensions; halfvec allows 4000,
+--       so 3072-dim Gemini embeddings become indexable.
+
+CREATE EXTENSION IF NOT EXISTS vector;
+
+-- Convert shared tables and any existing per-session tables
+DO $$
+DECLARE
+    tbl TEXT;
+BEGIN
+    FOR tbl IN
+        SELECT c.relname
+        FROM pg_attribute a
+        JOIN pg_class c ON c.oid = a.attrelid
+        JOIN pg_namespace n ON n.oid = c.relnamespace
+        WHERE n.nspname = 'public'
+          AND c.relkind = 'r'
+          AND a.attname = 'embedding'
+          AND format_type(a.atttypid, a.atttypmod) = 'vector(3072)'
+          AND (c.relname IN ('documents', 'international_policy')
+               OR c.relname LIKE 'temp\_documents\_%'
+               OR c.relname LIKE 'analyze\_documents\_%')
+    LOOP
+        EXECUTE format(
+            'ALTER TABLE %I ALTER COLUMN embedding TYPE halfvec(3072) USING embedding::halfvec(3072)',
+            tbl
+        );
+    END LOOP;
+END $$;
+
+-- ANN index for the company corpus (session tables are small and scanned directly).
+-- international_policy is only searched filtered by policy; an HNSW index there would
+-- post-filter its candidates and miss small policies entirely (see 006).
+CREATE INDEX IF NOT EXISTS idx_documents_embedding_hnsw
+    ON documents USING hnsw (embedding halfvec_cosine_ops);
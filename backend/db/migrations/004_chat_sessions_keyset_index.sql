@@ -0,0 +1,8 @@
+-- Migration: Keyset pagination index for chat sessions
+-- Description: Composite index matching get_user_sessions' ORDER BY updated_at DESC, id DESC,
+--              covering the listed columns so pages are served by an index-only descent.
+-- Date: 2025-10-22
+
+CREATE INDEX IF NOT EXISTS idx_chat_history_sessions_user_updated
+    ON chat_history_sessions (user_id, updated_at DESC, id DESC)
+    INCLUDE (title, created_at);
@@ -0,0 +1,8 @@
+-- Migration: Server-generated chat message IDs
+-- Description: Let Postgres assign chat_history_messages.id with gen_random_uuid()
+--              instead of generating UUIDs in Python.
+-- Date: 2025-10-23
+
+CREATE EXTENSION IF NOT EXISTS pgcrypto;
+
+ALTER TABLE chat_history_messages ALTER COLUMN id SET DEFAULT gen_random_uuid();
@@ -0,0 +1,11 @@
+-- Migration: Exact nearest-neighbour search for international policies
+-- Description: Drop the HNSW index on international_policy created by earlier versions of 003.
+--              Every search there filters on policy, and HNSW applies the filter after its
+--              ef_search candidates (40 by default), so a policy under ~2.5% of rows could
+--              return no matches at all. A btree on policy keeps the exact scan cheap.
+-- Date: 2025-10-24
+
+DROP INDEX IF EXISTS idx_international_policy_embedding_hnsw;
+
+CREATE INDEX IF NOT EXISTS idx_international_policy_policy
+    ON international_policy (policy);
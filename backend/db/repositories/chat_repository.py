@@ -5,11 +5,121 @@ Handles all database operations for chat sessions and messages.
 Provides CRUD operations with proper error handling and type safety.
 """
 
-import json
+import os
+import threading
 import uuid
-from typing import Dict, List, Optional, Any
+from typing import Dict, Iterator, List, Optional, Any
 from datetime import datetime
-from db.connection import get_db
+import orjson
+from cachetools import TTLCache
+from psycopg2.extras import RealDictCursor
+from db.connection import execute_prepared, get_db
+
+# Hot session lookups (ownership checks run on every message). Entries are
+# dropped on title updates and deletes; the TTL bounds any other staleness.
+SESSION_CACHE_SIZE = int(os.getenv("SESSION_CACHE_SIZE", "10000"))
+SESSION_CACHE_TTL = int(os.getenv("SESSION_CACHE_TTL", "30"))
+
+_session_cache = TTLCache(maxsize=SESSION_CACHE_SIZE, ttl=SESSION_CACHE_TTL)
+_session_cache_lock = threading.Lock()
+
+
+def _invalidate_sessions(*session_ids: str) -> None:
+    """Drop sessions from the get_session cache."""
+    with _session_cache_lock:
+        for session_id in session_ids:
+            _session_cache.pop(str(session_id), None)
+
+
+# SQL is built once at import; methods reference these constants
+_Q_GET_OR_CREATE_SESSION = """
+    INSERT INTO chat_history_sessions (id, user_id, title, created_at, updated_at)
+    VALUES (%s, %s, %s, NOW(), NOW())
+    ON CONFLICT (id) DO UPDATE SET updated_at = chat_history_sessions.updated_at
+    RETURNING id, user_id, title, created_at, updated_at
+"""
+
+_Q_CREATE_SESSION = """
+    INSERT INTO chat_history_sessions (id, user_id, title, created_at, updated_at)
+    VALUES (%s, %s, %s, NOW(), NOW())
+    RETURNING id, user_id, title, created_at, updated_at
+"""
+
+_Q_GET_SESSION = """
+    SELECT id, user_id, title, created_at, updated_at
+    FROM chat_history_sessions
+    WHERE id = $1
+"""
+
+_Q_GET_USER_SESSIONS_AFTER = """
+    SELECT s.id::text AS id, s.user_id::text AS user_id, s.title,
+           to_char(s.created_at, 'YYYY-MM-DD"T"HH24:MI:SS.USTZH:TZM') AS created_at,
+           to_char(s.updated_at, 'YYYY-MM-DD"T"HH24:MI:SS.USTZH:TZM') AS updated_at
+    FROM chat_history_sessions s
+    WHERE s.user_id = $1 AND (s.updated_at, s.id) < ($2, $3)
+    ORDER BY s.updated_at DESC, s.id DESC
+    LIMIT $4
+"""
+
+_Q_GET_USER_SESSIONS = """
+    SELECT s.id::text AS id, s.user_id::text AS user_id, s.title,
+           to_char(s.created_at, 'YYYY-MM-DD"T"HH24:MI:SS.USTZH:TZM') AS created_at,
+           to_char(s.updated_at, 'YYYY-MM-DD"T"HH24:MI:SS.USTZH:TZM') AS updated_at
+    FROM chat_history_sessions s
+    WHERE s.user_id = $1
+    ORDER BY s.updated_at DESC, s.id DESC
+    LIMIT $2
+"""
+
+_Q_SAVE_MESSAGE = """
+    INSERT INTO chat_history_messages (session_id, role, content, metadata, created_at)
+    VALUES ($1, $2, $3, $4, NOW())
+    RETURNING id, session_id, role, content, metadata, created_at
+"""
+
+_Q_CREATE_SESSION_WITH_MESSAGES = """
+    WITH s AS (
+        INSERT INTO chat_history_sessions (id, user_id, title, created_at, updated_at)
+        VALUES (%s, %s, %s, NOW(), NOW())
+        ON CONFLICT (id) DO UPDATE SET updated_at = chat_history_sessions.updated_at
+        RETURNING id, user_id, title, created_at, updated_at
+    ), m AS (
+        INSERT INTO chat_history_messages (session_id, role, content, metadata, created_at)
+        SELECT s.id, v.role, v.content, v.metadata,
+               NOW() + v.ord * INTERVAL '1 microsecond'
+        FROM s, unnest(%s::text[], %s::text[], %s::jsonb[])
+             WITH ORDINALITY AS v(role, content, metadata, ord)
+        RETURNING id, session_id, role, content, metadata, created_at
+    )
+    SELECT s.id, s.user_id, s.title, s.created_at, s.updated_at,
+           m.id, m.session_id, m.role, m.content, m.metadata, m.created_at
+    FROM s LEFT JOIN m ON true
+    ORDER BY m.created_at
+"""
+
+_Q_GET_MESSAGES = """
+    SELECT m.id::text AS id, m.session_id::text AS session_id, m.role, m.content,
+           m.metadata, to_char(m.created_at, 'YYYY-MM-DD"T"HH24:MI:SS.USTZH:TZM') AS created_at
+    FROM chat_history_messages m
+    WHERE m.session_id = $1
+    ORDER BY m.created_at ASC
+"""
+
+_Q_ITER_MESSAGES = """
+    SELECT m.id::text AS id, m.session_id::text AS session_id, m.role, m.content,
+           m.metadata, to_char(m.created_at, 'YYYY-MM-DD"T"HH24:MI:SS.USTZH:TZM') AS created_at
+    FROM chat_history_messages m
+    WHERE m.session_id = %s
+    ORDER BY m.created_at ASC
+"""
+
+_Q_DELETE_SESSION = "DELETE FROM chat_history_sessions WHERE id = %s"
+
+_Q_UPDATE_SESSION_TITLE = """
+    UPDATE chat_history_sessions
+    SET title = %s, updated_at = NOW()
+    WHERE id = %s
+"""
 
 
 class ChatRepository:
@@ -36,13 +146,31 @@ class ChatRepository:
         Returns:
             Dict with session data (id, user_id, title, created_at, updated_at)
         """
-        session = self.get_session(session_id)
+        with get_db() as conn:
+            cursor = conn.cursor()
         
-        if not session:
-            # Create new session with frontend's UUID
-            session = self.create_session(session_id, user_id, title)
-        
-        return session
+            try:
+                # One round-trip: the no-op update makes RETURNING yield the
+                # existing row when the frontend's UUID is already taken
+                cursor.execute(_Q_GET_OR_CREATE_SESSION, (session_id, user_id, title))
+                result = cursor.fetchone()
+                conn.commit()
+            
+                if result:
+                    return {
+                        'id': str(result[0]),
+                        'user_id': str(result[1]),
+                        'title': result[2],
+                        'created_at': result[3].isoformat() if result[3] else None,
+                        'updated_at': result[4].isoformat() if result[4] else None
+                    }
+                return None
+            
+            except Exception as e:
+                conn.rollback()
+                raise Exception(f"Failed to get or create session: {str(e)}")
+            finally:
+                cursor.close()
     
     def create_session(
         self, 
@@ -61,35 +189,29 @@ class ChatRepository:
         Returns:
             Dict with created session data
         """
-        conn = get_db()
-        cursor = conn.cursor()
+        with get_db() as conn:
+            cursor = conn.cursor()
         
-        try:
-            query = """
-                INSERT INTO chat_history_sessions (id, user_id, title, created_at, updated_at)
-                VALUES (%s, %s, %s, NOW(), NOW())
-                RETURNING id, user_id, title, created_at, updated_at
-            """
-            cursor.execute(query, (session_id, user_id, title))
-            result = cursor.fetchone()
-            conn.commit()
+            try:
+                cursor.execute(_Q_CREATE_SESSION, (session_id, user_id, title))
+                result = cursor.fetchone()
+                conn.commit()
             
-            if result:
-                return {
-                    'id': str(result[0]),
-                    'user_id': str(result[1]),
-                    'title': result[2],
-                    'created_at': result[3].isoformat() if result[3] else None,
-                    'updated_at': result[4].isoformat() if result[4] else None
-                }
-            return None
+                if result:
+                    return {
+                        'id': str(result[0]),
+                        'user_id': str(result[1]),
+                        'title': result[2],
+                        'created_at': result[3].isoformat() if result[3] else None,
+                        'updated_at': result[4].isoformat() if result[4] else None
+                    }
+                return None
             
-        except Exception as e:
-            conn.rollback()
-            raise Exception(f"Failed to create session: {str(e)}")
-        finally:
-            cursor.close()
-            conn.close()
+            except Exception as e:
+                conn.rollback()
+                raise Exception(f"Failed to create session: {str(e)}")
+            finally:
+                cursor.close()
     
     def get_session(self, session_id: str) -> Optional[Dict[str, Any]]:
         """
@@ -101,80 +223,77 @@ class ChatRepository:
         Returns:
             Dict with session data or None if not found
         """
-        conn = get_db()
-        cursor = conn.cursor()
+        with _session_cache_lock:
+            cached = _session_cache.get(str(session_id))
+        if cached is not None:
+            return dict(cached)
+        
+        with get_db(autocommit=True) as conn:
+            cursor = conn.cursor()
         
-        try:
-            query = """
-                SELECT id, user_id, title, created_at, updated_at
-                FROM chat_history_sessions
-                WHERE id = %s
-            """
-            cursor.execute(query, (session_id,))
-            result = cursor.fetchone()
+            try:
+                execute_prepared(cursor, "chat_get_session", ("uuid",), _Q_GET_SESSION, (session_id,))
+                result = cursor.fetchone()
             
-            if result:
-                return {
-                    'id': str(result[0]),
-                    'user_id': str(result[1]),
-                    'title': result[2],
-                    'created_at': result[3].isoformat() if result[3] else None,
-                    'updated_at': result[4].isoformat() if result[4] else None
-                }
-            return None
+                if result:
+                    session = {
+                        'id': str(result[0]),
+                        'user_id': str(result[1]),
+                        'title': result[2],
+                        'created_at': result[3].isoformat() if result[3] else None,
+                        'updated_at': result[4].isoformat() if result[4] else None
+                    }
+                    with _session_cache_lock:
+                        _session_cache[str(session_id)] = session
+                    return dict(session)
+                return None
             
-        except Exception as e:
-            raise Exception(f"Failed to get session: {str(e)}")
-        finally:
-            cursor.close()
-            conn.close()
+            except Exception as e:
+                raise Exception(f"Failed to get session: {str(e)}")
+            finally:
+                cursor.close()
     
     def get_user_sessions(
         self, 
         user_id: str, 
-        limit: int = 50
+        limit: int = 50,
+        before_updated_at: Optional[str] = None,
+        before_id: Optional[str] = None
     ) -> List[Dict[str, Any]]:
         """
         Get all sessions for a user, ordered by most recent.
         
+        Pages are keyset-based: pass the updated_at and id of the last
+        session of the previous page to get the next one.
+        
         Args:
             user_id: User ID from JWT token
             limit: Maximum number of sessions to return (default: 50)
+            before_updated_at: updated_at (ISO string) of the previous page's last session
+            before_id: id of the previous page's last session
             
         Returns:
             List of session dicts
         """
-        conn = get_db()
-        cursor = conn.cursor()
+        with get_db(autocommit=True) as conn:
+            # Rows come back as dicts with ISO timestamps rendered server-side
+            cursor = conn.cursor(cursor_factory=RealDictCursor)
         
-        try:
-            query = """
-                SELECT id, user_id, title, created_at, updated_at
-                FROM chat_history_sessions
-                WHERE user_id = %s
-                ORDER BY updated_at DESC
-                LIMIT %s
-            """
-            cursor.execute(query, (user_id, limit))
-            results = cursor.fetchall()
+            try:
+                if before_updated_at and before_id:
+                    execute_prepared(
+                        cursor, "chat_get_user_sessions_after",
+                        ("uuid", "timestamptz", "uuid", "int"),
+                        _Q_GET_USER_SESSIONS_AFTER, (user_id, before_updated_at, before_id, limit)
+                    )
+                else:
+                    execute_prepared(cursor, "chat_get_user_sessions", ("uuid", "int"), _Q_GET_USER_SESSIONS, (user_id, limit))
+                return cursor.fetchall()
             
-            sessions = []
-            for result in results:
-                sessions.append({
-                    'id': str(result[0]),
-                    'user_id': str(result[1]),
-                    'title': result[2],
-                    'created_at': result[3].isoformat() if result[3] else None,
-                    'updated_at': result[4].isoformat() if result[4] else None
-                })
-            
-            return sessions
-            
-        except Exception as e:
-            raise Exception(f"Failed to get user sessions: {str(e)}")
-        finally:
-            cursor.close()
-            conn.close()
+            except Exception as e:
+                raise Exception(f"Failed to get user sessions: {str(e)}")
+            finally:
+                cursor.close()
     
     def save_message(
         self,
@@ -195,46 +314,108 @@ class ChatRepository:
         Returns:
             Dict with created message data
         """
-        conn = get_db()
-        cursor = conn.cursor()
+        with get_db() as conn:
+            cursor = conn.cursor()
         
-        try:
-            message_id = str(uuid.uuid4())
+            try:
+                # Convert metadata to JSON string for PostgreSQL JSONB column
+                # If metadata is None or empty dict, store NULL
+                if metadata:
+                    metadata_json = orjson.dumps(metadata).decode()
+                else:
+                    metadata_json = None
+            
+                execute_prepared(
+                    cursor, "chat_save_message",
+                    ("uuid", "varchar", "text", "jsonb"),
+                    _Q_SAVE_MESSAGE, (session_id, role, content, metadata_json)
+                )
+                result = cursor.fetchone()
+                conn.commit()
             
-            # Convert metadata to JSON string for PostgreSQL JSONB column
-            # If metadata is None or empty dict, store NULL
-            if metadata:
-                metadata_json = json.dumps(metadata)
-            else:
-                metadata_json = None
+                if result:
+                    # psycopg2 returns JSONB as dict, no need to parse
+                    return {
+                        'id': str(result[0]),
+                        'session_id': str(result[1]),
+                        'role': result[2],
+                        'content': result[3],
+                        'metadata': result[4] if result[4] else None,
+                        'created_at': result[5].isoformat() if result[5] else None
+                    }
+                return None
             
-            query = """
-                INSERT INTO chat_history_messages (id, session_id, role, content, metadata, created_at)
-                VALUES (%s, %s, %s, %s, %s::jsonb, NOW())
-                RETURNING id, session_id, role, content, metadata, created_at
-            """
-            cursor.execute(query, (message_id, session_id, role, content, metadata_json))
-            result = cursor.fetchone()
-            conn.commit()
+            except Exception as e:
+                conn.rollback()
+                raise Exception(f"Failed to save message: {str(e)}")
+            finally:
+                cursor.close()
+    
+    def create_session_with_messages(
+        self,
+        session_id: str,
+        user_id: str,
+        title: str,
+        messages: List[Dict[str, Any]]
+    ) -> Dict[str, Any]:
+        """
+        Get or create a session and save messages to it in one round-trip.
+        
+        A writable CTE upserts the session (like get_or_create_session) and
+        inserts all the messages in a single statement.
+        
+        Args:
+            session_id: UUID string from frontend
+            user_id: User ID from JWT token
+            title: Title used if the session is created
+            messages: Dicts with 'role', 'content' and optional 'metadata'
             
-            if result:
-                # psycopg2 returns JSONB as dict, no need to parse
-                return {
-                    'id': str(result[0]),
-                    'session_id': str(result[1]),
-                    'role': result[2],
-                    'content': result[3],
-                    'metadata': result[4] if result[4] else None,
-                    'created_at': result[5].isoformat() if result[5] else None
+        Returns:
+            Dict with 'session' (session dict) and 'messages' (created message
+            dicts, in input order)
+        """
+        with get_db() as conn:
+            cursor = conn.cursor()
+        
+            try:
+                cursor.execute(_Q_CREATE_SESSION_WITH_MESSAGES, (
+                    session_id, user_id, title,
+                    [message['role'] for message in messages],
+                    [message['content'] for message in messages],
+                    [
+                        orjson.dumps(message['metadata']).decode() if message.get('metadata') else None
+                        for message in messages
+                    ]
+                ))
+                results = cursor.fetchall()
+                conn.commit()
+                
+                first = results[0]
+                session = {
+                    'id': str(first[0]),
+                    'user_id': str(first[1]),
+                    'title': first[2],
+                    'created_at': first[3].isoformat() if first[3] else None,
+                    'updated_at': first[4].isoformat() if first[4] else None
                 }
-            return None
+                saved = [
+                    {
+                        'id': str(result[5]),
+                        'session_id': str(result[6]),
+                        'role': result[7],
+                        'content': result[8],
+                        'metadata': result[9] if result[9] else None,
+                        'created_at': result[10].isoformat() if result[10] else None
+                    }
+                    for result in results if result[5] is not None
+                ]
+                return {'session': session, 'messages': saved}
             
-        except Exception as e:
-            conn.rollback()
-            raise Exception(f"Failed to save message: {str(e)}")
-        finally:
-            cursor.close()
-            conn.close()
+            except Exception as e:
+                conn.rollback()
+                raise Exception(f"Failed to create session with messages: {str(e)}")
+            finally:
+                cursor.close()
     
     def get_messages(self, session_id: str) -> List[Dict[str, Any]]:
         """
@@ -246,38 +427,47 @@ class ChatRepository:
         Returns:
             List of message dicts
         """
-        conn = get_db()
-        cursor = conn.cursor()
+        with get_db(autocommit=True) as conn:
+            # psycopg2 returns JSONB as dict and RealDictCursor builds the rows
+            cursor = conn.cursor(cursor_factory=RealDictCursor)
         
-        try:
-            query = """
-                SELECT id, session_id, role, content, metadata, created_at
-                FROM chat_history_messages
-                WHERE session_id = %s
-                ORDER BY created_at ASC
-            """
-            cursor.execute(query, (session_id,))
-            results = cursor.fetchall()
+            try:
+                execute_prepared(cursor, "chat_get_messages", ("uuid",), _Q_GET_MESSAGES, (session_id,))
+                return cursor.fetchall()
             
-            messages = []
-            for result in results:
-                # psycopg2 returns JSONB as dict, no need to parse
-                messages.append({
-                    'id': str(result[0]),
-                    'session_id': str(result[1]),
-                    'role': result[2],
-                    'content': result[3],
-                    'metadata': result[4] if result[4] else None,
-                    'created_at': result[5].isoformat() if result[5] else None
-                })
+            except Exception as e:
+                raise Exception(f"Failed to get messages: {str(e)}")
+            finally:
+                cursor.close()
+    
+    def iter_messages(self, session_id: str, itersize: int = 500) -> Iterator[Dict[str, Any]]:
+        """
+        Lazily yield a session's messages, ordered chronologically.
+        
+        Rows are pulled through a server-side cursor `itersize` at a time, so
+        long histories are never fully materialized in memory. The pooled
+        connection is held until the iterator is exhausted or closed.
+        
+        Args:
+            session_id: Session UUID string
+            itersize: Rows fetched per round-trip (default: 500)
             
-            return messages
+        Yields:
+            Message dicts, same shape as get_messages
+        """
+        with get_db() as conn:
+            # Named cursors live inside a transaction, so no autocommit here
+            cursor = conn.cursor(name=f"msgs_{uuid.uuid4().hex}", cursor_factory=RealDictCursor)
+            cursor.itersize = itersize
+        
+            try:
+                cursor.execute(_Q_ITER_MESSAGES, (session_id,))
+                yield from cursor
             
-        except Exception as e:
-            raise Exception(f"Failed to get messages: {str(e)}")
-        finally:
-            cursor.close()
-            conn.close()
+            except Exception as e:
+                raise Exception(f"Failed to stream messages: {str(e)}")
+            finally:
+                cursor.close()
     
     def delete_session(self, session_id: str) -> bool:
         """
@@ -289,21 +479,20 @@ class ChatRepository:
         Returns:
             True if successful
         """
-        conn = get_db()
-        cursor = conn.cursor()
+        with get_db() as conn:
+            cursor = conn.cursor()
         
-        try:
-            query = "DELETE FROM chat_history_sessions WHERE id = %s"
-            cursor.execute(query, (session_id,))
-            conn.commit()
-            return True
+            try:
+                cursor.execute(_Q_DELETE_SESSION, (session_id,))
+                conn.commit()
+                _invalidate_sessions(session_id)
+                return True
             
-        except Exception as e:
-            conn.rollback()
-            raise Exception(f"Failed to delete session: {str(e)}")
-        finally:
-            cursor.close()
-            conn.close()
+            except Exception as e:
+                conn.rollback()
+                raise Exception(f"Failed to delete session: {str(e)}")
+            finally:
+                cursor.close()
     
     def update_session_title(self, session_id: str, title: str) -> bool:
         """
@@ -316,22 +505,17 @@ class ChatRepository:
         Returns:
             True if successful
         """
-        conn = get_db()
-        cursor = conn.cursor()
+        with get_db() as conn:
+            cursor = conn.cursor()
         
-        try:
-            query = """
-                UPDATE chat_history_sessions 
-                SET title = %s, updated_at = NOW() 
-                WHERE id = %s
-            """
-            cursor.execute(query, (title, session_id))
-            conn.commit()
-            return True
+            try:
+                cursor.execute(_Q_UPDATE_SESSION_TITLE, (title, session_id))
+                conn.commit()
+                _invalidate_sessions(session_id)
+                return True
             
-        except Exception as e:
-            conn.rollback()
-            raise Exception(f"Failed to update session title: {str(e)}")
-        finally:
-            cursor.close()
-            conn.close()
+            except Exception as e:
+                conn.rollback()
+                raise Exception(f"Failed to update session title: {str(e)}")
+            finally:
+                cursor.close()
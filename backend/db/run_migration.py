@@ -21,13 +21,12 @@ def test_connection():
     """Test database connection before running migrations."""
     print("🔍 Testing database connection...")
     try:
-        conn = get_db()
-        cursor = conn.cursor()
-        cursor.execute("SELECT version();")
-        version = cursor.fetchone()[0]
-        print(f"✅ Connected to PostgreSQL: {version[:50]}...")
-        cursor.close()
-        conn.close()
+        with get_db() as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT version();")
+            version = cursor.fetchone()[0]
+            print(f"✅ Connected to PostgreSQL: {version[:50]}...")
+            cursor.close()
         return True
     except Exception as e:
         print(f"❌ Database connection failed: {e}")
@@ -44,15 +43,14 @@ def run_migration(migration_file: str):
             sql = f.read()
         
         # Execute migration
-        conn = get_db()
-        cursor = conn.cursor()
-        cursor.execute(sql)
-        conn.commit()
+        with get_db() as conn:
+            cursor = conn.cursor()
+            cursor.execute(sql)
+            conn.commit()
         
-        print(f"✅ Migration completed: {migration_file}")
+            print(f"✅ Migration completed: {migration_file}")
         
-        cursor.close()
-        conn.close()
+            cursor.close()
         return True
         
     except Exception as e:
@@ -64,59 +62,45 @@ def verify_tables():
     print("\n🔍 Verifying tables...")
     
     try:
-        conn = get_db()
-        cursor = conn.cursor()
+        with get_db() as conn:
+            cursor = conn.cursor()
         
-        # Check chat_history_sessions table
-        cursor.execute("""
-            SELECT table_name, column_name, data_type 
-            FROM information_schema.columns 
-            WHERE table_name = 'chat_history_sessions'
-            ORDER BY ordinal_position;
-        """)
-        sessions_columns = cursor.fetchall()
+            # Columns and indexes of both chat tables in a single round-trip
+            cursor.execute("""
+                SELECT 'col' AS kind, table_name::text, column_name::text, data_type::text, ordinal_position::int
+                FROM information_schema.columns 
+                WHERE table_name IN ('chat_history_sessions', 'chat_history_messages')
+                UNION ALL
+                SELECT 'idx', tablename::text, indexname::text, NULL, 0
+                FROM pg_indexes 
+                WHERE tablename IN ('chat_history_sessions', 'chat_history_messages')
+                ORDER BY 1, 2, 5, 3;
+            """)
+            rows = cursor.fetchall()
+            cursor.close()
         
-        if sessions_columns:
-            print("\n✅ Table 'chat_history_sessions' created with columns:")
-            for table, column, dtype in sessions_columns:
-                print(f"   - {column}: {dtype}")
-        else:
-            print("❌ Table 'chat_history_sessions' not found")
-            return False
+        columns = {}
+        indexes = []
+        for kind, table, name, dtype, _ in rows:
+            if kind == 'col':
+                columns.setdefault(table, []).append((name, dtype))
+            else:
+                indexes.append(name)
         
-        # Check chat_history_messages table
-        cursor.execute("""
-            SELECT table_name, column_name, data_type 
-            FROM information_schema.columns 
-            WHERE table_name = 'chat_history_messages'
-            ORDER BY ordinal_position;
-        """)
-        messages_columns = cursor.fetchall()
-        
-        if messages_columns:
-            print("\n✅ Table 'chat_history_messages' created with columns:")
-            for table, column, dtype in messages_columns:
-                print(f"   - {column}: {dtype}")
-        else:
-            print("❌ Table 'chat_history_messages' not found")
-            return False
-        
-        # Check indexes
-        cursor.execute("""
-            SELECT indexname 
-            FROM pg_indexes 
-            WHERE tablename IN ('chat_history_sessions', 'chat_history_messages')
-            ORDER BY indexname;
-        """)
-        indexes = cursor.fetchall()
+        for table in ('chat_history_sessions', 'chat_history_messages'):
+            if columns.get(table):
+                print(f"\n✅ Table '{table}' created with columns:")
+                for column, dtype in columns[table]:
+                    print(f"   - {column}: {dtype}")
+            else:
+                print(f"❌ Table '{table}' not found")
+                return False
         
         if indexes:
             print("\n✅ Indexes created:")
-            for (idx_name,) in indexes:
+            for idx_name in sorted(indexes):
                 print(f"   - {idx_name}")
         
-        cursor.close()
-        conn.close()
         return True
         
     except Exception as e:
@@ -140,10 +124,16 @@ def main():
         print("  - DB_PORT")
         sys.exit(1)
     
-    # Step 2: Run migration
-    if not run_migration("002_create_chat_history_tables.sql"):
-        print("\n❌ Migration failed")
-        sys.exit(1)
+    # Step 2: Run migrations
+    for migration_file in (
+        "002_create_chat_history_tables.sql",
+        "003_halfvec_embeddings.sql",
+        "004_chat_sessions_keyset_index.sql",
+        "005_message_id_default.sql",
+    ):
+        if not run_migration(migration_file):
+            print("\n❌ Migration failed")
+            sys.exit(1)
     
     # Step 3: Verify tables
     if not verify_tables():
@@ -0,0 +1,362 @@
+import io
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from psycopg2 import sql
+from psycopg2.extras import execute_values
+from db.connection import DB_POOL_MAX, get_db
+
+INSERT_PAGE_SIZE = 500
+
+# Embeddings are stored at half precision (see migrations/003); query vectors
+# are cast to the same type so the HNSW halfvec_cosine_ops index is used.
+EMBEDDING_TYPE = "halfvec"
+
+# Rebuilding an ANN index scans the whole table, so it only pays off when the
+# load is large relative to what is already indexed.
+INDEX_REBUILD_MIN_ROWS = int(os.getenv("VECTOR_INDEX_REBUILD_MIN_ROWS", "1000"))
+
+# Multi-embedding searches are split across this many pooled connections,
+# capped so that a single search never holds more than a quarter of the pool
+KNN_PARALLELISM = int(os.getenv("KNN_PARALLELISM", "4"))
+KNN_MIN_SHARD_SIZE = 8
+KNN_MAX_SHARDS = max(1, DB_POOL_MAX // 4)
+
+
+def session_table_name(prefix, session_id):
+    """
+    Build the per-session table name, e.g. temp_documents_<session>.
+
+    Names are lower-cased so the quoted identifier matches tables created
+    unquoted (which Postgres folds to lower case).
+    """
+    name = f"{prefix}_{session_id}".lower()
+    if not name.replace("_", "").isalnum():
+        raise ValueError(f"Invalid session id for table name: {session_id!r}")
+    return name
+
+
+def _table_sql(table):
+    """Quote a table name, passing already-composed SQL through."""
+    return table if isinstance(table, sql.Composable) else sql.Identifier(table)
+
+
+def _columns_sql(columns):
+    return sql.SQL(", ").join(sql.Identifier(column) for column in columns)
+
+
+def create_session_table(cur, table):
+    """Create a per-session chunk table if it does not exist yet."""
+    cur.execute(sql.SQL("""
+        CREATE TABLE IF NOT EXISTS {} (
+            id UUID PRIMARY KEY,
+            content TEXT,
+            embedding {}(3072)
+        )
+    """).format(_table_sql(table), sql.SQL(EMBEDDING_TYPE)))
+
+
+def to_vector_literal(embedding):
+    """Serialize an embedding in pgvector's text format: [v1,v2,...]"""
+    return "[" + ",".join(map(str, np.asarray(embedding, dtype=np.float32).tolist())) + "]"
+
+
+def _copy_escape(value):
+    """Escape a text value for COPY ... FROM STDIN (text format)."""
+    return (
+        value.replace("\\", "\\\\")
+        .replace("\t", "\\t")
+        .replace("\n", "\\n")
+        .replace("\r", "\\r")
+    )
+
+
+def begin_bulk_load(cur):
+    """
+    Relax durability for the current transaction only. A crash can lose the
+    last few commits but never corrupts data, which is acceptable for
+    re-runnable document ingestion.
+    """
+    cur.execute("SET LOCAL synchronous_commit = off")
+
+
+def insert_embeddings(cur, table, columns, rows, page_size=INSERT_PAGE_SIZE):
+    """
+    Insert many rows in one multi-row INSERT per page.
+
+    Args:
+        cur: Open psycopg2 cursor
+        table: Target table name
+        columns: Column names; the embedding must be the third column
+        rows: Sequence of tuples matching ``columns``
+
+    Returns:
+        Number of rows inserted
+    """
+    placeholders = ["%s"] * len(columns)
+    placeholders[2] = f"%s::{EMBEDDING_TYPE}"
+    template = "(" + ",".join(placeholders) + ")"
+    query = sql.SQL("INSERT INTO {} ({}) VALUES %s").format(_table_sql(table), _columns_sql(columns))
+    execute_values(
+        cur,
+        query.as_string(cur),
+        rows,
+        template=template,
+        page_size=page_size
+    )
+    return len(rows)
+
+
+def copy_embeddings(cur, table, columns, rows):
+    """
+    Bulk-load rows with COPY FROM STDIN. Faster than INSERT for append-only
+    loads; the embedding (third column) is sent in pgvector's text format.
+
+    Args:
+        cur: Open psycopg2 cursor
+        table: Target table name
+        columns: Column names; the embedding must be the third column
+        rows: Sequence of tuples matching ``columns``
+
+    Returns:
+        Number of rows copied
+    """
+    buf = io.StringIO()
+    for row in rows:
+        fields = []
+        for index, value in enumerate(row):
+            if index == 2:
+                fields.append(to_vector_literal(value))
+            else:
+                fields.append(_copy_escape(str(value)))
+        buf.write("\t".join(fields))
+        buf.write("\n")
+    buf.seek(0)
+    query = sql.SQL("COPY {} ({}) FROM STDIN").format(_table_sql(table), _columns_sql(columns))
+    cur.copy_expert(query.as_string(cur), buf)
+    return len(rows)
+
+
+def drop_vector_indexes(cur, table):
+    """
+    Drop the ANN (hnsw / ivfflat) indexes on a table before a bulk load.
+
+    Args:
+        cur: Open psycopg2 cursor (inside the load transaction)
+        table: Table name in the public schema
+
+    Returns:
+        List of (index_name, index_definition) to pass to restore_vector_indexes
+    """
+    cur.execute(
+        """
+        SELECT indexname, indexdef FROM pg_indexes
+        WHERE schemaname = 'public' AND tablename = %s
+          AND (indexdef ILIKE '%%USING hnsw%%' OR indexdef ILIKE '%%USING ivfflat%%')
+        """,
+        (table,)
+    )
+    indexes = cur.fetchall()
+    for index_name, _ in indexes:
+        cur.execute(sql.SQL("DROP INDEX IF EXISTS {}").format(sql.Identifier(index_name)))
+    return indexes
+
+
+def restore_vector_indexes(cur, indexes):
+    """Recreate indexes previously removed by drop_vector_indexes."""
+    for _, index_definition in indexes:
+        cur.execute(index_definition)
+
+
+def knn_search_many(cur, table, embeddings, top_k, filters=None):
+    """
+    Run one nearest-neighbour search per embedding in a single statement,
+    using a LATERAL join over a VALUES list of query vectors.
+
+    Args:
+        cur: Open psycopg2 cursor
+        table: Table to search
+        embeddings: Query vectors
+        top_k: Neighbours to return per query vector
+        filters: Optional {column: value} equality filters applied to every search
+
+    Returns:
+        Dict mapping each embedding's index to a list of
+        {"id", "content", "distance"} dicts, nearest first
+    """
+    results = {idx: [] for idx in range(len(embeddings))}
+    if not embeddings:
+        return results
+
+    filters = filters or {}
+    columns = list(filters)
+    # Filter values ride along in each VALUES row so they stay parameterized
+    where = sql.SQL("")
+    if columns:
+        where = sql.SQL("WHERE ") + sql.SQL(" AND ").join(
+            sql.SQL("{} = q.{}").format(sql.Identifier(column), sql.Identifier(column))
+            for column in columns
+        )
+    query = sql.SQL("""
+        SELECT q.idx, d.id, d.content, d.distance
+        FROM (VALUES %s) AS q({values_columns})
+        CROSS JOIN LATERAL (
+            SELECT id, content, embedding <=> q.vec AS distance
+            FROM {table}
+            {where}
+            ORDER BY distance
+            LIMIT {limit}
+        ) d
+        ORDER BY q.idx, d.distance
+    """).format(
+        values_columns=sql.SQL(", ").join(
+            [sql.Identifier("idx"), sql.Identifier("vec")] + [sql.Identifier(c) for c in columns]
+        ),
+        table=_table_sql(table),
+        where=where,
+        limit=sql.Literal(int(top_k))
+    )
+    template = f"(%s, %s::{EMBEDDING_TYPE}" + ", %s" * len(columns) + ")"
+    filter_values = tuple(filters[column] for column in columns)
+    rows = execute_values(
+        cur,
+        query.as_string(cur),
+        [(idx, embedding) + filter_values for idx, embedding in enumerate(embeddings)],
+        template=template,
+        page_size=INSERT_PAGE_SIZE,
+        fetch=True
+    )
+
+    for idx, doc_id, content, distance in rows:
+        results[idx].append({"id": doc_id, "content": content, "distance": distance})
+    return results
+
+
+def parallel_knn_search(table, embeddings, top_k, filters=None, workers=KNN_PARALLELISM):
+    """
+    knn_search_many sharded across pooled connections and run concurrently.
+
+    Small inputs use a single connection; larger ones are split into at most
+    ``workers`` contiguous shards of at least KNN_MIN_SHARD_SIZE embeddings.
+
+    Returns:
+        Same shape as knn_search_many, keyed by the original embedding index
+    """
+    embeddings = list(embeddings)
+    shard_count = max(1, min(workers, KNN_MAX_SHARDS, len(embeddings) // KNN_MIN_SHARD_SIZE))
+    shard_size = -(-len(embeddings) // shard_count) if embeddings else 0
+
+    def search(offset):
+        shard = embeddings[offset:offset + shard_size]
+        with get_db(autocommit=True) as conn:
+            with conn.cursor() as cur:
+                found = knn_search_many(cur, table, shard, top_k, filters)
+        return {offset + idx: chunks for idx, chunks in found.items()}
+
+    if shard_count == 1:
+        return search(0) if embeddings else {}
+
+    results = {}
+    with ThreadPoolExecutor(max_workers=shard_count) as executor:
+        for shard_results in executor.map(search, range(0, len(embeddings), shard_size)):
+            results.update(shard_results)
+    return results
+
+
+def knn_search_sources(cur, sources, embeddings, top_k):
+    """
+    Like knn_search_many, but searches several tables (or filtered slices of
+    one table) in a single statement: one LATERAL search per source, joined
+    with UNION ALL over a shared VALUES list of query vectors.
+
+    Args:
+        cur: Open psycopg2 cursor
+        sources: List of (table, filters) pairs; filters is an optional
+            {column: value} equality filter for that source
+        embeddings: Query vectors
+        top_k: Neighbours to return per query vector and source
+
+    Returns:
+        One dict per source, in order, shaped like knn_search_many's result
+    """
+    results = [{idx: [] for idx in range(len(embeddings))} for _ in sources]
+    if not embeddings or not sources:
+        return results
+
+    searches = []
+    for position, (table, filters) in enumerate(sources):
+        where = sql.SQL("")
+        if filters:
+            # execute_values allows a single placeholder, so filter values
+            # are inlined as quoted literals
+            where = sql.SQL("WHERE ") + sql.SQL(" AND ").join(
+                sql.SQL("{} = {}").format(sql.Identifier(column), sql.Literal(value))
+                for column, value in filters.items()
+            )
+        searches.append(sql.SQL("""
+            SELECT {position} AS src, q.idx, d.id, d.content, d.distance
+            FROM q
+            CROSS JOIN LATERAL (
+                SELECT id, content, embedding <=> q.vec AS distance
+                FROM {table}
+                {where}
+                ORDER BY distance
+                LIMIT {limit}
+            ) d
+        """).format(
+            position=sql.Literal(position),
+            table=_table_sql(table),
+            where=where,
+            limit=sql.Literal(int(top_k))
+        ))
+    query = (
+        sql.SQL("WITH q(idx, vec) AS (VALUES %s) ")
+        + sql.SQL(" UNION ALL ").join(searches)
+        + sql.SQL(" ORDER BY src, idx, distance")
+    )
+    rows = execute_values(
+        cur,
+        query.as_string(cur),
+        list(enumerate(embeddings)),
+        template=f"(%s, %s::{EMBEDDING_TYPE})",
+        page_size=INSERT_PAGE_SIZE,
+        fetch=True
+    )
+
+    for position, idx, doc_id, content, distance in rows:
+        results[position][idx].append({"id": doc_id, "content": content, "distance": distance})
+    return results
+
+
+def parallel_knn_search_sources(sources, embeddings, top_k, workers=KNN_PARALLELISM):
+    """
+    knn_search_sources sharded across pooled connections, like
+    parallel_knn_search.
+
+    Returns:
+        Same shape as knn_search_sources, keyed by the original embedding index
+    """
+    embeddings = list(embeddings)
+    shard_count = max(1, min(workers, KNN_MAX_SHARDS, len(embeddings) // KNN_MIN_SHARD_SIZE))
+    shard_size = -(-len(embeddings) // shard_count) if embeddings else 0
+
+    def search(offset):
+        shard = embeddings[offset:offset + shard_size]
+        with get_db(autocommit=True) as conn:
+            with conn.cursor() as cur:
+                found = knn_search_sources(cur, sources, shard, top_k)
+        return [
+            {offset + idx: chunks for idx, chunks in per_source.items()}
+            for per_source in found
+        ]
+
+    if shard_count == 1:
+        return search(0) if embeddings else [{} for _ in sources]
+
+    results = [{} for _ in sources]
+    with ThreadPoolExecutor(max_workers=shard_count) as executor:
+        for shard_results in executor.map(search, range(0, len(embeddings), shard_size)):
+            for merged, per_source in zip(results, shard_results):
+                merged.update(per_source)
+    return results
@@ -6,12 +6,65 @@ Provides decorators for JWT authentication and role-based access control.
 
 from functools import wraps
 from flask import request, jsonify, g
+from cachetools import TTLCache
+import hashlib
 import jwt
+import logging
 import os
+import threading
+import time
 from dotenv import load_dotenv
 
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
+# Verification settings are fixed for the process lifetime
+_JWT_SECRET = os.getenv('SUPABASE_JWT_SECRET')
+_JWT_ALGS = ('HS256',)
+_JWT_AUD = 'authenticated'
+_jwt_decoder = jwt.PyJWT()
+
+# Decoded claims per token, so a token re-sent on every request is only
+# verified once. Kept in-process (per worker) and never shared.
+JWT_CACHE_SIZE = int(os.getenv("JWT_CACHE_SIZE", "10000"))
+JWT_CACHE_TTL = int(os.getenv("JWT_CACHE_TTL", "60"))
+# Stop serving a cached decode this many seconds before the token expires
+JWT_EXPIRY_LEEWAY = 5
+
+# Role hierarchy: user < analyst < admin
+_ROLE_LEVEL = {
+    'user': 0,
+    'analyst': 1,
+    'admin': 2
+}
+
+_jwt_cache = TTLCache(maxsize=JWT_CACHE_SIZE, ttl=JWT_CACHE_TTL)
+_jwt_cache_lock = threading.Lock()
+
+
+def _decode_token(token):
+    """Verify a JWT, reusing the decoded claims of a recently seen token."""
+    key = hashlib.sha256(token.encode()).digest()
+    with _jwt_cache_lock:
+        cached = _jwt_cache.get(key)
+    # The signature and claims were fully checked when the entry was cached
+    if cached is not None and cached[1] > time.time() + JWT_EXPIRY_LEEWAY:
+        return cached[0]
+
+    # Decode JWT token using Supabase JWT secret
+    decoded = _jwt_decoder.decode(
+        token,
+        _JWT_SECRET,
+        algorithms=_JWT_ALGS,
+        audience=_JWT_AUD,
+        options={"require": ["exp", "sub"]}
+    )
+    with _jwt_cache_lock:
+        _jwt_cache[key] = (decoded, decoded['exp'])
+    return decoded
+
+
 def require_auth(f):
     """
     Decorator that validates JWT token and extracts user information.
@@ -33,11 +86,12 @@ def require_auth(f):
     """
     @wraps(f)
     def decorated_function(*args, **kwargs):
-        auth_header = request.headers.get('Authorization')
-        
+        # CORS preflights carry no credentials; answer before any auth work
         if request.method == "OPTIONS":
             return jsonify({"status": "ok"}), 200
         
+        auth_header = request.headers.get('Authorization')
+        
         if not auth_header:
             return jsonify({
                 'error': 'No authorization header',
@@ -55,13 +109,7 @@ def require_auth(f):
             
             token = parts[1]
             
-            # Decode JWT token using Supabase JWT secret
-            decoded = jwt.decode(
-                token,
-                os.getenv('SUPABASE_JWT_SECRET'),
-                algorithms=['HS256'],
-                audience='authenticated'
-            )
+            decoded = _decode_token(token)
             
             # Extract user information from token
             g.user_id = decoded.get('sub')  # Subject = User ID
@@ -72,8 +120,8 @@ def require_auth(f):
             app_metadata = decoded.get('app_metadata', {})
             g.user_role = user_metadata.get('role') or app_metadata.get('role') or 'user'
             
-            # Log for debugging
-            print(f"[AUTH] User authenticated: {g.user_id} ({g.user_email}) - Role: {g.user_role}")
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug("User authenticated: %s (%s) - Role: %s", g.user_id, g.user_email, g.user_role)
             
             return f(*args, **kwargs)
             
@@ -88,7 +136,7 @@ def require_auth(f):
                 'message': f'Token validation failed: {str(e)}'
             }), 401
         except Exception as e:
-            print(f"[AUTH ERROR] {str(e)}")
+            logger.error("Authentication error: %s", e)
             return jsonify({
                 'error': 'Authentication failed',
                 'message': 'Unable to authenticate request'
@@ -111,22 +159,14 @@ def require_role(required_role):
         def admin_route():
             return jsonify({'message': 'Admin access granted'})
     """
+    required_level = _ROLE_LEVEL.get(required_role, 0)
+
     def decorator(f):
         @wraps(f)
         def decorated_function(*args, **kwargs):
             user_role = getattr(g, 'user_role', 'user')
             
-            # Define role hierarchy
-            role_hierarchy = {
-                'user': 0,
-                'analyst': 1,
-                'admin': 2
-            }
-            
-            user_level = role_hierarchy.get(user_role, 0)
-            required_level = role_hierarchy.get(required_role, 0)
-            
-            if user_level < required_level:
+            if _ROLE_LEVEL.get(user_role, 0) < required_level:
                 return jsonify({
                     'error': 'Insufficient permissions',
                     'message': f'This action requires {required_role} role or higher',
@@ -1,12 +1,34 @@
-import os
-import json
-from typing import Dict, Any, List, Optional
+import sys
+import logging
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Dict, Any, Iterator, Optional
+
+import orjson
+
+logger = logging.getLogger(__name__)
+
+# Event types seen on every event; incoming names are interned to match by identity
+EV_STREAM = sys.intern("on_chat_model_stream")
+EV_END = sys.intern("on_chat_model_end")
+EV_START = sys.intern("on_chain_start")
+EV_STOP = sys.intern("on_chain_end")
+
+# Stage message templates taking a single count
+MSG_HISTORY_FETCHED = sys.intern("Fetched %d messages from history")
+MSG_POLICY_CHUNKS = sys.intern("Retrieved %d policy chunks")
+MSG_DOC_CHUNKS = sys.intern("Retrieved %d document chunks")
 
 
 def _truncate(text, limit=140):
     """Truncate text to a specified limit."""
     if text is None:
         return ""
+    # Common case: a short str is returned as-is, without copying
+    if type(text) is str:
+        if len(text) <= limit:
+            return text
+        return text[: limit - 1].rstrip() + "…"
     text = str(text)
     return text if len(text) <= limit else text[: limit - 1].rstrip() + "…"
 
@@ -18,25 +40,29 @@ def _safe_session(value: str) -> str:
 
 def _extract_text(blob):
     """Extract text content from various data structures."""
-    if blob is None:
-        return ""
-    if isinstance(blob, str):
-        return blob
-    if isinstance(blob, dict):
-        for key in ("content", "text", "response"):
-            if key in blob:
-                return _extract_text(blob[key])
-        parts = []
-        for val in blob.values():
-            chunk = _extract_text(val)
-            if chunk:
-                parts.append(chunk)
-        return "".join(parts)
-    if isinstance(blob, (list, tuple)):
-        return "".join(_extract_text(part) for part in blob)
-    if hasattr(blob, "content"):
-        return _extract_text(getattr(blob, "content"))
-    return str(blob)
+    # Iterative depth-first walk; leaf strings are joined once at the end
+    out = []
+    stack = [blob]
+    while stack:
+        item = stack.pop()
+        if item is None:
+            continue
+        if isinstance(item, str):
+            out.append(item)
+        elif isinstance(item, dict):
+            for key in ("content", "text", "response"):
+                if key in item:
+                    stack.append(item[key])
+                    break
+            else:
+                stack.extend(reversed(list(item.values())))
+        elif isinstance(item, (list, tuple)):
+            stack.extend(reversed(item))
+        elif hasattr(item, "content"):
+            stack.append(item.content)
+        else:
+            out.append(str(item))
+    return "".join(out)
 
 
 def _extract_count(value):
@@ -49,19 +75,32 @@ def _extract_count(value):
 def _build_stage_payload(node: str, message: str, **extra):
     """Build a stage payload for UI events."""
     payload = {"type": "stage", "node": node, "message": message}
-    if extra:
-        payload.update({k: v for k, v in extra.items() if v is not None})
+    for key, value in extra.items():
+        if value is not None:
+            payload[key] = value
     return payload
 
 
+def _static_stage(node: str, message: str):
+    """
+    Prebuilt single-payload result for a stage event that carries no
+    per-request data. Shared across requests, so it must not be mutated.
+    """
+    return (_build_stage_payload(node, message),)
+
+
 def _extract_token(data_section):
     """Extract token from LLM streaming data."""
-    if not isinstance(data_section, dict):
+    if data_section.__class__ is not dict and not isinstance(data_section, dict):
         return ""
     chunk = data_section.get("chunk") or data_section.get("delta")
     if chunk is None:
         return ""
-    if isinstance(chunk, str):
+    # Fast path: LangChain AIMessageChunk with string content
+    content = getattr(chunk, "content", None)
+    if type(content) is str:
+        return content
+    if type(chunk) is str or isinstance(chunk, str):
         return chunk
     if isinstance(chunk, dict):
         content = chunk.get("content")
@@ -81,6 +120,34 @@ def _extract_token(data_section):
     return _extract_text(chunk)
 
 
+def _pick(out, state_snapshot, key):
+    """First non-None value for key in the node output (dict or None), then the state snapshot."""
+    if out is not None:
+        value = out.get(key)
+        if value is not None:
+            return value
+    return state_snapshot.get(key) if state_snapshot else None
+
+
+@lru_cache(maxsize=256)
+def _count_msg(template: str, n: int) -> str:
+    """Format a one-int stage message, reusing the string for repeated counts."""
+    return template % n
+
+
+def _chunks_stage_payload(node: str, template: str, chunks):
+    """Stage payload reporting how many chunks a retriever returned, with a sample."""
+    count = _extract_count(chunks) or 0
+    return _build_stage_payload(
+        node,
+        _count_msg(template, count),
+        count=count,
+        sample=_truncate(chunks[0] if count else "", 160)
+        if isinstance(chunks, list)
+        else None,
+    )
+
+
 def _maybe_get_state(data_section: dict):
     """Extract state from data section."""
     if not isinstance(data_section, dict):
@@ -92,248 +159,255 @@ def _maybe_get_state(data_section: dict):
     return {}
 
 
-def format_event_for_ui(event: Dict[str, Any], initial_state: Dict[str, Any]) -> List[Dict[str, Any]]:
+@dataclass(slots=True, frozen=True)
+class EventCtx:
+    """Per-stream values the event handlers need, computed once per stream."""
+    safe_session_id: str
+    user_message: str
+    document_url: Optional[str]
+    initial_state: Dict[str, Any]
+
+    @classmethod
+    def from_initial_state(cls, initial_state: Dict[str, Any]) -> "EventCtx":
+        return cls(
+            safe_session_id=_safe_session(initial_state.get("session_id")),
+            user_message=_truncate(initial_state.get("message"), 120),
+            document_url=initial_state.get("document_url"),
+            initial_state=initial_state,
+        )
+
+
+def _handle_input_start(node_name, data_section, out, state_snapshot, ctx):
+    return [
+        _build_stage_payload(
+            "input",
+            "Validating session & user input…",
+            session=ctx.safe_session_id,
+            user_message=ctx.user_message,
+        )
+    ]
+
+
+def _handle_input_end(node_name, data_section, out, state_snapshot, ctx):
+    safe_id = (out.get("safe_session_id") if out is not None else None) or ctx.safe_session_id
+    logger.debug("Generated input end payload with safe_id: %s", safe_id)
+    return [_build_stage_payload("input", "Session validated", session=safe_id)]
+
+
+def _handle_history_end(node_name, data_section, out, state_snapshot, ctx):
+    count = _extract_count(_pick(out, state_snapshot, "history")) or 0
+    logger.debug("Generated history payload with %d messages", count)
+    return [
+        _build_stage_payload(
+            "history",
+            _count_msg(MSG_HISTORY_FETCHED, count),
+            count=count,
+        )
+    ]
+
+
+def _handle_doc_download_start(node_name, data_section, out, state_snapshot, ctx):
+    url = ctx.document_url or state_snapshot.get("document_url")
+    if not url:
+        return []
+    return [
+        _build_stage_payload(
+            "doc_download",
+            f"Downloading document from URL {_truncate(url, 100)}",
+        )
+    ]
+
+
+def _handle_doc_download_end(node_name, data_section, out, state_snapshot, ctx):
+    # Reported by the downloader, so the bytes themselves are not touched
+    size_bytes = _pick(out, state_snapshot, "size_bytes")
+    return [
+        _build_stage_payload(
+            "doc_download",
+            "Document downloaded",
+            bytes=size_bytes,
+        )
+    ]
+
+
+_DOC_PROCESS_START = _static_stage("doc_process", "Processing downloaded document…")
+_DOC_PROCESS_END = _static_stage("doc_process", "Document chunks prepared for retrieval")
+
+
+def _handle_doc_process_start(node_name, data_section, out, state_snapshot, ctx):
+    return _DOC_PROCESS_START
+
+
+def _handle_doc_process_end(node_name, data_section, out, state_snapshot, ctx):
+    return _DOC_PROCESS_END
+
+
+def _handle_policy_retriever_end(node_name, data_section, out, state_snapshot, ctx):
+    payload = _chunks_stage_payload("policy_retriever", MSG_POLICY_CHUNKS, _pick(out, state_snapshot, "policy_context"))
+    logger.debug("Generated policy retriever payload with %d chunks", payload["count"])
+    return [payload]
+
+
+def _handle_doc_retriever_end(node_name, data_section, out, state_snapshot, ctx):
+    return [_chunks_stage_payload("doc_retriever", MSG_DOC_CHUNKS, _pick(out, state_snapshot, "doc_context"))]
+
+
+def _handle_context_combine_end(node_name, data_section, out, state_snapshot, ctx):
+    full_message = _pick(out, state_snapshot, "full_user_message")
+    return [
+        _build_stage_payload(
+            "context_combine",
+            "Combining policy and document context",
+            preview=_truncate(full_message, 200) if full_message else None,
+        )
+    ]
+
+
+_LLM_START = _static_stage("llm", "Generating response with LLM…")
+_SESSION_UPDATE_END = _static_stage("session_update", "Appending messages to session history")
+
+
+def _handle_llm_start(node_name, data_section, out, state_snapshot, ctx):
+    return _LLM_START
+
+
+def _handle_session_update_end(node_name, data_section, out, state_snapshot, ctx):
+    return _SESSION_UPDATE_END
+
+
+def _handle_output_end(node_name, data_section, out, state_snapshot, ctx):
+    final_text = ""
+    if out is not None:
+        final_text = _extract_text(out.get("content") or out)
+        if not final_text:
+            final_text = out.get("response", "")
+    if not final_text:
+        final_text = _extract_text(data_section)
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("Generated final output payload with text: %s...", final_text[:100])
+    return [{"type": "final", "node": node_name, "content": final_text}]
+
+
+# Graph node names (both short and *_node spellings) -> canonical UI node
+NODE_ALIASES = {
+    "input_node": "input",
+    "session_history_node": "history",
+    "document_download_node": "doc_download",
+    "document_processing_node": "doc_process",
+    "policy_retriever_node": "policy_retriever",
+    "document_retriever_node": "doc_retriever",
+    "context_combination_node": "context_combine",
+    "llm_node": "llm",
+    "session_update_node": "session_update",
+    "output_node": "output",
+}
+
+# (canonical node, event type) -> handler returning UI payloads
+HANDLERS = {
+    ("input", EV_START): _handle_input_start,
+    ("input", EV_STOP): _handle_input_end,
+    ("history", EV_STOP): _handle_history_end,
+    ("doc_download", EV_START): _handle_doc_download_start,
+    ("doc_download", EV_STOP): _handle_doc_download_end,
+    ("doc_process", EV_START): _handle_doc_process_start,
+    ("doc_process", EV_STOP): _handle_doc_process_end,
+    ("policy_retriever", EV_STOP): _handle_policy_retriever_end,
+    ("doc_retriever", EV_STOP): _handle_doc_retriever_end,
+    ("context_combine", EV_STOP): _handle_context_combine_end,
+    ("llm", EV_START): _handle_llm_start,
+    ("session_update", EV_STOP): _handle_session_update_end,
+    ("output", EV_STOP): _handle_output_end,
+}
+
+
+def format_event_for_ui(event: Dict[str, Any], ctx: EventCtx) -> Iterator[Dict[str, Any]]:
     """
     Convert a raw LangGraph event into UI-friendly payloads.
     
     Args:
         event: Raw event dict from LangGraph
-        initial_state: Initial state used for the graph execution
+        ctx: EventCtx built once from the graph's initial state
         
-    Returns:
-        List of UI payloads to send to the client
+    Yields:
+        UI payloads to send to the client; read-only, as payloads for
+        static stage events are shared
     """
-    payloads = []
-    
     try:
-        node_name = (event.get("name") or "").lower()
-        ev_type = event.get("event")
+        ev_type = sys.intern(event.get("event") or "")
         data_section = event.get("data") or {}
-        state_snapshot = _maybe_get_state(data_section)
-        output_section = data_section.get("output") if isinstance(data_section, dict) else None
         
-        print(f"[EVENT_FORMATTER] Processing event: {ev_type} from {node_name}")
-        print(f"[EVENT_FORMATTER] Event keys: {list(event.keys())}")
-        print(f"[EVENT_FORMATTER] Data section keys: {list(data_section.keys()) if isinstance(data_section, dict) else 'not dict'}")
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Processing event: %s from %s", ev_type, event.get("name"))
+            logger.debug("Event keys: %s", list(event.keys()))
+            logger.debug("Data section keys: %s", list(data_section.keys()) if isinstance(data_section, dict) else "not dict")
         
         # Note: Intent classification is handled by the main orchestrator before routing
         # Graph nodes don't do intent classification, they just execute their specific logic
 
-        if ev_type == "on_chat_model_stream":
-            print(f"[EVENT_FORMATTER] Processing LLM stream event from {node_name}")
+        # Per-token events are the hottest path: answer them before any
+        # node-name interning or output/state extraction
+        if ev_type == EV_STREAM:
             token = _extract_token(data_section)
             if token:
-                payloads.append({"type": "llm_stream", "node": node_name, "content": token})
-                print(f"[EVENT_FORMATTER] Generated LLM stream payload with token: {token[:50]}...")
+                yield {"type": "llm_stream", "node": (event.get("name") or "").lower(), "content": token}
+            return
 
-        elif ev_type == "on_chat_model_end":
-            print(f"[EVENT_FORMATTER] Processing LLM end event from {node_name}")
+        node_name = sys.intern((event.get("name") or "").lower())
+        output_section = data_section.get("output") if isinstance(data_section, dict) else None
+        out = output_section if isinstance(output_section, dict) else None
+
+        if ev_type == EV_END:
             final_text = _extract_text(output_section or data_section)
             if final_text:
-                payloads.append({"type": "llm_final", "node": node_name, "content": final_text})
-                print(f"[EVENT_FORMATTER] Generated LLM final payload with text: {final_text[:100]}...")
-
-        elif node_name in ("input", "input_node"):
-            print(f"[EVENT_FORMATTER] Processing input node event: {ev_type}")
-            if ev_type == "on_chain_start":
-                payloads.append(
-                    _build_stage_payload(
-                        "input",
-                        "Validating session & user input…",
-                        session=_safe_session(initial_state.get("session_id")),
-                        user_message=_truncate(initial_state.get("message"), 120),
-                    )
-                )
-                print(f"[EVENT_FORMATTER] Generated input start payload")
-            elif ev_type == "on_chain_end":
-                safe_id = None
-                if isinstance(output_section, dict):
-                    safe_id = output_section.get("safe_session_id")
-                if not safe_id:
-                    safe_id = _safe_session(initial_state.get("session_id"))
-                payloads.append(
-                    _build_stage_payload(
-                        "input",
-                        "Session validated",
-                        session=safe_id,
-                    )
-                )
-                print(f"[EVENT_FORMATTER] Generated input end payload with safe_id: {safe_id}")
-
-        elif node_name in ("history", "session_history_node") and ev_type == "on_chain_end":
-            print(f"[EVENT_FORMATTER] Processing history node end event")
-            history = None
-            if isinstance(output_section, dict):
-                history = output_section.get("history")
-            if history is None and state_snapshot:
-                history = state_snapshot.get("history")
-            count = _extract_count(history) or 0
-            payloads.append(
-                _build_stage_payload(
-                    "history",
-                    f"Fetched {count} messages from history",
-                    count=count,
-                )
-            )
-            print(f"[EVENT_FORMATTER] Generated history payload with {count} messages")
-
-        elif node_name in ("doc_download", "document_download_node"):
-            if ev_type == "on_chain_start":
-                url = initial_state.get("document_url") or state_snapshot.get("document_url")
-                if url:
-                    payloads.append(
-                        _build_stage_payload(
-                            "doc_download",
-                            f"Downloading document from URL {_truncate(url, 100)}",
-                        )
-                    )
-            elif ev_type == "on_chain_end":
-                tmp_path = None
-                if isinstance(output_section, dict):
-                    tmp_path = output_section.get("tmp_file_path")
-                if not tmp_path and state_snapshot:
-                    tmp_path = state_snapshot.get("tmp_file_path")
-                size_bytes = None
-                if tmp_path and os.path.exists(tmp_path):
-                    try:
-                        size_bytes = os.path.getsize(tmp_path)
-                    except OSError:
-                        size_bytes = None
-                payloads.append(
-                    _build_stage_payload(
-                        "doc_download",
-                        "Document downloaded",
-                        bytes=size_bytes,
-                        temp_path=_truncate(tmp_path, 80) if tmp_path else None,
-                    )
-                )
-
-        elif node_name in ("doc_process", "document_processing_node"):
-            if ev_type == "on_chain_start":
-                payloads.append(
-                    _build_stage_payload(
-                        "doc_process",
-                        "Processing downloaded document…",
-                    )
-                )
-            elif ev_type == "on_chain_end":
-                payloads.append(
-                    _build_stage_payload(
-                        "doc_process",
-                        "Document chunks prepared for retrieval",
-                    )
-                )
-
-        elif node_name in ("policy_retriever", "policy_retriever_node") and ev_type == "on_chain_end":
-            print(f"[EVENT_FORMATTER] Processing policy retriever end event")
-            policy_chunks = None
-            if isinstance(output_section, dict):
-                policy_chunks = output_section.get("policy_context")
-            if policy_chunks is None and state_snapshot:
-                policy_chunks = state_snapshot.get("policy_context")
-            count = _extract_count(policy_chunks) or 0
-            payloads.append(
-                _build_stage_payload(
-                    "policy_retriever",
-                    f"Retrieved {count} policy chunks",
-                    count=count,
-                    sample=_truncate(policy_chunks[0] if count else "", 160)
-                    if isinstance(policy_chunks, list)
-                    else None,
-                )
-            )
-            print(f"[EVENT_FORMATTER] Generated policy retriever payload with {count} chunks")
-
-        elif node_name in ("doc_retriever", "document_retriever_node") and ev_type == "on_chain_end":
-            doc_chunks = None
-            if isinstance(output_section, dict):
-                doc_chunks = output_section.get("doc_context")
-            if doc_chunks is None and state_snapshot:
-                doc_chunks = state_snapshot.get("doc_context")
-            count = _extract_count(doc_chunks) or 0
-            payloads.append(
-                _build_stage_payload(
-                    "doc_retriever",
-                    f"Retrieved {count} document chunks",
-                    count=count,
-                    sample=_truncate(doc_chunks[0] if count else "", 160)
-                    if isinstance(doc_chunks, list)
-                    else None,
-                )
-            )
-
-        elif node_name in ("context_combine", "context_combination_node") and ev_type == "on_chain_end":
-            full_message = None
-            if isinstance(output_section, dict):
-                full_message = output_section.get("full_user_message")
-            if not full_message and state_snapshot:
-                full_message = state_snapshot.get("full_user_message")
-            payloads.append(
-                _build_stage_payload(
-                    "context_combine",
-                    "Combining policy and document context",
-                    preview=_truncate(full_message, 200) if full_message else None,
-                )
-            )
-
-        elif node_name in ("llm", "llm_node") and ev_type == "on_chain_start":
-            payloads.append(
-                _build_stage_payload(
-                    "llm",
-                    "Generating response with LLM…",
-                )
-            )
+                yield {"type": "llm_final", "node": node_name, "content": final_text}
+            return
 
-        elif node_name in ("session_update", "session_update_node") and ev_type == "on_chain_end":
-            payloads.append(
-                _build_stage_payload(
-                    "session_update",
-                    "Appending messages to session history",
-                )
-            )
+        handler = HANDLERS.get((NODE_ALIASES.get(node_name, node_name), ev_type))
+        if handler is not None:
+            state_snapshot = _maybe_get_state(data_section)
+            payloads = handler(node_name, data_section, out, state_snapshot, ctx)
 
-        elif node_name in ("output", "output_node") and ev_type == "on_chain_end":
-            print(f"[EVENT_FORMATTER] Processing output node end event")
-            final_text = ""
-            if isinstance(output_section, dict):
-                final_text = _extract_text(output_section.get("content") or output_section)
-                if not final_text:
-                    final_text = output_section.get("response", "")
-            if not final_text:
-                final_text = _extract_text(data_section)
-            payloads.append({"type": "final", "node": node_name, "content": final_text})
-            print(f"[EVENT_FORMATTER] Generated final output payload with text: {final_text[:100]}...")
-
-        elif ev_type in ("on_chain_start", "on_chain_end") and node_name:
+        elif (ev_type == EV_START or ev_type == EV_STOP) and node_name:
             # Fallback generic progress event
-            print(f"[EVENT_FORMATTER] Processing generic {ev_type} event for {node_name}")
-            verb = "Starting" if ev_type == "on_chain_start" else "Finished"
-            payloads.append(
+            verb = "Starting" if ev_type == EV_START else "Finished"
+            payloads = (
                 _build_stage_payload(
                     node_name,
                     f"{verb} node '{node_name}'",
-                )
+                ),
             )
-            print(f"[EVENT_FORMATTER] Generated generic payload for {node_name}")
+            logger.debug("Generated generic payload for %s", node_name)
+
+        else:
+            return
 
     except Exception as e:
-        print(f"[EVENT_FORMATTER] ERROR processing event: {str(e)}")
-        import traceback
-        traceback.print_exc()
-        payloads = [{"type": "error", "error": str(e)}]
+        logger.exception("Error processing event: %s", e)
+        yield {"type": "error", "error": str(e)}
+        return
+
+    yield from payloads
+
+
+_SSE_PREFIX = b"data: "
+_SSE_SUFFIX = b"\n\n"
+
 
-    print(f"[EVENT_FORMATTER] Returning {len(payloads)} payloads for event: {ev_type} from {node_name}")
-    return payloads
+@lru_cache(maxsize=128)
+def _static_sse(node: str, message: str) -> bytes:
+    """SSE frame for a stage payload carrying nothing but node and message."""
+    return _SSE_PREFIX + orjson.dumps({"type": "stage", "node": node, "message": message}) + _SSE_SUFFIX
 
 
-def serialize_payload_for_sse(payload: Dict[str, Any]) -> str:
-    """Serialize a payload for Server-Sent Events."""
+def serialize_payload_for_sse(payload: Dict[str, Any]) -> bytes:
+    """Serialize a payload for Server-Sent Events, as UTF-8 bytes ready to send."""
     try:
-        sse_line = f"data: {json.dumps(payload)}\n\n"
-        print(f"[SERIALIZER] Serialized payload: {payload.get('type', 'unknown')} - {len(sse_line)} chars")
-        return sse_line
+        # Parameter-free stage frames are the same on every request
+        if len(payload) == 3 and payload.get("type") == "stage":
+            return _static_sse(payload["node"], payload["message"])
+        return _SSE_PREFIX + orjson.dumps(payload) + _SSE_SUFFIX
     except Exception as e:
-        print(f"[SERIALIZER] Error serializing payload: {e}")
+        logger.warning("Error serializing payload: %s", e)
         raw = str(payload)[:200].replace("\n", "\\n")
         safe_payload = {"type": "event", "raw": raw}
-        return f"data: {json.dumps(safe_payload)}\n\n"
+        return _SSE_PREFIX + orjson.dumps(safe_payload) + _SSE_SUFFIX
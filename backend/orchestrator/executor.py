@@ -1,9 +1,25 @@
 import asyncio
-import json
+import logging
 import queue as _queue
 import threading
-from typing import Dict, Any, Generator, AsyncGenerator
-from .event_formatter import format_event_for_ui, serialize_payload_for_sse
+from typing import Dict, Any, Generator, AsyncGenerator, Optional
+from .event_formatter import EventCtx, format_event_for_ui, serialize_payload_for_sse
+
+logger = logging.getLogger(__name__)
+
+# Coalesce LLM tokens into one SSE frame per this many tokens / seconds
+STREAM_FLUSH_TOKENS = 16
+STREAM_FLUSH_SECONDS = 0.02
+
+# Shared event loop that runs every WSGI stream's producer
+# Bound on buffered SSE frames per stream before the producer waits
+STREAM_QUEUE_MAXSIZE = 256
+# A full queue is re-checked with backoff between these intervals
+STREAM_PUT_POLL_MIN_SECONDS = 0.005
+STREAM_PUT_POLL_SECONDS = 0.1
+
+_BG_LOOP: Optional[asyncio.AbstractEventLoop] = None
+_bg_loop_lock = threading.Lock()
 
 
 async def run_graph_stream(graph, initial_state: Dict[str, Any]) -> AsyncGenerator[Dict[str, Any], None]:
@@ -17,108 +33,217 @@ async def run_graph_stream(graph, initial_state: Dict[str, Any]) -> AsyncGenerat
     Yields:
         Raw event dicts from graph.astream_events
     """
-    print(f"[EXECUTOR] Starting graph stream with initial state keys: {list(initial_state.keys())}")
-    print(f"[EXECUTOR] Session ID: {initial_state.get('session_id')}")
-    print(f"[EXECUTOR] Message: {initial_state.get('message', '')[:100]}...")
-    if initial_state.get('document_url'):
-        print(f"[EXECUTOR] Document URL: {initial_state.get('document_url')}")
+    debug = logger.isEnabledFor(logging.DEBUG)
+    if debug:
+        logger.debug("Starting graph stream with initial state keys: %s", list(initial_state.keys()))
+        logger.debug("Session ID: %s", initial_state.get('session_id'))
+        logger.debug("Message: %s...", initial_state.get('message', '')[:100])
+        if initial_state.get('document_url'):
+            logger.debug("Document URL: %s", initial_state.get('document_url'))
     
     event_count = 0
     async for ev in graph.astream_events(initial_state, version="v2"):
         event_count += 1
-        print(f"[EXECUTOR] Event #{event_count}: {ev.get('event', 'unknown')} from {ev.get('name', 'unknown')}")
+        if debug:
+            logger.debug("Event #%d: %s from %s", event_count, ev.get('event', 'unknown'), ev.get('name', 'unknown'))
         yield ev
     
-    print(f"[EXECUTOR] Graph stream completed. Total events: {event_count}")
+    logger.debug("Graph stream completed. Total events: %d", event_count)
 
 
-async def async_producer(graph, initial_state: Dict[str, Any], queue: _queue.Queue) -> None:
+async def astream_sse(graph, initial_state: Dict[str, Any]) -> AsyncGenerator[bytes, None]:
     """
-    Run the compiled graph's async event stream and push serialized
-    SSE payloads into the queue as they arrive.
+    Execute a LangGraph graph and yield SSE frames directly,
+    with no queue or extra thread in between.
+    
+    Consecutive llm_stream tokens from the same node are coalesced into one
+    payload, flushed every STREAM_FLUSH_TOKENS tokens, after
+    STREAM_FLUSH_SECONDS, or as soon as any other payload arrives. The
+    stream always ends with an 'end' payload.
     
     Args:
         graph: LangGraph graph instance
         initial_state: Initial state dict for the graph
-        queue: Queue to push SSE payloads into
+        
+    Yields:
+        SSE frames as UTF-8 bytes, ready to write to the response
     """
-    print(f"[ASYNC_PRODUCER] Starting async producer")
-    print(f"[ASYNC_PRODUCER] Initial state: {list(initial_state.keys())}")
+    debug = logger.isEnabledFor(logging.DEBUG)
+    if debug:
+        logger.debug("Starting SSE stream with initial state keys: %s", list(initial_state.keys()))
     
+    loop = asyncio.get_running_loop()
+    ctx = EventCtx.from_initial_state(initial_state)
+    event_count = 0
+    payload_count = 0
+    tokens = []
+    token_node = None
+    tokens_since = 0.0
+    next_event = None
+
+    def encode(payload):
+        nonlocal payload_count
+        payload_count += 1
+        try:
+            return serialize_payload_for_sse(payload)
+        except Exception as e:
+            logger.warning("Error serializing payload: %s", e)
+            # Fallback for any serialization issues
+            raw = str(payload)[:200].replace("\n", "\\n")
+            return serialize_payload_for_sse({"type": "event", "raw": raw})
+
+    def take_tokens():
+        payload = {"type": "llm_stream", "node": token_node, "content": "".join(tokens)}
+        tokens.clear()
+        return encode(payload)
+
     try:
         # astream_events is an async generator of event dicts
-        events = graph.astream_events(initial_state, version="v2")
-        print(f"[ASYNC_PRODUCER] Created event stream")
+        events = graph.astream_events(initial_state, version="v2").__aiter__()
+
+        while True:
+            if next_event is None:
+                next_event = asyncio.ensure_future(events.__anext__())
+            # Wait for the next event, but no longer than the buffered tokens may sit.
+            # asyncio.wait (unlike wait_for) leaves the pending event untouched on timeout.
+            timeout = None
+            if tokens:
+                timeout = max(0.0, tokens_since + STREAM_FLUSH_SECONDS - loop.time())
+            done, _ = await asyncio.wait((next_event,), timeout=timeout)
+            if not done:
+                yield take_tokens()
+                continue
+
+            finished, next_event = next_event, None
+            try:
+                event = finished.result()
+            except StopAsyncIteration:
+                break
 
-        event_count = 0
-        payload_count = 0
-        async for event in events:
             event_count += 1
-            print(f"[ASYNC_PRODUCER] Processing event #{event_count}: {event.get('event', 'unknown')} from {event.get('name', 'unknown')}")
+            if debug:
+                logger.debug("Processing event #%d: %s from %s", event_count, event.get('event', 'unknown'), event.get('name', 'unknown'))
             
-            payloads = format_event_for_ui(event, initial_state)
-            print(f"[ASYNC_PRODUCER] Generated {len(payloads)} UI payloads for event #{event_count}")
-            
-            for payload in payloads:
-                try:
-                    sse_line = serialize_payload_for_sse(payload)
-                    queue.put(sse_line)
-                    payload_count += 1
-                    print(f"[ASYNC_PRODUCER] Queued payload #{payload_count}: {payload.get('type', 'unknown')}")
-                except Exception as e:
-                    print(f"[ASYNC_PRODUCER] Error serializing payload: {e}")
-                    # Fallback for any serialization issues
-                    raw = str(payload)[:200].replace("\n", "\\n")
-                    safe_payload = {"type": "event", "raw": raw}
-                    queue.put(f"data: {json.dumps(safe_payload)}\n\n")
-                    payload_count += 1
-
-        print(f"[ASYNC_PRODUCER] Completed processing. Total events: {event_count}, Total payloads: {payload_count}")
+            for payload in format_event_for_ui(event, ctx):
+                if payload.get("type") != "llm_stream":
+                    if tokens:
+                        yield take_tokens()
+                    yield encode(payload)
+                    continue
+                if tokens and payload.get("node") != token_node:
+                    yield take_tokens()
+                if not tokens:
+                    token_node = payload.get("node")
+                    tokens_since = loop.time()
+                tokens.append(payload.get("content", ""))
+                if len(tokens) >= STREAM_FLUSH_TOKENS:
+                    yield take_tokens()
+
+        if tokens:
+            yield take_tokens()
+        logger.debug("Completed processing. Total events: %d, Total payloads: %d", event_count, payload_count)
 
     except Exception as e:
-        print(f"[ASYNC_PRODUCER] ERROR: {str(e)}")
-        import traceback
-        traceback.print_exc()
-        queue.put(f"data: {json.dumps({'type':'error','error': str(e)})}\n\n")
+        logger.exception("SSE stream failed: %s", e)
+        if tokens:
+            yield take_tokens()
+        yield serialize_payload_for_sse({"type": "error", "error": str(e)})
     finally:
-        print(f"[ASYNC_PRODUCER] Sending end signal and closing queue")
+        if next_event is not None and not next_event.done():
+            next_event.cancel()
+            try:
+                await next_event
+            except BaseException:
+                pass
+
+    yield serialize_payload_for_sse({"type": "end"})
+
+
+async def _put_until_closed(queue: _queue.Queue, item, closed: threading.Event) -> None:
+    """
+    Put that waits on the event loop while the queue is full and gives up
+    once the consumer has gone away. Waiting in an executor thread instead
+    would let a few stalled clients exhaust the shared loop's default
+    executor, which every stream's to_thread work depends on.
+    """
+    delay = STREAM_PUT_POLL_MIN_SECONDS
+    while not closed.is_set():
         try:
-            queue.put(f"data: {json.dumps({'type':'end'})}\n\n")
-        except Exception:
-            queue.put("data: {\"type\": \"end\"}\n\n")
-        queue.put(None)
+            queue.put_nowait(item)
+            return
+        except _queue.Full:
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, STREAM_PUT_POLL_SECONDS)
 
 
-def start_background_loop(graph, initial_state: Dict[str, Any], queue: _queue.Queue) -> None:
+async def async_producer(
+    graph,
+    initial_state: Dict[str, Any],
+    queue: _queue.Queue,
+    closed: Optional[threading.Event] = None
+) -> None:
     """
-    Thread target that runs the async producer.
+    Push the graph's SSE stream into a thread-safe queue for WSGI callers,
+    followed by a None sentinel.
+    
+    When the queue is bounded and full, the producer waits for the consumer
+    without blocking the event loop, so a slow client slows the graph instead of
+    buffering the whole response in memory. Once ``closed`` is set, further
+    payloads are dropped and the graph runs to completion.
     
     Args:
         graph: LangGraph graph instance
         initial_state: Initial state dict for the graph
         queue: Queue to push SSE payloads into
+        closed: Set by the consumer when it stops reading
     """
-    print(f"[BACKGROUND_LOOP] Starting background thread for async producer")
-    print(f"[BACKGROUND_LOOP] Session ID: {initial_state.get('session_id')}")
-    
+    closed = closed or threading.Event()
+
+    async def put(item):
+        if not closed.is_set():
+            await _put_until_closed(queue, item, closed)
+
     try:
-        loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(loop)
-        print(f"[BACKGROUND_LOOP] Created new event loop")
-        
-        loop.run_until_complete(async_producer(graph, initial_state, queue))
-        print(f"[BACKGROUND_LOOP] Async producer completed successfully")
-        
+        async for sse_line in astream_sse(graph, initial_state):
+            await put(sse_line)
     except Exception as e:
-        print(f"[BACKGROUND_LOOP] ERROR in background loop: {str(e)}")
-        import traceback
-        traceback.print_exc()
+        logger.exception("Async producer failed: %s", e)
+        await put(serialize_payload_for_sse({"type": "error", "error": str(e)}))
+        await put(serialize_payload_for_sse({"type": "end"}))
     finally:
-        loop.close()
-        print(f"[BACKGROUND_LOOP] Event loop closed")
+        await put(None)
 
 
-def create_stream_generator(graph, initial_state: Dict[str, Any]) -> Generator[str, None, None]:
+def _run_background_loop(loop: asyncio.AbstractEventLoop) -> None:
+    """Thread target that drives the shared background loop forever."""
+    asyncio.set_event_loop(loop)
+    loop.run_forever()
+
+
+def _get_background_loop() -> asyncio.AbstractEventLoop:
+    """
+    Return the process-wide event loop used for WSGI streaming, starting it
+    in a daemon thread on first use.
+    
+    Reusing one loop across requests avoids per-stream loop setup and lets
+    async HTTP clients keep their connection pools between requests.
+    """
+    global _BG_LOOP
+    if _BG_LOOP is None:
+        with _bg_loop_lock:
+            if _BG_LOOP is None:
+                loop = asyncio.new_event_loop()
+                threading.Thread(
+                    target=_run_background_loop,
+                    args=(loop,),
+                    name="sse-event-loop",
+                    daemon=True
+                ).start()
+                _BG_LOOP = loop
+    return _BG_LOOP
+
+
+def create_stream_generator(graph, initial_state: Dict[str, Any]) -> Generator[bytes, None, None]:
     """
     Create a generator that yields SSE events from the graph execution.
     
@@ -127,28 +252,29 @@ def create_stream_generator(graph, initial_state: Dict[str, Any]) -> Generator[s
         initial_state: Initial state dict for the graph
         
     Yields:
-        SSE-formatted strings
+        SSE frames as UTF-8 bytes, ready to write to the response
     """
-    print(f"[STREAM_GENERATOR] Creating stream generator")
-    print(f"[STREAM_GENERATOR] Session ID: {initial_state.get('session_id')}")
-    print(f"[STREAM_GENERATOR] Message: {initial_state.get('message', '')[:100]}...")
+    logger.debug("Creating stream generator for session %s", initial_state.get('session_id'))
     
     # Queue for passing SSE lines from the async producer to the Flask generator
-    q: _queue.Queue = _queue.Queue()
-    print(f"[STREAM_GENERATOR] Created queue for SSE events")
+    q: _queue.Queue = _queue.Queue(maxsize=STREAM_QUEUE_MAXSIZE)
+    closed = threading.Event()
 
-    # Start background thread that will populate the queue
-    t = threading.Thread(target=start_background_loop, args=(graph, initial_state, q))
-    t.start()
-    print(f"[STREAM_GENERATOR] Started background thread")
+    # Run the producer on the shared background loop; it populates the queue
+    asyncio.run_coroutine_threadsafe(
+        async_producer(graph, initial_state, q, closed), _get_background_loop()
+    )
 
     # Yield items as they arrive from the async producer
     item_count = 0
-    while True:
-        item = q.get()
-        if item is None:
-            print(f"[STREAM_GENERATOR] Received end signal. Total items yielded: {item_count}")
-            break
-        item_count += 1
-        print(f"[STREAM_GENERATOR] Yielding item #{item_count}: {item[:100]}...")
-        yield item
+    try:
+        while True:
+            item = q.get()
+            if item is None:
+                logger.debug("Received end signal. Total items yielded: %d", item_count)
+                break
+            item_count += 1
+            yield item
+    finally:
+        # Client disconnected (or stream finished): stop the producer blocking on us
+        closed.set()
@@ -1,9 +1,20 @@
+import asyncio
+import functools
+import logging
 from typing import Dict, Any, List, TypedDict
 from langgraph.graph import StateGraph, START, END
 from langchain_core.messages import BaseMessage, HumanMessage, SystemMessage, AIMessage
+from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
 from langchain_google_genai import ChatGoogleGenerativeAI
+from agents.gemini_client import EMBEDDING_MODEL, get_client
+from utils.gemini_embeddings import embed_query
+from .history_window import trim_history
+from .llm_batcher import BatchedLLM
+from .response_cache import ResponseCache
 import os
 
+logger = logging.getLogger(__name__)
+
 # --- TypedDict for general purpose state ---
 class GeneralPurposeState(TypedDict, total=False):
     session_id: str
@@ -11,6 +22,7 @@ class GeneralPurposeState(TypedDict, total=False):
     message: str
     safe_session_id: str
     history: List[BaseMessage]
+    history_serialized: List[Dict[str, str]]
     response: str
 
 # --- General purpose nodes ---
@@ -18,30 +30,37 @@ class GeneralPurposeState(TypedDict, total=False):
 # Graph nodes focus on their specific functionality without caring about intent
 
 def general_input_node(state: GeneralPurposeState) -> GeneralPurposeState:
-    print(f"[GENERAL_INPUT_NODE] Starting with state keys: {list(state.keys())}")
-    print(f"[GENERAL_INPUT_NODE] Session ID: {state.get('session_id')}")
-    print(f"[GENERAL_INPUT_NODE] Message: {state.get('message')}")
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("[GENERAL_INPUT_NODE] Starting with state keys: %s", list(state.keys()))
+    logger.debug("[GENERAL_INPUT_NODE] Session ID: %s", state.get('session_id'))
+    logger.debug("[GENERAL_INPUT_NODE] Message: %s", state.get('message'))
     assert state.get("session_id"), "session_id required"
     assert state.get("message"), "message required"
     assert state.get("user_id"), "user_id required"
     safe_session_id = state["session_id"].replace("-", "_")
-    print("[GENERAL_INPUT_NODE] Validation passed")
+    logger.debug("[GENERAL_INPUT_NODE] Validation passed")
     return {"safe_session_id": safe_session_id}
 
-def general_history_node(state: GeneralPurposeState) -> GeneralPurposeState:
-    print(f"[GENERAL_HISTORY_NODE] Getting history for session: {state['session_id']}")
-    # Use orchestrator's session management
+def _session_orchestrator(state: Dict[str, Any]):
+    """The orchestrator passed in state, else the global one."""
     orchestrator = state.get("orchestrator")
-    if orchestrator:
-        history = orchestrator.get_session_history(state["session_id"], state.get("user_id"))
-    else:
+    if not orchestrator:
         # Fallback
         from .orchestrator import get_orchestrator
-        history = get_orchestrator().get_session_history(state["session_id"], state.get("user_id"))
+        orchestrator = get_orchestrator()
+    return orchestrator
+
+def general_history_node(state: GeneralPurposeState) -> GeneralPurposeState:
+    logger.debug("[GENERAL_HISTORY_NODE] Getting history for session: %s", state['session_id'])
+    # Use orchestrator's session management
+    history, history_serialized = _session_orchestrator(state).load_session_history(
+        state["session_id"], state.get("user_id")
+    )
     
-    print(f"[GENERAL_HISTORY_NODE] Retrieved {len(history)} messages from history")
-    print(f"[GENERAL_HISTORY_NODE] History types: {[type(msg).__name__ for msg in history]}")
-    return {"history": history}
+    logger.debug("[GENERAL_HISTORY_NODE] Retrieved %s messages from history", len(history))
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("[GENERAL_HISTORY_NODE] History types: %s", [type(msg).__name__ for msg in history])
+    return {"history": history, "history_serialized": history_serialized}
 
 # Initialize LLM for general purpose
 _LLM = ChatGoogleGenerativeAI(
@@ -49,15 +68,31 @@ _LLM = ChatGoogleGenerativeAI(
     temperature=0.7,  # Higher temperature for more creative responses
     google_api_key=os.getenv("GEMINI_API_KEY"),
 )
+# Cached answers for first-turn small talk, keyed on the bare user message
+_RESPONSE_CACHE = ResponseCache(
+    embed=lambda text: embed_query(get_client(), EMBEDDING_MODEL, text)
+)
+# Keyword categories whose answers are generic enough to share across users
+_CACHEABLE_CATEGORIES = frozenset({"casual", "capability"})
 
-def general_llm_node(state: GeneralPurposeState) -> GeneralPurposeState:
-    message = state["message"]
-    history = state["history"]
-    print(f"[GENERAL_LLM_NODE] History has {len(history)} messages")
-    print(f"[GENERAL_LLM_NODE] User message: {message[:100]}...")
-    try:
-        # Create conversation with focused system message
-        system_message = SystemMessage(content="""You are a helpful assistant for a policy compliance system. Your role is strictly limited to:
+
+def _is_cacheable(message: str, history: List[BaseMessage]) -> bool:
+    """
+    Whether a response may be served from / stored in the shared cache: only
+    first turns (later answers may depend on the conversation) that the
+    keyword classifier marks as small talk or capability questions. The
+    cache is shared by all users, so anything else could echo one user's
+    details to another.
+    """
+    if any(isinstance(msg, (HumanMessage, AIMessage)) for msg in history):
+        return False
+    # Imported here: the orchestrator module imports this one
+    from .orchestrator import _classify_by_keywords
+    match = _classify_by_keywords(message.lower().strip())
+    return match is not None and match[1] in _CACHEABLE_CATEGORIES
+
+# Focused system message, built once
+_GENERAL_SYSTEM_MESSAGE = SystemMessage(content="""You are a helpful assistant for a policy compliance system. Your role is strictly limited to:
 
 1. CASUAL CONVERSATION: Greetings, small talk, pleasantries (hello, how are you, good morning, etc.)
 2. SYSTEM CAPABILITIES: Explaining what the system can help with regarding company policies
@@ -83,82 +118,97 @@ RESPONSES FOR UNETHICAL QUESTIONS:
 "I cannot assist with requests that involve unethical or illegal activities. Please consult with appropriate authorities or legal counsel for such matters."
 
 Be warm and helpful within your defined scope, but firm about boundaries and ethical standards.""")
-    
-        convo = [system_message] + history + [HumanMessage(content=message)]
-        print(f"[GENERAL_LLM_NODE] Total conversation length: {len(convo)} messages")
-        print("[GENERAL_LLM_NODE] Invoking LLM...")
-        response = _LLM.invoke(convo)
-        print(f"[GENERAL_LLM_NODE] LLM response type: {type(response)}")
-        print(f"[GENERAL_LLM_NODE] Response content length: {len(response.content) if response.content else 0}")
+
+_GENERAL_CHAIN = ChatPromptTemplate.from_messages([
+    _GENERAL_SYSTEM_MESSAGE,
+    MessagesPlaceholder("history"),
+    ("human", "{message}"),
+]) | _LLM
+
+# Concurrent requests' LLM calls are dispatched in small batches
+_BATCHED_LLM = BatchedLLM(_GENERAL_CHAIN)
+
+async def general_llm_node(state: GeneralPurposeState) -> GeneralPurposeState:
+    message = state["message"]
+    history = state["history"]
+    logger.debug("[GENERAL_LLM_NODE] History has %s messages", len(history))
+    logger.debug("[GENERAL_LLM_NODE] User message: %.100s...", message)
+
+    cacheable = _is_cacheable(message, history)
+    embedding = None
+    if cacheable:
+        cached, embedding = await asyncio.to_thread(_RESPONSE_CACHE.lookup, message)
+        if cached is not None:
+            logger.debug("[GENERAL_LLM_NODE] Response cache hit")
+            return {"response": cached}
+
+    try:
+        # Only the copy sent to the model is windowed; storage keeps everything
+        window = trim_history(history)
+        logger.debug("[GENERAL_LLM_NODE] Total conversation length: %s messages", len(window) + 2)
+        logger.debug("[GENERAL_LLM_NODE] Invoking LLM...")
+        response = await _BATCHED_LLM.submit({"history": window, "message": message})
+        logger.debug("[GENERAL_LLM_NODE] LLM response type: %s", type(response))
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("[GENERAL_LLM_NODE] Response content length: %s", len(response.content) if response.content else 0)
+        if cacheable and isinstance(response.content, str) and response.content:
+            _RESPONSE_CACHE.store(message, embedding, response.content)
         return {"response": response.content}
     except Exception as e:
-        print(f"[GENERAL_LLM_NODE] ERROR invoking LLM: {e}")
-        import traceback
-        traceback.print_exc()
+        logger.exception("[GENERAL_LLM_NODE] ERROR invoking LLM: %s", e)
         fallback = "I'm here to help with policy questions, but I can't generate a response right now."
         return {"response": fallback}
 
-def general_session_update_node(state: GeneralPurposeState) -> GeneralPurposeState:
+async def general_session_update_node(state: GeneralPurposeState) -> GeneralPurposeState:
     session_id = state["session_id"]
-    print(f"[GENERAL_SESSION_UPDATE_NODE] Updating session: {session_id}")
+    logger.debug("[GENERAL_SESSION_UPDATE_NODE] Updating session: %s", session_id)
     
-    # Use orchestrator's session management
-    orchestrator = state.get("orchestrator")
-    if orchestrator:
-        orchestrator.update_session_history(
-            session_id,
-            state.get("user_id"),
-            state["message"],
-            state.get("response", "")
-        )
-        print(f"[GENERAL_SESSION_UPDATE_NODE] Updated session via orchestrator")
-    else:
-        # Fallback
-        from .orchestrator import get_orchestrator
-        get_orchestrator().update_session_history(
-            session_id,
-            state.get("user_id"),
-            state["message"],
-            state.get("response", "")
-        )
-        print(f"[GENERAL_SESSION_UPDATE_NODE] Updated session via fallback orchestrator")
+    # The write runs in the background so the answer is not held up by it;
+    # run_general_purpose waits for it before closing its event loop
+    _session_orchestrator(state).schedule_session_update(
+        session_id,
+        state.get("user_id"),
+        state["message"],
+        state.get("response", "")
+    )
+    logger.debug("[GENERAL_SESSION_UPDATE_NODE] Scheduled session update")
     
     return {}
 
 def general_output_node(state: GeneralPurposeState) -> Dict[str, Any]:
-    print("[GENERAL_OUTPUT_NODE] Starting output processing...")
+    logger.debug("[GENERAL_OUTPUT_NODE] Starting output processing...")
     response_text = state.get("response", "")
-    print(f"[GENERAL_OUTPUT_NODE] Response text type: {type(response_text)}")
-    print(f"[GENERAL_OUTPUT_NODE] Response text length: {len(response_text) if response_text else 0}")
+    logger.debug("[GENERAL_OUTPUT_NODE] Response text type: %s", type(response_text))
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("[GENERAL_OUTPUT_NODE] Response text length: %s", len(response_text) if response_text else 0)
     
     # Serialize history for response
     session_id = state.get("session_id")
     history_serialized = []
     if session_id:
-        print(f"[GENERAL_OUTPUT_NODE] Serializing history for session: {session_id}")
-        orchestrator = state.get("orchestrator")
-        if orchestrator:
-            history = orchestrator.get_session_history(session_id, state.get("user_id"))
-        else:
-            from .orchestrator import get_orchestrator
-            history = get_orchestrator().get_session_history(session_id, state.get("user_id"))
-        
-        print(f"[GENERAL_OUTPUT_NODE] History to serialize has {len(history)} messages")
-        history_serialized = [{"type": type(msg).__name__, "content": msg.content} 
-                              for msg in history]
-        print(f"[GENERAL_OUTPUT_NODE] Serialized {len(history_serialized)} messages")
+        logger.debug("[GENERAL_OUTPUT_NODE] Serializing history for session: %s", session_id)
+        # The history loaded at the start of the run (serialized while it was
+        # loaded) plus the turn just saved; matches what the store now holds
+        # without reading it back
+        history_serialized = [
+            *(state.get("history_serialized") or []),
+            {"type": "HumanMessage", "content": state.get("message", "")},
+            {"type": "AIMessage", "content": response_text},
+        ]
+        logger.debug("[GENERAL_OUTPUT_NODE] Serialized %s messages", len(history_serialized))
     
     result = {
         "content": response_text,
         "history": history_serialized
     }
-    print(f"[GENERAL_OUTPUT_NODE] Final result keys: {list(result.keys())}")
-    print(f"[GENERAL_OUTPUT_NODE] Result types: {[(k, type(v)) for k, v in result.items()]}")
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("[GENERAL_OUTPUT_NODE] Final result keys: %s", list(result.keys()))
+        logger.debug("[GENERAL_OUTPUT_NODE] Result types: %s", [(k, type(v)) for k, v in result.items()])
     return result
 
 # --- Build the general purpose graph ---
 def build_general_purpose_graph():
-    print("[GENERAL_GRAPH] Building general purpose graph")
+    logger.debug("[GENERAL_GRAPH] Building general purpose graph")
     graph = StateGraph(GeneralPurposeState)
     
     # Add nodes
@@ -176,34 +226,75 @@ def build_general_purpose_graph():
     graph.add_edge("session_update", "output")
     graph.add_edge("output", END)
     
-    print("[GENERAL_GRAPH] General purpose graph built successfully")
+    logger.debug("[GENERAL_GRAPH] General purpose graph built successfully")
     return graph.compile()
 
+@functools.lru_cache(maxsize=1)
+def get_general_purpose_app():
+    """Compiled general purpose graph, built once and shared by all requests."""
+    return build_general_purpose_graph()
+
+# The graph above is strictly linear, so non-streaming callers can run its
+# nodes back to back and skip LangGraph's per-node dispatch and state copies.
+# The compiled graph is still used for SSE streaming, which needs its events.
+_GENERAL_PIPELINE = (
+    general_input_node,
+    general_history_node,
+    general_llm_node,
+    general_session_update_node,
+    general_output_node,
+)
+
+async def arun_general_purpose(initial_state: GeneralPurposeState) -> Dict[str, Any]:
+    """
+    Run the general purpose nodes directly, in graph order, and return the
+    final state. Blocking nodes (database access) run in a worker thread, as
+    LangGraph would run them.
+    """
+    state: Dict[str, Any] = dict(initial_state)
+    for node in _GENERAL_PIPELINE:
+        if asyncio.iscoroutinefunction(node):
+            update = await node(state)
+        else:
+            update = await asyncio.to_thread(node, state)
+        if update:
+            state.update(update)
+    return state
+
+async def _arun_and_persist(initial_state: GeneralPurposeState) -> Dict[str, Any]:
+    """Run the pipeline, then wait for its background session write."""
+    final_state = await arun_general_purpose(initial_state)
+    await _session_orchestrator(initial_state).wait_for_pending_writes()
+    return final_state
+
 # --- Run the general purpose graph ---
-def run_general_purpose(session_id: str, message: str) -> str:
-    print(f"[RUN_GENERAL_PURPOSE] Starting general purpose graph with session_id: {session_id}")
-    print(f"[RUN_GENERAL_PURPOSE] Message: {message[:100]}...")
+def run_general_purpose(session_id: str, message: str, user_id: str) -> str:
+    logger.debug("[RUN_GENERAL_PURPOSE] Starting general purpose graph with session_id: %s", session_id)
+    logger.debug("[RUN_GENERAL_PURPOSE] Message: %.100s...", message)
     
     try:
-        app = build_general_purpose_graph()
         initial_state: GeneralPurposeState = {
             "session_id": session_id,
             "message": message,
+            "user_id": user_id,
+            "orchestrator": _session_orchestrator({}),
         }
-        print(f"[RUN_GENERAL_PURPOSE] Initial state: {list(initial_state.keys())}")
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("[RUN_GENERAL_PURPOSE] Initial state: %s", list(initial_state.keys()))
         
-        print("[RUN_GENERAL_PURPOSE] Invoking graph...")
-        final_state = app.invoke(initial_state)
-        print(f"[RUN_GENERAL_PURPOSE] Final state keys: {list(final_state.keys())}")
+        logger.debug("[RUN_GENERAL_PURPOSE] Running pipeline...")
+        # The LLM node is async, so the pipeline must run on an event loop
+        final_state = asyncio.run(_arun_and_persist(initial_state))
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("[RUN_GENERAL_PURPOSE] Final state keys: %s", list(final_state.keys()))
         
         content = final_state.get("content", "") or final_state.get("response", "")
-        print(f"[RUN_GENERAL_PURPOSE] Extracted content: {repr(content[:100]) if content else 'None'}")
-        print(f"[RUN_GENERAL_PURPOSE] Content length: {len(content) if content else 0}")
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("[RUN_GENERAL_PURPOSE] Extracted content: %s", repr(content[:100]) if content else 'None')
+            logger.debug("[RUN_GENERAL_PURPOSE] Content length: %s", len(content) if content else 0)
         
         return content
         
     except Exception as e:
-        print(f"[RUN_GENERAL_PURPOSE] ERROR: {str(e)}")
-        import traceback
-        traceback.print_exc()
+        logger.exception("[RUN_GENERAL_PURPOSE] ERROR: %s", e)
         return f"Error processing request: {str(e)}"
@@ -1,15 +1,33 @@
-from typing import Dict, Any, List, TypedDict
+import asyncio
+import functools
+import logging
+from typing import Dict, Any, List, Optional, Tuple, TypedDict
 from langgraph.graph import StateGraph, START, END
-from langchain_core.messages import BaseMessage, HumanMessage, SystemMessage, AIMessage
+from langchain_core.messages import BaseMessage, SystemMessage, AIMessage
+from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
 from utils.prompts import MAIN_PROMPT
 from agents.chuck_retriever import Retriever
 from agents.chunk_retriever_temp import TempRetriever
 from agents.attached_document_processor import DocumentProcessorTemp
 from langchain_google_genai import ChatGoogleGenerativeAI
 import os
-import tempfile
-import requests
+import threading
+import uuid
+from cachetools import TTLCache
 from db.connection import get_db
+from db.vector_store import session_table_name
+from utils.http_client import DEFAULT_TIMEOUT, DOCUMENT_MAX_BYTES, DOWNLOAD_CHUNK_SIZE, get_http_session
+from .history_window import trim_history
+from .llm_batcher import BatchedLLM
+
+logger = logging.getLogger(__name__)
+
+# Retrieved context sent to the LLM is capped at about 4K tokens
+CONTEXT_MAX_CHARS = int(os.getenv("CONTEXT_MAX_CHARS", "16000"))
+CONTEXT_CHUNK_SEPARATOR = "\n---\n"
+
+TEMP_TABLE_CACHE_SIZE = int(os.getenv("TEMP_TABLE_CACHE_SIZE", "10000"))
+TEMP_TABLE_CACHE_TTL = int(os.getenv("TEMP_TABLE_CACHE_TTL", "300"))
 
 # --- TypedDict for orchestrator state ---
 class OrchestratorState(TypedDict, total=False):
@@ -19,9 +37,11 @@ class OrchestratorState(TypedDict, total=False):
     document_url: str
     safe_session_id: str
     history: List[BaseMessage]
+    history_serialized: List[Dict[str, str]]
     policy_context: Any
     doc_context: Any
-    tmp_file_path: str
+    doc_key: Optional[str]
+    size_bytes: int
     full_user_message: str
     llm_response: BaseMessage
     response: str
@@ -29,13 +49,20 @@ class OrchestratorState(TypedDict, total=False):
 # --- Session management moved to orchestrator ---
 def get_history_from_orchestrator(state: OrchestratorState) -> List[BaseMessage]:
     """Get history from orchestrator's session management."""
+    return load_history_from_orchestrator(state)[0]
+
+def load_history_from_orchestrator(state: OrchestratorState) -> Tuple[List[BaseMessage], List[Dict[str, str]]]:
+    """Get history as messages plus its serialized form (see ``Orchestrator.load_session_history``)."""
+    return _session_orchestrator(state).load_session_history(state["session_id"], state.get("user_id"))
+
+def _session_orchestrator(state: Dict[str, Any]):
+    """The orchestrator passed in state, else the global one."""
     orchestrator = state.get("orchestrator")
-    if orchestrator:
-        return orchestrator.get_session_history(state["session_id"], state.get("user_id"))
-    else:
+    if not orchestrator:
         # Fallback for backward compatibility
         from .orchestrator import get_orchestrator
-        return get_orchestrator().get_session_history(state["session_id"], state.get("user_id"))
+        orchestrator = get_orchestrator()
+    return orchestrator
 
 # --- Helper to serialize LangChain messages ---
 def serialize_messages(messages: List[BaseMessage]) -> List[Dict[str, str]]:
@@ -46,50 +73,85 @@ def serialize_messages(messages: List[BaseMessage]) -> List[Dict[str, str]]:
 # Graph nodes focus on their specific functionality without caring about intent
 
 def input_node(state: OrchestratorState) -> OrchestratorState:
-    print(f"[INPUT_NODE] Starting with state keys: {list(state.keys())}")
-    print(f"[INPUT_NODE] Session ID: {state.get('session_id')}")
-    print(f"[INPUT_NODE] Message: {state.get('message')}")
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("[INPUT_NODE] Starting with state keys: %s", list(state.keys()))
+    logger.debug("[INPUT_NODE] Session ID: %s", state.get('session_id'))
+    logger.debug("[INPUT_NODE] Message: %s", state.get('message'))
     if state.get("document_url"):
-        print(f"[INPUT_NODE] Document URL: {state.get('document_url')}")
+        logger.debug("[INPUT_NODE] Document URL: %s", state.get('document_url'))
     assert state.get("session_id"), "session_id required"
     assert state.get("message"), "message required"
     assert state.get("user_id"), "user_id required"
     safe_session_id = state["session_id"].replace("-", "_")
-    print("[INPUT_NODE] Validation passed")
+    logger.debug("[INPUT_NODE] Validation passed")
     return {"safe_session_id": safe_session_id}
 
 def session_history_node(state: OrchestratorState) -> OrchestratorState:
-    print(f"[SESSION_HISTORY_NODE] Getting history for session: {state['session_id']}")
-    history = get_history_from_orchestrator(state)
-    print(f"[SESSION_HISTORY_NODE] Retrieved {len(history)} messages from history")
-    print(f"[SESSION_HISTORY_NODE] History types: {[type(msg).__name__ for msg in history]}")
-    return {"history": history}
+    logger.debug("[SESSION_HISTORY_NODE] Getting history for session: %s", state['session_id'])
+    history, history_serialized = load_history_from_orchestrator(state)
+    logger.debug("[SESSION_HISTORY_NODE] Retrieved %s messages from history", len(history))
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("[SESSION_HISTORY_NODE] History types: %s", [type(msg).__name__ for msg in history])
+    return {"history": history, "history_serialized": history_serialized}
 
 _policy_retriever = Retriever()
 _temp_retriever = TempRetriever()
 _doc_processor = DocumentProcessorTemp()
 
-def policy_retriever_node(state: OrchestratorState) -> OrchestratorState:
+async def policy_retriever_node(state: OrchestratorState) -> OrchestratorState:
     message = state["message"]
-    print(f"[POLICY_RETRIEVER_NODE] Retrieving chunks for message: {message[:100]}...")
-    policy_context = _policy_retriever.retrieve_chunks(message)
-    print(f"[POLICY_RETRIEVER_NODE] Retrieved {len(policy_context) if policy_context else 0} chunks")
-    print(f"[POLICY_RETRIEVER_NODE] Policy context type: {type(policy_context)}")
+    logger.debug("[POLICY_RETRIEVER_NODE] Retrieving chunks for message: %.100s...", message)
+    policy_context = await _policy_retriever.aretrieve_chunks(message)
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("[POLICY_RETRIEVER_NODE] Retrieved %s chunks", len(policy_context) if policy_context else 0)
+    logger.debug("[POLICY_RETRIEVER_NODE] Policy context type: %s", type(policy_context))
     return {"policy_context": policy_context}
 
+def _context_chunks(context) -> List[str]:
+    """Chunk texts from a retriever result ({"status", "chunks"}) or a chunk list."""
+    if isinstance(context, dict):
+        context = context.get("chunks") or []
+    texts = []
+    for chunk in context:
+        text = chunk.get("content") if isinstance(chunk, dict) else chunk
+        if text:
+            texts.append(str(text))
+    return texts
+
+def _join_chunks(chunks: List[str], budget: int) -> Tuple[str, int]:
+    """Join chunks with separators, stopping once ``budget`` characters are used."""
+    kept = []
+    used = 0
+    for chunk in chunks:
+        if used >= budget:
+            break
+        chunk = chunk[:budget - used]
+        kept.append(chunk)
+        used += len(chunk)
+    return CONTEXT_CHUNK_SEPARATOR.join(kept), used
+
 def context_combination_node(state: OrchestratorState) -> OrchestratorState:
     message = state["message"]
-    policy_context = state.get("policy_context") or []
-    doc_context = state.get("doc_context") or []
-    print(f"[CONTEXT_COMBINATION_NODE] Message: {message[:100]}...")
-    print(f"[CONTEXT_COMBINATION_NODE] Policy context length: {len(policy_context) if policy_context else 0}")
-    print(f"[CONTEXT_COMBINATION_NODE] Document context length: {len(doc_context) if doc_context else 0}")
-    combined_context = f"""
-    Policy Context: {str(policy_context)}
-    Document Context: {str(doc_context)}
-    """
-    full_message = f"User Message: {message}\nContext: {combined_context}"
-    print(f"[CONTEXT_COMBINATION_NODE] Full message length: {len(full_message)}")
+    policy_chunks = _context_chunks(state.get("policy_context") or [])
+    doc_chunks = _context_chunks(state.get("doc_context") or [])
+    logger.debug("[CONTEXT_COMBINATION_NODE] Message: %.100s...", message)
+    logger.debug("[CONTEXT_COMBINATION_NODE] Policy context length: %s", len(policy_chunks))
+    logger.debug("[CONTEXT_COMBINATION_NODE] Document context length: %s", len(doc_chunks))
+    if not policy_chunks and not doc_chunks:
+        # Nothing retrieved: don't spend prompt tokens on an empty wrapper
+        logger.debug("[CONTEXT_COMBINATION_NODE] No context, passing message through")
+        return {"full_user_message": message}
+
+    # Policy chunks first, then document chunks, within one shared budget
+    policy_text, used = _join_chunks(policy_chunks, CONTEXT_MAX_CHARS)
+    doc_text, _ = _join_chunks(doc_chunks, CONTEXT_MAX_CHARS - used)
+    sections = [f"User Message: {message}", "Context:"]
+    if policy_text:
+        sections.append(f"Policy Context:\n{policy_text}")
+    if doc_text:
+        sections.append(f"Document Context:\n{doc_text}")
+    full_message = "\n".join(sections)
+    logger.debug("[CONTEXT_COMBINATION_NODE] Full message length: %s", len(full_message))
     return {"full_user_message": full_message}
 
 _LLM = ChatGoogleGenerativeAI(
@@ -97,213 +159,266 @@ _LLM = ChatGoogleGenerativeAI(
     temperature=0,
     google_api_key=os.getenv("GEMINI_API_KEY"),
 )
+_MAIN_SYSTEM_MESSAGE = SystemMessage(content=MAIN_PROMPT)
+
+# System prompt, then the session history, then the user's message;
+# compiled once instead of rebuilding the message list per call
+_MAIN_CHAIN = ChatPromptTemplate.from_messages([
+    _MAIN_SYSTEM_MESSAGE,
+    MessagesPlaceholder("history"),
+    ("human", "{message}"),
+]) | _LLM
+
+# Concurrent requests' LLM calls are dispatched in small batches
+_BATCHED_LLM = BatchedLLM(_MAIN_CHAIN)
 
-def llm_node(state: OrchestratorState) -> OrchestratorState:
+async def llm_node(state: OrchestratorState) -> OrchestratorState:
     history = state["history"]
-    print(f"[LLM_NODE] History has {len(history)} messages")
-    print(f"[LLM_NODE] Full user message length: {len(state['full_user_message'])}")
+    logger.debug("[LLM_NODE] History has %s messages", len(history))
+    logger.debug("[LLM_NODE] Full user message length: %s", len(state['full_user_message']))
     try:
-        # Add system prompt at the beginning of conversation
-        system_message = SystemMessage(content=MAIN_PROMPT)
-        convo = [system_message] + history + [HumanMessage(content=state["full_user_message"])]
-        print(f"[LLM_NODE] Total conversation length: {len(convo)} messages")
-        print("[LLM_NODE] Invoking LLM...")
-        response = _LLM.invoke(convo)
-        print(f"[LLM_NODE] LLM response type: {type(response)}")
-        print(f"[LLM_NODE] Response content length: {len(response.content) if response.content else 0}")
+        # Only the copy sent to the model is windowed; storage keeps everything
+        window = trim_history(history)
+        logger.debug("[LLM_NODE] Total conversation length: %s messages", len(window) + 2)
+        logger.debug("[LLM_NODE] Invoking LLM...")
+        response = await _BATCHED_LLM.submit({"history": window, "message": state["full_user_message"]})
+        logger.debug("[LLM_NODE] LLM response type: %s", type(response))
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("[LLM_NODE] Response content length: %s", len(response.content) if response.content else 0)
         return {"response": response.content}
     except Exception as e:
-        print(f"[LLM_NODE] ERROR invoking LLM: {e}")
-        import traceback
-        traceback.print_exc()
+        logger.exception("[LLM_NODE] ERROR invoking LLM: %s", e)
         # Fallback response to keep pipeline moving and allow persistence
         fallback = "I'm temporarily unavailable to generate a detailed answer, but I've recorded your question."
         return {"response": fallback}
 
-def session_update_node(state: OrchestratorState) -> OrchestratorState:
+async def session_update_node(state: OrchestratorState) -> OrchestratorState:
     session_id = state["session_id"]
-    user_id = state.get("user_id")
-    print(f"[SESSION_UPDATE_NODE] Updating session: {session_id}")
+    logger.debug("[SESSION_UPDATE_NODE] Updating session: %s", session_id)
 
-    # Use orchestrator's session management
-    orchestrator = state.get("orchestrator")
-    user_message = state.get("message", "")  # Only persist the original user query
-    if orchestrator:
-        orchestrator.update_session_history(
-            session_id,
-            user_id,
-            user_message,
-            state.get("response", "")
-        )
-        print(f"[SESSION_UPDATE_NODE] Updated session via orchestrator")
-    else:
-        # Fallback for backward compatibility
-        from .orchestrator import get_orchestrator
-        get_orchestrator().update_session_history(
-            session_id,
-            user_id,
-            user_message,
-            state.get("response", "")
-        )
-        print(f"[SESSION_UPDATE_NODE] Updated session via fallback orchestrator")
+    # The write runs in the background so the answer is not held up by it;
+    # run_company_policy waits for it before closing its event loop
+    _session_orchestrator(state).schedule_session_update(
+        session_id,
+        state.get("user_id"),
+        state.get("message", ""),  # Only persist the original user query
+        state.get("response", "")
+    )
+    logger.debug("[SESSION_UPDATE_NODE] Scheduled session update")
 
     return {}
 
 def output_node(state: OrchestratorState) -> Dict[str, Any]:
-    print("[OUTPUT_NODE] Starting output processing...")
+    logger.debug("[OUTPUT_NODE] Starting output processing...")
     # Don't directly return BaseMessage objects; only return primitives
     response_text = state.get("response", "")
-    print(f"[OUTPUT_NODE] Response text type: {type(response_text)}")
-    print(f"[OUTPUT_NODE] Response text length: {len(response_text) if response_text else 0}")
+    logger.debug("[OUTPUT_NODE] Response text type: %s", type(response_text))
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("[OUTPUT_NODE] Response text length: %s", len(response_text) if response_text else 0)
     
     # If you want to include session history, serialize it
     session_id = state.get("session_id")
     history_serialized = []
     if session_id:
-        print(f"[OUTPUT_NODE] Serializing history for session: {session_id}")
-        history = get_history_from_orchestrator(state)
-        print(f"[OUTPUT_NODE] History to serialize has {len(history)} messages")
-        history_serialized = [{"type": type(msg).__name__, "content": msg.content} 
-                              for msg in history]
-        print(f"[OUTPUT_NODE] Serialized {len(history_serialized)} messages")
+        logger.debug("[OUTPUT_NODE] Serializing history for session: %s", session_id)
+        # The history loaded at the start of the run (serialized while it was
+        # loaded) plus the turn just saved; matches what the store now holds
+        # without reading it back
+        history_serialized = [
+            *(state.get("history_serialized") or []),
+            {"type": "HumanMessage", "content": state.get("message", "")},
+            {"type": "AIMessage", "content": response_text},
+        ]
+        logger.debug("[OUTPUT_NODE] Serialized %s messages", len(history_serialized))
     
     result = {
         "content": response_text,
         "history": history_serialized
     }
-    print(f"[OUTPUT_NODE] Final result keys: {list(result.keys())}")
-    print(f"[OUTPUT_NODE] Result types: {[(k, type(v)) for k, v in result.items()]}")
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("[OUTPUT_NODE] Final result keys: %s", list(result.keys()))
+        logger.debug("[OUTPUT_NODE] Result types: %s", [(k, type(v)) for k, v in result.items()])
     return result
 
-def document_download_node(state: OrchestratorState) -> OrchestratorState:
-    print("=" * 60)
-    print("[DOCUMENT_DOWNLOAD_NODE] STARTING DOCUMENT DOWNLOAD")
-    print("=" * 60)
+# Downloaded documents waiting for the processing node, keyed by a per-run
+# token kept in state. The bytes themselves stay out of the graph state, which
+# astream_events copies into the events of every later node. The TTL only
+# bounds entries orphaned by a run that stopped between the two nodes.
+_pending_documents = TTLCache(maxsize=32, ttl=300)
+_pending_documents_lock = threading.Lock()
+
+def _stash_document(data: bytes) -> str:
+    key = uuid.uuid4().hex
+    with _pending_documents_lock:
+        _pending_documents[key] = data
+    return key
+
+def _take_document(key: Optional[str]) -> Optional[bytes]:
+    if not key:
+        return None
+    with _pending_documents_lock:
+        return _pending_documents.pop(key, None)
+
+def _download_bytes(url: str):
+    """
+    Download a document into memory in DOWNLOAD_CHUNK_SIZE pieces,
+    stopping as soon as it exceeds DOCUMENT_MAX_BYTES.
+
+    Returns:
+        The document's bytes
+
+    Raises:
+        requests.HTTPError: On an error status
+        ValueError: If the document is larger than DOCUMENT_MAX_BYTES
+    """
+    with get_http_session().get(url, stream=True, timeout=DEFAULT_TIMEOUT) as res:
+        logger.debug("[DOCUMENT_DOWNLOAD_NODE] HTTP Status: %s", res.status_code)
+        res.raise_for_status()
+        declared = res.headers.get("Content-Length")
+        if declared and declared.isdigit() and int(declared) > DOCUMENT_MAX_BYTES:
+            raise ValueError(f"Document too large: {declared} bytes (limit {DOCUMENT_MAX_BYTES})")
+
+        data = bytearray()
+        for chunk in res.iter_content(DOWNLOAD_CHUNK_SIZE):
+            data += chunk
+            if len(data) > DOCUMENT_MAX_BYTES:
+                raise ValueError(f"Document too large: over {DOCUMENT_MAX_BYTES} bytes")
+    return bytes(data)
+
+async def document_download_node(state: OrchestratorState) -> OrchestratorState:
+    logger.debug("[DOCUMENT_DOWNLOAD_NODE] STARTING DOCUMENT DOWNLOAD")
     url = state.get("document_url")
     if not url:
-        print("[DOCUMENT_DOWNLOAD_NODE] No document_url provided. Skipping download.")
-        print("[DOCUMENT_DOWNLOAD_NODE] State keys:", list(state.keys()))
+        logger.debug("[DOCUMENT_DOWNLOAD_NODE] No document_url provided. Skipping download.")
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("[DOCUMENT_DOWNLOAD_NODE] State keys: %s", list(state.keys()))
         return {}
     
-    print(f"[DOCUMENT_DOWNLOAD_NODE] Document URL detected: {url}")
-    print(f"[DOCUMENT_DOWNLOAD_NODE] Session ID: {state.get('session_id')}")
-    print(f"[DOCUMENT_DOWNLOAD_NODE] Safe Session ID: {state.get('safe_session_id')}")
-    print("[DOCUMENT_DOWNLOAD_NODE] Starting download...")
+    logger.debug("[DOCUMENT_DOWNLOAD_NODE] Document URL detected: %s", url)
+    logger.debug("[DOCUMENT_DOWNLOAD_NODE] Session ID: %s", state.get('session_id'))
+    logger.debug("[DOCUMENT_DOWNLOAD_NODE] Safe Session ID: %s", state.get('safe_session_id'))
+    logger.debug("[DOCUMENT_DOWNLOAD_NODE] Starting download...")
     
     try:
-        res = requests.get(url)
-        print(f"[DOCUMENT_DOWNLOAD_NODE] HTTP Status: {res.status_code}")
-        content = res.content
-        print(f"[DOCUMENT_DOWNLOAD_NODE] Downloaded {len(content)} bytes")
-        
-        tmp = tempfile.NamedTemporaryFile(delete=False)
-        tmp.write(content)
-        tmp.flush()
-        tmp.close()
-        print(f"[DOCUMENT_DOWNLOAD_NODE] Saved temp file at: {tmp.name}")
-        print("[DOCUMENT_DOWNLOAD_NODE] Download completed successfully")
-        return {"tmp_file_path": tmp.name}
+        # Network I/O runs in a worker thread, off the event loop
+        doc_bytes = await asyncio.to_thread(_download_bytes, url)
+        logger.debug("[DOCUMENT_DOWNLOAD_NODE] Downloaded %s bytes", len(doc_bytes))
+        logger.debug("[DOCUMENT_DOWNLOAD_NODE] Download completed successfully")
+        return {"doc_key": _stash_document(doc_bytes), "size_bytes": len(doc_bytes)}
         
     except Exception as e:
-        print(f"[DOCUMENT_DOWNLOAD_NODE] ERROR during download: {str(e)}")
-        import traceback
-        traceback.print_exc()
+        logger.exception("[DOCUMENT_DOWNLOAD_NODE] ERROR during download: %s", e)
         return {}
 
 def document_processing_node(state: OrchestratorState) -> OrchestratorState:
-    print("=" * 60)
-    print("[DOCUMENT_PROCESSING_NODE] STARTING DOCUMENT PROCESSING")
-    print("=" * 60)
-    tmp_file_path = state.get("tmp_file_path")
+    logger.debug("[DOCUMENT_PROCESSING_NODE] STARTING DOCUMENT PROCESSING")
+    # Taken out of the side channel, so the bytes are released with this node
+    doc_bytes = _take_document(state.get("doc_key"))
     safe_session_id = state.get("safe_session_id")
     
-    print(f"[DOCUMENT_PROCESSING_NODE] State keys: {list(state.keys())}")
-    print(f"[DOCUMENT_PROCESSING_NODE] Temp file path: {tmp_file_path}")
-    print(f"[DOCUMENT_PROCESSING_NODE] Safe session ID: {safe_session_id}")
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("[DOCUMENT_PROCESSING_NODE] State keys: %s", list(state.keys()))
+    logger.debug("[DOCUMENT_PROCESSING_NODE] Document size: %s", len(doc_bytes) if doc_bytes else 0)
+    logger.debug("[DOCUMENT_PROCESSING_NODE] Safe session ID: %s", safe_session_id)
     
-    if not tmp_file_path:
-        print("[DOCUMENT_PROCESSING_NODE] No temp file path found. Skipping processing.")
+    if not doc_bytes:
+        logger.debug("[DOCUMENT_PROCESSING_NODE] No downloaded document found. Skipping processing.")
         return {}
     
     if not safe_session_id:
-        print("[DOCUMENT_PROCESSING_NODE] No safe session ID found. Cannot process.")
+        logger.debug("[DOCUMENT_PROCESSING_NODE] No safe session ID found. Cannot process.")
         return {}
     
-    print(f"[DOCUMENT_PROCESSING_NODE] Processing temp file: {tmp_file_path}")
-    print(f"[DOCUMENT_PROCESSING_NODE] For session: {safe_session_id}")
-    print("[DOCUMENT_PROCESSING_NODE] Calling document processor...")
+    logger.debug("[DOCUMENT_PROCESSING_NODE] For session: %s", safe_session_id)
+    logger.debug("[DOCUMENT_PROCESSING_NODE] Calling document processor...")
     
     try:
-        result = _doc_processor.process(tmp_file_path, safe_session_id)
-        print(f"[DOCUMENT_PROCESSING_NODE] Processor result: {result}")
-        print(f"[DOCUMENT_PROCESSING_NODE] Processor result status: {result.get('status') if result else 'No result'}")
-        
-        # Clean up temp file
-        try:
-            os.remove(tmp_file_path)
-            print(f"[DOCUMENT_PROCESSING_NODE] Successfully removed temp file: {tmp_file_path}")
-        except Exception as e:
-            print(f"[DOCUMENT_PROCESSING_NODE] Failed to remove temp file: {e}")
+        result = _doc_processor.process_bytes(doc_bytes, safe_session_id)
+        logger.debug("[DOCUMENT_PROCESSING_NODE] Processor result: %s", result)
+        if result and result.get("status") == "success":
+            _mark_temp_table(safe_session_id)
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("[DOCUMENT_PROCESSING_NODE] Processor result status: %s", result.get('status') if result else 'No result')
         
-        print("[DOCUMENT_PROCESSING_NODE] Processing completed successfully")
-        return {}
+        logger.debug("[DOCUMENT_PROCESSING_NODE] Processing completed successfully")
+        return {"doc_key": None}
         
     except Exception as e:
-        print(f"[DOCUMENT_PROCESSING_NODE] ERROR during processing: {str(e)}")
-        import traceback
-        traceback.print_exc()
-        return {}
+        logger.exception("[DOCUMENT_PROCESSING_NODE] ERROR during processing: %s", e)
+        return {"doc_key": None}
 
-def document_retriever_node(state: OrchestratorState) -> OrchestratorState:
-    print("=" * 60)
-    print("[DOCUMENT_RETRIEVER_NODE] STARTING DOCUMENT RETRIEVAL")
-    print("=" * 60)
+async def document_retriever_node(state: OrchestratorState) -> OrchestratorState:
+    logger.debug("[DOCUMENT_RETRIEVER_NODE] STARTING DOCUMENT RETRIEVAL")
     question = state["message"]
     safe_session_id = state.get("safe_session_id")
     document_url = state.get("document_url")
     
-    print(f"[DOCUMENT_RETRIEVER_NODE] Question: {question[:100]}...")
-    print(f"[DOCUMENT_RETRIEVER_NODE] Safe session ID: {safe_session_id}")
-    print(f"[DOCUMENT_RETRIEVER_NODE] Document URL: {document_url}")
-    print(f"[DOCUMENT_RETRIEVER_NODE] State keys: {list(state.keys())}")
+    logger.debug("[DOCUMENT_RETRIEVER_NODE] Question: %.100s...", question)
+    logger.debug("[DOCUMENT_RETRIEVER_NODE] Safe session ID: %s", safe_session_id)
+    logger.debug("[DOCUMENT_RETRIEVER_NODE] Document URL: %s", document_url)
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("[DOCUMENT_RETRIEVER_NODE] State keys: %s", list(state.keys()))
     
     # Check if we have a document context to retrieve from
     if not safe_session_id:
-        print("[DOCUMENT_RETRIEVER_NODE] No safe session ID. Skipping temp retrieval.")
+        logger.debug("[DOCUMENT_RETRIEVER_NODE] No safe session ID. Skipping temp retrieval.")
         return {"doc_context": []}
     
-    print(f"[DOCUMENT_RETRIEVER_NODE] Calling temp retriever for session: {safe_session_id}")
-    print("[DOCUMENT_RETRIEVER_NODE] Attempting to retrieve chunks from temporary document store...")
+    logger.debug("[DOCUMENT_RETRIEVER_NODE] Calling temp retriever for session: %s", safe_session_id)
+    logger.debug("[DOCUMENT_RETRIEVER_NODE] Attempting to retrieve chunks from temporary document store...")
     
     try:
-        doc_results = _temp_retriever.retrieve_chunks(question, safe_session_id)
-        print(f"[DOCUMENT_RETRIEVER_NODE] Temp retriever returned: {type(doc_results)}")
-        print(f"[DOCUMENT_RETRIEVER_NODE] Temp retriever result: {doc_results}")
+        doc_results = await _temp_retriever.aretrieve_chunks(question, safe_session_id)
+        logger.debug("[DOCUMENT_RETRIEVER_NODE] Temp retriever returned: %s", type(doc_results))
+        logger.debug("[DOCUMENT_RETRIEVER_NODE] Temp retriever result: %s", doc_results)
         
         if isinstance(doc_results, dict):
             status = doc_results.get("status")
             chunks = doc_results.get("chunks", [])
-            print(f"[DOCUMENT_RETRIEVER_NODE] Retrieval status: {status}")
-            print(f"[DOCUMENT_RETRIEVER_NODE] Number of chunks: {len(chunks)}")
+            logger.debug("[DOCUMENT_RETRIEVER_NODE] Retrieval status: %s", status)
+            logger.debug("[DOCUMENT_RETRIEVER_NODE] Number of chunks: %s", len(chunks))
             
             if status == "success":
                 doc_context = chunks
             else:
-                print(f"[DOCUMENT_RETRIEVER_NODE] Retrieval failed with status: {status}")
+                logger.warning("[DOCUMENT_RETRIEVER_NODE] Retrieval failed with status: %s", status)
                 doc_context = []
         else:
-            print(f"[DOCUMENT_RETRIEVER_NODE] Unexpected result type: {type(doc_results)}")
+            logger.warning("[DOCUMENT_RETRIEVER_NODE] Unexpected result type: %s", type(doc_results))
             doc_context = []
         
-        print(f"[DOCUMENT_RETRIEVER_NODE] Final doc_context length: {len(doc_context)}")
+        logger.debug("[DOCUMENT_RETRIEVER_NODE] Final doc_context length: %s", len(doc_context))
         return {"doc_context": doc_context}
         
     except Exception as e:
-        print(f"[DOCUMENT_RETRIEVER_NODE] ERROR during retrieval: {str(e)}")
-        import traceback
-        traceback.print_exc()
+        logger.exception("[DOCUMENT_RETRIEVER_NODE] ERROR during retrieval: %s", e)
         return {"doc_context": []}
 
+# Sessions known to have a temp document table. Tables are never dropped, so
+# only positive lookups are cached: another worker may create the table at
+# any time, so a miss must always be re-checked.
+_temp_table_cache = TTLCache(maxsize=TEMP_TABLE_CACHE_SIZE, ttl=TEMP_TABLE_CACHE_TTL)
+_temp_table_lock = threading.Lock()
+
+def _mark_temp_table(safe_session_id: str) -> None:
+    with _temp_table_lock:
+        _temp_table_cache[safe_session_id] = True
+
+def _has_temp_table(safe_session_id: str) -> bool:
+    """Whether the session's temp document table exists (to_regclass, cached)."""
+    with _temp_table_lock:
+        if _temp_table_cache.get(safe_session_id):
+            return True
+    with get_db(autocommit=True) as conn:
+        cur = conn.cursor()
+        cur.execute("SELECT to_regclass(%s)", ("public." + session_table_name("temp_documents", safe_session_id),))
+        exists_row = cur.fetchone()
+        cur.close()
+    exists = bool(exists_row and exists_row[0])
+    if exists:
+        _mark_temp_table(safe_session_id)
+    return exists
+
 # --- Build the state graph ---
 def build_company_policy_graph():
     graph = StateGraph(OrchestratorState)
@@ -319,141 +434,115 @@ def build_company_policy_graph():
     graph.add_node("output", output_node)
 
     graph.add_edge(START, "input")
-    graph.add_edge("input", "history")
     
-    # Conditional: if document_url is provided, go through doc pipeline first; else go straight to policy
-    def route_after_history(state: OrchestratorState):
-        print("=" * 60)
-        print("[ROUTER] ROUTING AFTER HISTORY NODE")
-        print("=" * 60)
+    # History loading always runs alongside retrieval, since nothing before
+    # the LLM needs it. Conditional: if document_url is provided, go through
+    # doc pipeline first; else go straight to policy
+    def route_after_input(state: OrchestratorState):
+        logger.debug("[ROUTER] ROUTING AFTER INPUT NODE")
         safe_session_id = state.get("safe_session_id")
         document_url = state.get("document_url")
         
-        print(f"[ROUTER] Safe session ID: {safe_session_id}")
-        print(f"[ROUTER] Document URL: {document_url}")
-        print(f"[ROUTER] State keys: {list(state.keys())}")
+        logger.debug("[ROUTER] Safe session ID: %s", safe_session_id)
+        logger.debug("[ROUTER] Document URL: %s", document_url)
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("[ROUTER] State keys: %s", list(state.keys()))
         
         has_temp = False
         try:
             if safe_session_id:
-                print(f"[ROUTER] Checking for existing temp table: temp_documents_{safe_session_id}")
-                conn = get_db()
-                cur = conn.cursor()
-                cur.execute("SELECT to_regclass(%s)", (f"public.temp_documents_{safe_session_id}",))
-                exists_row = cur.fetchone()
-                cur.close()
-                conn.close()
-                has_temp = bool(exists_row and exists_row[0])
-                print(f"[ROUTER] Temp table exists: {has_temp}")
+                logger.debug("[ROUTER] Checking for existing temp table: temp_documents_%s", safe_session_id)
+                has_temp = _has_temp_table(safe_session_id)
+                logger.debug("[ROUTER] Temp table exists: %s", has_temp)
         except Exception as e:
-            print(f"[ROUTER] Error checking temp table: {e}")
+            logger.error("[ROUTER] Error checking temp table: %s", e)
             has_temp = False
 
         if has_temp:
-            print("[ROUTER] Decision: has_doc (existing temp table found)")
-            return "has_doc"  # already processed doc for this session
+            logger.debug("[ROUTER] Decision: has_doc (existing temp table found)")
+            # Already processed doc for this session: retrieve policy and
+            # document context concurrently
+            return ["history", "policy", "doc"]
         if document_url:
-            print("[ROUTER] Decision: with_doc (new document URL provided)")
-            return "with_doc"  # new doc provided, needs processing
-        print("[ROUTER] Decision: no_doc (no document)")
-        return "no_doc"
+            logger.debug("[ROUTER] Decision: with_doc (new document URL provided)")
+            return ["history", "with_doc"]  # new doc provided, needs processing
+        logger.debug("[ROUTER] Decision: no_doc (no document)")
+        return ["history", "policy"]
 
     graph.add_conditional_edges(
-        "history",
-        route_after_history,
+        "input",
+        route_after_input,
         {
+            "history": "history",
             "with_doc": "doc_download",
-            "has_doc": "policy_retriever",
-            "no_doc": "policy_retriever",
+            "policy": "policy_retriever",
+            "doc": "doc_retriever",
         },
     )
 
     graph.add_edge("doc_download", "doc_process")
+    # Fan out: both retrievers run in the same step and fan back in at
+    # context_combine, which then runs once
     graph.add_edge("doc_process", "policy_retriever")
-
-    # Conditional: after policy retrieval, if we have a document, also retrieve from temp; else skip to combine
-    def route_after_policy(state: OrchestratorState):
-        print("=" * 60)
-        print("[ROUTER] ROUTING AFTER POLICY RETRIEVAL")
-        print("=" * 60)
-        safe_session_id = state.get("safe_session_id")
-        document_url = state.get("document_url")
-        
-        print(f"[ROUTER] Safe session ID: {safe_session_id}")
-        print(f"[ROUTER] Document URL: {document_url}")
-        
-        has_temp = False
-        try:
-            if safe_session_id:
-                print(f"[ROUTER] Checking for temp table: temp_documents_{safe_session_id}")
-                conn = get_db()
-                cur = conn.cursor()
-                cur.execute("SELECT to_regclass(%s)", (f"public.temp_documents_{safe_session_id}",))
-                exists_row = cur.fetchone()
-                cur.close()
-                conn.close()
-                has_temp = bool(exists_row and exists_row[0])
-                print(f"[ROUTER] Temp table exists: {has_temp}")
-        except Exception as e:
-            print(f"[ROUTER] Error checking temp table after policy: {e}")
-            has_temp = False
-
-        if has_temp:
-            print("[ROUTER] Decision: need_doc (temp table found, will retrieve document context)")
-            return "need_doc"
-        else:
-            print("[ROUTER] Decision: no_doc_needed (no temp table, skip document retrieval)")
-            return "no_doc_needed"
-
-    graph.add_conditional_edges(
-        "policy_retriever",
-        route_after_policy,
-        {
-            "need_doc": "doc_retriever",
-            "no_doc_needed": "context_combine",
-        },
-    )
-
+    graph.add_edge("doc_process", "doc_retriever")
+    graph.add_edge("policy_retriever", "context_combine")
     graph.add_edge("doc_retriever", "context_combine")
-    graph.add_edge("context_combine", "llm")
+    # The LLM waits for both the history and the combined context, whichever
+    # branch finishes last
+    graph.add_edge(["history", "context_combine"], "llm")
     graph.add_edge("llm", "session_update")
     graph.add_edge("session_update", "output")
     graph.add_edge("output", END)
 
     return graph.compile()
 
+@functools.lru_cache(maxsize=1)
+def get_company_policy_app():
+    """Compiled company policy graph, built once and shared by all requests."""
+    return build_company_policy_graph()
+
 # --- Run the graph safely ---
-def run_company_policy(session_id: str, message: str, document_url: str = None) -> str:
-    print(f"[RUN_COMPANY_POLICY] Starting company policy graph with session_id: {session_id}")
-    print(f"[RUN_COMPANY_POLICY] Message: {message[:100]}...")
+async def _ainvoke_and_persist(app, initial_state: Dict[str, Any]) -> Dict[str, Any]:
+    """Run the graph, then wait for its background session write."""
+    final_state = await app.ainvoke(initial_state)
+    await _session_orchestrator(initial_state).wait_for_pending_writes()
+    return final_state
+
+def run_company_policy(session_id: str, message: str, user_id: str, document_url: str = None) -> str:
+    logger.debug("[RUN_COMPANY_POLICY] Starting company policy graph with session_id: %s", session_id)
+    logger.debug("[RUN_COMPANY_POLICY] Message: %.100s...", message)
     if document_url:
-        print(f"[RUN_COMPANY_POLICY] Document URL detected: {document_url}")
+        logger.debug("[RUN_COMPANY_POLICY] Document URL detected: %s", document_url)
     
     try:
-        app = build_company_policy_graph()
+        app = get_company_policy_app()
         initial_state: OrchestratorState = {
             "session_id": session_id,
             "message": message,
             "document_url": document_url,
+            "user_id": user_id,
+            "orchestrator": _session_orchestrator({}),
         }
-        print(f"[RUN_COMPANY_POLICY] Initial state: {list(initial_state.keys())}")
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("[RUN_COMPANY_POLICY] Initial state: %s", list(initial_state.keys()))
         
-        print("[RUN_COMPANY_POLICY] Invoking graph...")
-        final_state = app.invoke(initial_state)
-        print(f"[RUN_COMPANY_POLICY] Final state keys: {list(final_state.keys())}")
-        print(f"[RUN_COMPANY_POLICY] Final state types: {[(k, type(v)) for k, v in final_state.items()]}")
+        logger.debug("[RUN_COMPANY_POLICY] Invoking graph...")
+        # Retriever and LLM nodes are async, so the graph must run on an event loop
+        final_state = asyncio.run(_ainvoke_and_persist(app, initial_state))
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("[RUN_COMPANY_POLICY] Final state keys: %s", list(final_state.keys()))
+            logger.debug("[RUN_COMPANY_POLICY] Final state types: %s", [(k, type(v)) for k, v in final_state.items()])
         
         # Extract just the content string like the old route
         # The output_node puts the response in "content" key, not "response"
         content = final_state.get("content", "") or final_state.get("response", "")
-        print(f"[RUN_COMPANY_POLICY] Extracted content: {repr(content[:100]) if content else 'None'}")
-        print(f"[RUN_COMPANY_POLICY] Returning content type: {type(content)}")
-        print(f"[RUN_COMPANY_POLICY] Content length: {len(content) if content else 0}")
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("[RUN_COMPANY_POLICY] Extracted content: %s", repr(content[:100]) if content else 'None')
+            logger.debug("[RUN_COMPANY_POLICY] Returning content type: %s", type(content))
+            logger.debug("[RUN_COMPANY_POLICY] Content length: %s", len(content) if content else 0)
         
         return content
         
     except Exception as e:
-        print(f"[RUN_COMPANY_POLICY] ERROR: {str(e)}")
-        import traceback
-        traceback.print_exc()
-        return f"Error processing request: {str(e)}"
\ No newline at end of file
+        logger.exception("[RUN_COMPANY_POLICY] ERROR: %s", e)
+        return f"Error processing request: {str(e)}"
@@ -0,0 +1,48 @@
+"""Sliding window over session history for LLM calls.
+
+Every turn adds a human and an AI message, and the whole history used to be
+sent to Gemini, so prefill cost grew with the conversation. Only the copy
+sent to the model is trimmed; stored history is untouched.
+"""
+
+import os
+from typing import List
+
+from langchain_core.messages import AIMessage, BaseMessage
+
+MAX_HISTORY_MESSAGES = int(os.getenv("MAX_HISTORY_MESSAGES", "20"))
+MAX_HISTORY_CHARS = int(os.getenv("MAX_HISTORY_CHARS", "16000"))
+
+
+def _content_len(message: BaseMessage) -> int:
+    content = message.content
+    return len(content) if isinstance(content, str) else len(str(content))
+
+
+def trim_history(
+    history: List[BaseMessage],
+    max_messages: int = MAX_HISTORY_MESSAGES,
+    max_chars: int = MAX_HISTORY_CHARS,
+) -> List[BaseMessage]:
+    """
+    Keep the most recent messages within a message count and a character
+    budget (a cheap stand-in for tokens), dropping the oldest first.
+
+    Args:
+        history: Full session history, oldest first
+        max_messages: Maximum number of messages to keep
+        max_chars: Maximum total content length of the kept messages
+
+    Returns:
+        The trimmed history; never starts with an AI reply cut off from
+        its question
+    """
+    window = history[-max_messages:] if max_messages > 0 else []
+    total = sum(_content_len(m) for m in window)
+    start = 0
+    while start < len(window) and total > max_chars:
+        total -= _content_len(window[start])
+        start += 1
+    while start < len(window) and isinstance(window[start], AIMessage):
+        start += 1
+    return window[start:] if start else window
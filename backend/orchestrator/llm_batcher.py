@@ -0,0 +1,98 @@
+"""Micro-batching front end for the chat LLM (or a prompt | LLM chain).
+
+Concurrent graph runs share one event loop (see ``executor``), so their LLM
+calls can be collected for up to ``LLM_BATCH_MAX_WAIT_MS`` (or until
+``LLM_BATCH_MAX_SIZE`` are waiting) and dispatched together. Gemini has no
+batched chat endpoint, so a flush starts one ``ainvoke`` per conversation
+at once; they share the model client's connection pool and each caller is
+resumed as soon as its own response arrives.
+
+Each call runs in the context captured at submit time, so LangGraph's
+callbacks (and with them ``astream_events`` token streaming) still reach
+the stream that made the request.
+"""
+
+import asyncio
+import contextvars
+import os
+from typing import Any
+
+LLM_BATCH_MAX_SIZE = int(os.getenv("LLM_BATCH_MAX_SIZE", "16"))
+LLM_BATCH_MAX_WAIT_MS = float(os.getenv("LLM_BATCH_MAX_WAIT_MS", "10"))
+
+
+class BatchedLLM:
+    """Collects ``submit`` calls into small batches per event loop."""
+
+    def __init__(self, llm, max_batch: int = LLM_BATCH_MAX_SIZE, max_wait_ms: float = LLM_BATCH_MAX_WAIT_MS):
+        self._llm = llm
+        self._max_batch = max(1, max_batch)
+        self._max_wait = max(0.0, max_wait_ms) / 1000
+        # One queue and flush task per loop; graphs may also run under
+        # asyncio.run(), which creates a short-lived loop per call. The queue
+        # holds its loop, so entries are dropped when the flush task ends
+        # (asyncio.run cancels it on exit) rather than left to the GC
+        self._queues = {}
+
+    async def submit(self, inputs: Any):
+        """
+        Queue a conversation for the next batch and wait for its response.
+
+        Args:
+            inputs: Input for the wrapped runnable's ``ainvoke`` (messages
+                for a bare model, template variables for a chain)
+
+        Returns:
+            The model's response message
+        """
+        loop = asyncio.get_running_loop()
+        queue = self._queues.get(loop)
+        if queue is None:
+            queue = self._queues[loop] = asyncio.Queue()
+            loop.create_task(self._flush_loop(loop, queue))
+        future = loop.create_future()
+        queue.put_nowait((inputs, contextvars.copy_context(), future))
+        return await future
+
+    async def _flush_loop(self, loop, queue: asyncio.Queue) -> None:
+        try:
+            while True:
+                batch = [await queue.get()]
+                deadline = loop.time() + self._max_wait
+                while len(batch) < self._max_batch:
+                    timeout = deadline - loop.time()
+                    if timeout <= 0:
+                        break
+                    try:
+                        batch.append(await asyncio.wait_for(queue.get(), timeout))
+                    except asyncio.TimeoutError:
+                        break
+                for inputs, context, future in batch:
+                    if not future.done():
+                        self._dispatch(loop, inputs, context, future)
+        finally:
+            if self._queues.get(loop) is queue:
+                del self._queues[loop]
+            # Anything still queued would otherwise wait on a dead loop
+            while not queue.empty():
+                _, _, future = queue.get_nowait()
+                future.cancel()
+
+    def _dispatch(self, loop, inputs, context, future) -> None:
+        # Tasks copy the current context when created; create this one inside
+        # the caller's context so its run config and callbacks apply
+        task = context.run(loop.create_task, self._llm.ainvoke(inputs))
+
+        def resolve(done):
+            if future.done():
+                return
+            if done.cancelled():
+                future.cancel()
+            elif done.exception() is not None:
+                future.set_exception(done.exception())
+            else:
+                future.set_result(done.result())
+
+        task.add_done_callback(resolve)
+        # Caller gave up (e.g. client disconnected): stop its request too
+        future.add_done_callback(lambda f: task.cancel() if f.cancelled() else None)
@@ -1,10 +1,12 @@
 
-from typing import Dict, Any, List, Optional
+import logging
+from functools import lru_cache
+from typing import Dict, Any, List, Optional, Tuple
 from langchain_core.messages import BaseMessage, HumanMessage, SystemMessage, AIMessage
 from langchain_google_genai import ChatGoogleGenerativeAI
 import os
-from .graph import build_company_policy_graph
-from .general_graph import build_general_purpose_graph
+from .graph import get_company_policy_app
+from .general_graph import get_general_purpose_app
 from .executor import create_stream_generator
 from .event_formatter import format_event_for_ui, serialize_payload_for_sse
 import asyncio
@@ -13,6 +15,15 @@ import threading
 import json
 from db.repositories.chat_repository import ChatRepository
 
+logger = logging.getLogger(__name__)
+
+# Optional: a C Aho-Corasick automaton scans for every keyword in one pass;
+# without it the classifier falls back to per-keyword substring checks
+try:
+    import ahocorasick
+except ImportError:
+    ahocorasick = None
+
 # --- Intent classification prompts ---
 INTENT_CLASSIFICATION_PROMPT = """
 You are an intent classifier for a policy compliance system. Analyze the user's message and classify it into one of these categories:
@@ -40,6 +51,102 @@ Examples:
 When in doubt, classify as "general" to ensure unrelated questions don't get answered.
 """
 
+# --- Rule-based intent keywords ---
+# Built once at import; tuples keep the original matching order
+# Company policy keywords
+POLICY_KEYWORDS: Tuple[str, ...] = (
+    'policy', 'policies', 'hr', 'human resources', 'vacation', 'leave', 'sick', 'holiday',
+    'dress code', 'attendance', 'remote work', 'work from home', 'benefits', 'insurance',
+    'harassment', 'discrimination', 'complaint', 'procedure', 'handbook', 'employee',
+    'employment', 'contract', 'agreement', 'disciplinary', 'termination', 'salary',
+    'pay', 'compensation', 'bonus', 'raise', 'promotion', 'performance', 'training',
+    'development', 'onboarding', 'orientation', 'safety', 'security', 'compliance',
+    'regulation', 'legal', 'law', 'rights', 'responsibilities', 'workplace', 'office',
+    'company', 'organization', 'corporate', 'business', 'work', 'job', 'career',
+)
+
+# Casual conversation keywords
+CASUAL_KEYWORDS: Tuple[str, ...] = (
+    'hello', 'hi', 'hey', 'good morning', 'good afternoon', 'good evening',
+    'how are you', 'what\'s up', 'thanks', 'thank you', 'bye', 'goodbye',
+    'see you', 'have a good', 'nice to meet', 'pleasure', 'welcome',
+)
+
+# System capability keywords
+CAPABILITY_KEYWORDS: Tuple[str, ...] = (
+    'what can you', 'what do you', 'how can you', 'what are you', 'help me',
+    'assist', 'support', 'capabilities', 'features', 'functions', 'do for',
+)
+
+# Conversation history keywords
+HISTORY_KEYWORDS: Tuple[str, ...] = (
+    'previous', 'before', 'earlier', 'last time', 'conversation', 'chat',
+    'history', 'asked', 'questions', 'messages', 'what did i', 'what was',
+    'recall', 'remember', 'past', 'ago',
+)
+
+# Checked in this order; the first category with a match decides the intent
+_KEYWORD_GROUPS = (
+    ("policy", POLICY_KEYWORDS, "company_policy"),
+    ("casual", CASUAL_KEYWORDS, "general"),
+    ("capability", CAPABILITY_KEYWORDS, "general"),
+    ("history", HISTORY_KEYWORDS, "general"),
+)
+
+
+def _build_keyword_automaton():
+    """Aho-Corasick automaton over all keywords, or None without pyahocorasick."""
+    if ahocorasick is None:
+        return None
+    categories: Dict[str, set] = {}
+    for category, keywords, _ in _KEYWORD_GROUPS:
+        for keyword in keywords:
+            categories.setdefault(keyword, set()).add(category)
+    automaton = ahocorasick.Automaton()
+    for keyword, keyword_categories in categories.items():
+        automaton.add_word(keyword, (keyword, tuple(keyword_categories)))
+    automaton.make_automaton()
+    return automaton
+
+
+_KEYWORD_AUTOMATON = _build_keyword_automaton()
+
+
+def _count_keywords(message_lower: str) -> Dict[str, int]:
+    """Number of distinct keywords of each category found in the message."""
+    seen = set()
+    counts: Dict[str, int] = {}
+    for _, (keyword, keyword_categories) in _KEYWORD_AUTOMATON.iter(message_lower):
+        if keyword in seen:
+            continue
+        seen.add(keyword)
+        for category in keyword_categories:
+            counts[category] = counts.get(category, 0) + 1
+    return counts
+
+
+@lru_cache(maxsize=4096)
+def _classify_by_keywords(message_lower: str) -> Optional[Tuple[str, str, int]]:
+    """
+    Keyword classification of a normalized message, memoized since greetings
+    and capability questions recur verbatim; the keywords never change.
+
+    Returns:
+        (intent, matched category, number of matched keywords), or None when
+        no keyword matches
+    """
+    # One pass over the message when the automaton is available
+    counts = _count_keywords(message_lower) if _KEYWORD_AUTOMATON is not None else None
+    for category, keywords, intent in _KEYWORD_GROUPS:
+        if counts is not None:
+            matches = counts.get(category, 0)
+        else:
+            matches = sum(1 for keyword in keywords if keyword in message_lower)
+        if matches > 0:
+            return intent, category, matches
+    return None
+
+
 class Orchestrator:
     """
     Central orchestrator that classifies user intents and routes to appropriate pipelines.
@@ -54,133 +161,111 @@ class Orchestrator:
         self.company_policy_graph = None
         self.general_purpose_graph = None
         self.chat_repo = ChatRepository()
-        print("[ORCHESTRATOR] Initialized orchestrator")
+        # Strong references to in-flight background session writes
+        self._pending_writes = set()
+        logger.debug("[ORCHESTRATOR] Initialized orchestrator")
 
     def get_session_history(self, session_id: str, user_id: str) -> List[BaseMessage]:
         """Load session history from the database."""
+        return self.load_session_history(session_id, user_id)[0]
+
+    def load_session_history(self, session_id: str, user_id: str) -> Tuple[List[BaseMessage], List[Dict[str, str]]]:
+        """
+        Load session history from the database as LangChain messages and,
+        built in the same pass, the serialized form returned to clients
+        (``{"type", "content"}`` dicts, without the placeholder system message).
+        """
         try:
             db_messages = self.chat_repo.get_messages(session_id)
             history = []
+            serialized = []
             for msg in db_messages:
                 if msg['role'] == 'user':
                     history.append(HumanMessage(content=msg['content']))
+                    serialized.append({"type": "HumanMessage", "content": msg['content']})
                 elif msg['role'] == 'assistant':
                     history.append(AIMessage(content=msg['content']))
+                    serialized.append({"type": "AIMessage", "content": msg['content']})
             if not history:
                 history = [SystemMessage(content="You are a helpful assistant.")]
-            return history
+            return history, serialized
         except Exception as e:
-            print(f"[ORCHESTRATOR] Failed to load history: {e}")
-            return [SystemMessage(content="You are a helpful assistant.")]
+            logger.warning("[ORCHESTRATOR] Failed to load history: %s", e)
+            return [SystemMessage(content="You are a helpful assistant.")], []
 
     def update_session_history(self, session_id: str, user_id: str, human_message: str, ai_response: str):
         """Save conversation to the database."""
         try:
-            # Ensure session exists
-            self.chat_repo.get_or_create_session(
+            # Ensure session exists and save both turns in a single round-trip
+            self.chat_repo.create_session_with_messages(
                 session_id=session_id,
                 user_id=user_id,
-                title=human_message[:50] if human_message else "New Chat"
-            )
-            # Save user message
-            self.chat_repo.save_message(
-                session_id=session_id,
-                role='user',
-                content=human_message,
-                metadata=None
-            )
-            # Save assistant response
-            self.chat_repo.save_message(
-                session_id=session_id,
-                role='assistant',
-                content=ai_response,
-                metadata=None
+                title=human_message[:50] if human_message else "New Chat",
+                messages=[
+                    {'role': 'user', 'content': human_message},
+                    {'role': 'assistant', 'content': ai_response},
+                ]
             )
-            print(f"[ORCHESTRATOR] Saved conversation to database - Session: {session_id}")
+            logger.debug("[ORCHESTRATOR] Saved conversation to database - Session: %s", session_id)
         except Exception as e:
-            print(f"[ORCHESTRATOR] Failed to save history: {e}")
+            logger.warning("[ORCHESTRATOR] Failed to save history: %s", e)
     
+    async def aupdate_session_history(self, session_id: str, user_id: str, human_message: str, ai_response: str):
+        """Async wrapper around ``update_session_history``; the write runs in a worker thread."""
+        await asyncio.to_thread(self.update_session_history, session_id, user_id, human_message, ai_response)
+
+    def schedule_session_update(self, session_id: str, user_id: str, human_message: str, ai_response: str) -> asyncio.Task:
+        """
+        Save a conversation turn in the background on the running event loop,
+        so the response does not wait for the database write.
+        """
+        task = asyncio.get_running_loop().create_task(
+            self.aupdate_session_history(session_id, user_id, human_message, ai_response)
+        )
+        self._pending_writes.add(task)
+        task.add_done_callback(self._pending_writes.discard)
+        return task
+
+    async def wait_for_pending_writes(self):
+        """
+        Wait for background session writes started on the running loop.
+        Callers that close their loop afterwards (``asyncio.run``) must call
+        this, or the writes would be cancelled.
+        """
+        loop = asyncio.get_running_loop()
+        tasks = [task for task in list(self._pending_writes) if task.get_loop() is loop]
+        if tasks:
+            await asyncio.shield(asyncio.gather(*tasks))
+
     def classify_intent(self, message: str, session_id: str) -> str:
         """Classify user intent using rule-based approach first, then LLM if needed."""
-        print(f"[ORCHESTRATOR] Classifying intent for message: {message[:100]}...")
+        logger.debug("[ORCHESTRATOR] Classifying intent for message: %.100s...", message)
         
         # First try rule-based classification
         intent = self._rule_based_classification(message)
         if intent:
-            print(f"[ORCHESTRATOR] Rule-based classification: {intent}")
+            logger.debug("[ORCHESTRATOR] Rule-based classification: %s", intent)
             return intent
         
         # If rule-based fails, use LLM
-        print(f"[ORCHESTRATOR] Rule-based classification uncertain, using LLM...")
+        logger.debug("[ORCHESTRATOR] Rule-based classification uncertain, using LLM...")
         return self._llm_classification(message, session_id)
     
     def _rule_based_classification(self, message: str) -> str:
         """Rule-based intent classification using keywords."""
-        message_lower = message.lower().strip()
-        
-        # Company policy keywords
-        policy_keywords = [
-            'policy', 'policies', 'hr', 'human resources', 'vacation', 'leave', 'sick', 'holiday',
-            'dress code', 'attendance', 'remote work', 'work from home', 'benefits', 'insurance',
-            'harassment', 'discrimination', 'complaint', 'procedure', 'handbook', 'employee',
-            'employment', 'contract', 'agreement', 'disciplinary', 'termination', 'salary',
-            'pay', 'compensation', 'bonus', 'raise', 'promotion', 'performance', 'training',
-            'development', 'onboarding', 'orientation', 'safety', 'security', 'compliance',
-            'regulation', 'legal', 'law', 'rights', 'responsibilities', 'workplace', 'office',
-            'company', 'organization', 'corporate', 'business', 'work', 'job', 'career'
-        ]
-        
-        # Casual conversation keywords
-        casual_keywords = [
-            'hello', 'hi', 'hey', 'good morning', 'good afternoon', 'good evening',
-            'how are you', 'what\'s up', 'thanks', 'thank you', 'bye', 'goodbye',
-            'see you', 'have a good', 'nice to meet', 'pleasure', 'welcome'
-        ]
-        
-        # System capability keywords
-        capability_keywords = [
-            'what can you', 'what do you', 'how can you', 'what are you', 'help me',
-            'assist', 'support', 'capabilities', 'features', 'functions', 'do for'
-        ]
-        
-        # Conversation history keywords
-        history_keywords = [
-            'previous', 'before', 'earlier', 'last time', 'conversation', 'chat',
-            'history', 'asked', 'questions', 'messages', 'what did i', 'what was',
-            'recall', 'remember', 'past', 'earlier', 'ago'
-        ]
-        
-        # Check for policy keywords
-        policy_matches = sum(1 for keyword in policy_keywords if keyword in message_lower)
-        if policy_matches > 0:
-            print(f"[ORCHESTRATOR] Found {policy_matches} policy keywords")
-            return "company_policy"
-        
-        # Check for casual conversation
-        casual_matches = sum(1 for keyword in casual_keywords if keyword in message_lower)
-        if casual_matches > 0:
-            print(f"[ORCHESTRATOR] Found {casual_matches} casual keywords")
-            return "general"
-        
-        # Check for system capability questions
-        capability_matches = sum(1 for keyword in capability_keywords if keyword in message_lower)
-        if capability_matches > 0:
-            print(f"[ORCHESTRATOR] Found {capability_matches} capability keywords")
-            return "general"
-        
-        # Check for conversation history questions
-        history_matches = sum(1 for keyword in history_keywords if keyword in message_lower)
-        if history_matches > 0:
-            print(f"[ORCHESTRATOR] Found {history_matches} history keywords")
-            return "general"
+        match = _classify_by_keywords(message.lower().strip())
+        if match:
+            intent, category, matches = match
+            logger.debug("[ORCHESTRATOR] Found %s %s keywords", matches, category)
+            return intent
         
         # If no clear matches, return None to trigger LLM classification
-        print(f"[ORCHESTRATOR] No clear rule-based classification found")
+        logger.debug("[ORCHESTRATOR] No clear rule-based classification found")
         return None
     
     def _llm_classification(self, message: str, session_id: str, user_id: Optional[str] = None) -> str:
         """LLM-based intent classification as fallback."""
-        print(f"[ORCHESTRATOR] Using LLM for intent classification...")
+        logger.debug("[ORCHESTRATOR] Using LLM for intent classification...")
         
         try:
             # Get session history for context
@@ -198,63 +283,61 @@ class Orchestrator:
             
             # Validate intent
             if intent not in ["company_policy", "general"]:
-                print(f"[ORCHESTRATOR] Invalid LLM intent '{intent}', defaulting to 'general'")
+                logger.warning("[ORCHESTRATOR] Invalid LLM intent '%s', defaulting to 'general'", intent)
                 intent = "general"
             
-            print(f"[ORCHESTRATOR] LLM classified intent: {intent}")
+            logger.debug("[ORCHESTRATOR] LLM classified intent: %s", intent)
             return intent
             
         except Exception as e:
-            print(f"[ORCHESTRATOR] Error in LLM classification: {e}")
+            logger.error("[ORCHESTRATOR] Error in LLM classification: %s", e)
             return "general"  # Default fallback
     
     def get_graph(self, intent: str):
         """Get the appropriate graph for the intent."""
-        print(f"[ORCHESTRATOR] Getting graph for intent: {intent}")
+        logger.debug("[ORCHESTRATOR] Getting graph for intent: %s", intent)
         
         if intent == "company_policy":
-            print(f"[ORCHESTRATOR] Routing to COMPANY POLICY pipeline")
+            logger.debug("[ORCHESTRATOR] Routing to COMPANY POLICY pipeline")
             if self.company_policy_graph is None:
-                print(f"[ORCHESTRATOR] Building company policy graph...")
-                self.company_policy_graph = build_company_policy_graph()
-                print("[ORCHESTRATOR] Company policy graph built successfully")
+                logger.debug("[ORCHESTRATOR] Building company policy graph...")
+                self.company_policy_graph = get_company_policy_app()
+                logger.debug("[ORCHESTRATOR] Company policy graph built successfully")
             else:
-                print(f"[ORCHESTRATOR] Using existing company policy graph")
+                logger.debug("[ORCHESTRATOR] Using existing company policy graph")
             return self.company_policy_graph
         elif intent == "general":
-            print(f"[ORCHESTRATOR] Routing to GENERAL PURPOSE pipeline")
+            logger.debug("[ORCHESTRATOR] Routing to GENERAL PURPOSE pipeline")
             if self.general_purpose_graph is None:
-                print(f"[ORCHESTRATOR] Building general purpose graph...")
-                self.general_purpose_graph = build_general_purpose_graph()
-                print("[ORCHESTRATOR] General purpose graph built successfully")
+                logger.debug("[ORCHESTRATOR] Building general purpose graph...")
+                self.general_purpose_graph = get_general_purpose_app()
+                logger.debug("[ORCHESTRATOR] General purpose graph built successfully")
             else:
-                print(f"[ORCHESTRATOR] Using existing general purpose graph")
+                logger.debug("[ORCHESTRATOR] Using existing general purpose graph")
             return self.general_purpose_graph
         else:
-            print(f"[ORCHESTRATOR] ERROR: Unknown intent '{intent}'")
+            logger.error("[ORCHESTRATOR] ERROR: Unknown intent '%s'", intent)
             raise ValueError(f"Unknown intent: {intent}")
     
     def create_stream_generator(self, session_id: str, message: str, document_url: Optional[str] = None, user_id: Optional[str] = None):
         """Create a stream generator that routes through the orchestrator."""
-        print("=" * 80)
-        print(f"[ORCHESTRATOR] Creating stream generator for session: {session_id}")
-        print(f"[ORCHESTRATOR] Message: {message[:100]}...")
+        logger.debug("[ORCHESTRATOR] Creating stream generator for session: %s", session_id)
+        logger.debug("[ORCHESTRATOR] Message: %.100s...", message)
         if document_url:
-            print(f"[ORCHESTRATOR] Document URL: {document_url}")
-        print("=" * 80)
+            logger.debug("[ORCHESTRATOR] Document URL: %s", document_url)
         
         # Classify intent
-        print(f"[ORCHESTRATOR] Step 1: Classifying intent...")
+        logger.debug("[ORCHESTRATOR] Step 1: Classifying intent...")
         intent = self.classify_intent(message, session_id)
-        print(f"[ORCHESTRATOR] Intent classification result: {intent}")
+        logger.debug("[ORCHESTRATOR] Intent classification result: %s", intent)
         
         # Get appropriate graph
-        print(f"[ORCHESTRATOR] Step 2: Getting appropriate graph...")
+        logger.debug("[ORCHESTRATOR] Step 2: Getting appropriate graph...")
         graph = self.get_graph(intent)
-        print(f"[ORCHESTRATOR] Graph obtained: {type(graph).__name__}")
+        logger.debug("[ORCHESTRATOR] Graph obtained: %s", type(graph).__name__)
         
         # Create initial state with orchestrator context
-        print(f"[ORCHESTRATOR] Step 3: Creating initial state...")
+        logger.debug("[ORCHESTRATOR] Step 3: Creating initial state...")
         initial_state = {
             "session_id": session_id,
             "message": message,
@@ -264,15 +347,15 @@ class Orchestrator:
             "user_id": user_id,
         }
         
-        print(f"[ORCHESTRATOR] Initial state created with keys: {list(initial_state.keys())}")
-        print(f"[ORCHESTRATOR] Intent being passed to graph: {intent}")
-        print(f"[ORCHESTRATOR] Final routing decision: {intent.upper()} pipeline")
-        print("=" * 80)
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("[ORCHESTRATOR] Initial state created with keys: %s", list(initial_state.keys()))
+            logger.debug("[ORCHESTRATOR] Intent being passed to graph: %s", intent)
+            logger.debug("[ORCHESTRATOR] Final routing decision: %s pipeline", intent.upper())
         
         # Create stream generator using the executor
-        print(f"[ORCHESTRATOR] Step 4: Creating stream generator...")
+        logger.debug("[ORCHESTRATOR] Step 4: Creating stream generator...")
         stream_gen = create_stream_generator(graph, initial_state)
-        print(f"[ORCHESTRATOR] Stream generator created successfully")
+        logger.debug("[ORCHESTRATOR] Stream generator created successfully")
         
         return stream_gen
     
@@ -293,7 +376,7 @@ class Orchestrator:
         setattr(self, f"_last_intent_{session_id}", context_updates.get("intent"))
         if "context_data" in context_updates:
             setattr(self, f"_context_data_{session_id}", context_updates["context_data"])
-        print(f"[ORCHESTRATOR] Updated global context for session: {session_id}")
+        logger.debug("[ORCHESTRATOR] Updated global context for session: %s", session_id)
 
 
 # Global orchestrator instance
@@ -303,9 +386,9 @@ def get_orchestrator() -> Orchestrator:
     """Get the global orchestrator instance."""
     global _orchestrator
     if _orchestrator is None:
-        print("[ORCHESTRATOR] Creating new global orchestrator instance...")
+        logger.debug("[ORCHESTRATOR] Creating new global orchestrator instance...")
         _orchestrator = Orchestrator()
-        print("[ORCHESTRATOR] Global orchestrator instance created successfully")
+        logger.debug("[ORCHESTRATOR] Global orchestrator instance created successfully")
     else:
-        print("[ORCHESTRATOR] Using existing global orchestrator instance")
+        logger.debug("[ORCHESTRATOR] Using existing global orchestrator instance")
     return _orchestrator
@@ -0,0 +1,166 @@
+"""Two-tier response cache for the general-purpose chat pipeline.
+
+Small talk ("hello", "what can you do?") makes up much of the general
+traffic and its answers barely vary, yet each message paid a full Gemini
+round-trip. Responses are cached by the bare user message:
+
+* L1, exact: a TTL map keyed by a hash of the normalized message.
+* L2, semantic: cosine similarity against recently cached messages, using
+  the shared query-embedding cache, so close paraphrases also hit. Only
+  consulted when L1 misses and the message is at least
+  ``SEMANTIC_CACHE_MIN_CHARS`` long: very short messages gain little from
+  it, and one word ("can't") flips their meaning while barely moving the
+  embedding. Entries only match messages with the same negations.
+
+The cache is shared by all users, so answers that depend on the conversation
+so far or on anything user-specific must not be cached; callers decide when
+a lookup is safe (see ``general_graph``).
+"""
+
+import hashlib
+import logging
+import os
+import re
+import threading
+from typing import Callable, FrozenSet, Optional, Tuple
+
+import numpy as np
+from cachetools import TTLCache
+
+logger = logging.getLogger(__name__)
+
+RESPONSE_CACHE_SIZE = int(os.getenv("RESPONSE_CACHE_SIZE", "10000"))
+RESPONSE_CACHE_TTL = int(os.getenv("RESPONSE_CACHE_TTL", "3600"))
+SEMANTIC_CACHE_SIZE = int(os.getenv("SEMANTIC_CACHE_SIZE", "1000"))
+SEMANTIC_CACHE_THRESHOLD = float(os.getenv("SEMANTIC_CACHE_THRESHOLD", "0.95"))
+SEMANTIC_CACHE_MIN_CHARS = int(os.getenv("SEMANTIC_CACHE_MIN_CHARS", "24"))
+
+_NEGATION_RE = re.compile(r"\b(?:not|no|never|nothing|none|nobody|cannot|without)\b|n't\b")
+
+
+def _normalize(message: str) -> str:
+    return " ".join(message.lower().replace("\u2019", "'").split())
+
+
+def _negations(normalized: str) -> FrozenSet[str]:
+    """Negation words in a normalized message; semantic hits must agree on them."""
+    return frozenset(_NEGATION_RE.findall(normalized))
+
+
+class ExactCache:
+    """TTL map from a normalized message to its response."""
+
+    def __init__(self, maxsize: int = RESPONSE_CACHE_SIZE, ttl: int = RESPONSE_CACHE_TTL):
+        self._cache = TTLCache(maxsize=maxsize, ttl=ttl)
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(message: str) -> str:
+        return hashlib.sha1(_normalize(message).encode("utf-8")).hexdigest()
+
+    def get(self, message: str) -> Optional[str]:
+        with self._lock:
+            return self._cache.get(self._key(message))
+
+    def put(self, message: str, response: str) -> None:
+        with self._lock:
+            self._cache[self._key(message)] = response
+
+
+class SemanticCache:
+    """
+    Fixed-size ring of (unit embedding, response) pairs; a lookup is a single
+    matrix-vector product over the stored embeddings.
+    """
+
+    def __init__(self, maxsize: int = SEMANTIC_CACHE_SIZE, threshold: float = SEMANTIC_CACHE_THRESHOLD):
+        self._maxsize = max(1, maxsize)
+        self._threshold = threshold
+        self._vectors = None
+        self._responses = [None] * self._maxsize
+        self._tags = [None] * self._maxsize
+        self._count = 0
+        self._next = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _unit(embedding) -> Optional[np.ndarray]:
+        vector = np.asarray(embedding, dtype=np.float32)
+        norm = float(np.linalg.norm(vector))
+        return vector / norm if norm else None
+
+    def get(self, embedding, tag=None) -> Optional[str]:
+        """Best response above the threshold among entries stored with ``tag``."""
+        vector = self._unit(embedding)
+        if vector is None:
+            return None
+        with self._lock:
+            if not self._count:
+                return None
+            scores = self._vectors[:self._count] @ vector
+            for best in np.argsort(scores)[::-1]:
+                if scores[best] < self._threshold:
+                    break
+                if self._tags[best] == tag:
+                    return self._responses[best]
+        return None
+
+    def put(self, embedding, response: str, tag=None) -> None:
+        vector = self._unit(embedding)
+        if vector is None:
+            return
+        with self._lock:
+            if self._vectors is None:
+                self._vectors = np.empty((self._maxsize, vector.shape[0]), dtype=np.float32)
+            self._vectors[self._next] = vector
+            self._responses[self._next] = response
+            self._tags[self._next] = tag
+            self._next = (self._next + 1) % self._maxsize
+            self._count = min(self._count + 1, self._maxsize)
+
+
+class ResponseCache:
+    """
+    Exact-match cache backed by a semantic cache.
+
+    Args:
+        embed: Function returning an embedding for a message; when it fails
+            the semantic tier is skipped for that message
+    """
+
+    def __init__(self, embed: Callable[[str], np.ndarray]):
+        self._embed = embed
+        self.exact = ExactCache()
+        self.semantic = SemanticCache()
+
+    def lookup(self, message: str) -> Tuple[Optional[str], Optional[np.ndarray]]:
+        """
+        Look a message up in both tiers. May call the embedding API when the
+        exact tier misses, so async callers should run it in a thread.
+
+        Returns:
+            (cached response or None, message embedding or None); pass the
+            embedding back to ``store`` on a miss to avoid embedding twice
+        """
+        response = self.exact.get(message)
+        if response is not None:
+            return response, None
+        normalized = _normalize(message)
+        if len(normalized) < SEMANTIC_CACHE_MIN_CHARS:
+            return None, None
+        try:
+            embedding = self._embed(normalized)
+        except Exception as e:
+            logger.warning("Embedding failed, skipping semantic lookup: %s", e)
+            return None, None
+        response = self.semantic.get(embedding, _negations(normalized))
+        if response is not None:
+            # Promote so the next identical message skips the embedding
+            self.exact.put(message, response)
+        return response, embedding
+
+    def store(self, message: str, embedding: Optional[np.ndarray], response: str) -> None:
+        """Cache a freshly generated response in both tiers."""
+        self.exact.put(message, response)
+        if embedding is not None:
+            self.semantic.put(embedding, response, _negations(_normalize(message)))
@@ -0,0 +1,44 @@
+"""Optional warmup of the chat pipeline at app startup.
+
+The Gemini clients, the embedding client, the database pool and the
+compiled graphs are all created on first use, so the first chat request of
+each worker paid for all of them. With ``WARMUP_ON_START`` enabled,
+``create_app`` builds them up front with a throwaway retrieval and LLM call.
+"""
+
+import asyncio
+import logging
+import os
+import time
+
+logger = logging.getLogger(__name__)
+
+WARMUP_ON_START = os.getenv("WARMUP_ON_START", "false").lower() in {"1", "true", "yes"}
+WARMUP_TIMEOUT_SECONDS = float(os.getenv("WARMUP_TIMEOUT_SECONDS", "30"))
+
+
+def warmup() -> None:
+    """Initialize the chat pipeline's clients; failures are logged, never raised."""
+    from .executor import _get_background_loop
+    from .general_graph import get_general_purpose_app
+    from .graph import _LLM, _policy_retriever, get_company_policy_app
+    from .orchestrator import get_orchestrator
+
+    started = time.perf_counter()
+    steps = (
+        ("graphs", lambda: (get_company_policy_app(), get_general_purpose_app(), get_orchestrator())),
+        # Embedding client, connection pool and vector index
+        ("retriever", lambda: _policy_retriever.retrieve_chunks("ping", top_k=1)),
+        # Async Gemini client on the loop that serves SSE streams
+        ("llm", lambda: asyncio.run_coroutine_threadsafe(
+            _LLM.ainvoke("ping"), _get_background_loop()
+        ).result(WARMUP_TIMEOUT_SECONDS)),
+    )
+    for name, step in steps:
+        step_started = time.perf_counter()
+        try:
+            step()
+            logger.debug("Warmed up %s in %.2fs", name, time.perf_counter() - step_started)
+        except Exception as e:
+            logger.warning("Warmup of %s failed: %s", name, e)
+    logger.info("Chat pipeline warmup finished in %.2fs", time.perf_counter() - started)
@@ -1,18 +1,41 @@
-from flask import Blueprint, jsonify, g
+import logging
+from itertools import islice
+
+import orjson
+from flask import Blueprint, Response, jsonify, g, request, stream_with_context
 from middleware.auth import require_auth
 from db.repositories.chat_repository import ChatRepository
 
 
+logger = logging.getLogger(__name__)
+
 chat_bp = Blueprint("chat", __name__)
 
+# Messages fetched before the response starts; also the server-side
+# cursor's page size
+MESSAGES_PAGE_SIZE = 500
+
+# Stateless (connections come from the shared pool), so one instance serves
+# every request
+_chat_repo = ChatRepository()
+
 
 @chat_bp.route("/sessions", methods=["GET"])
 @require_auth
 def get_sessions():
-    """Return the authenticated user's chat sessions (most recent first)."""
+    """
+    Return the authenticated user's chat sessions (most recent first).
+
+    Optional query params: limit, and before_updated_at + before_id taken from
+    the last session of the previous page.
+    """
     user_id = getattr(g, "user_id", None)
-    repo = ChatRepository()
-    sessions = repo.get_user_sessions(user_id)
+    sessions = _chat_repo.get_user_sessions(
+        user_id,
+        limit=request.args.get("limit", 50, type=int),
+        before_updated_at=request.args.get("before_updated_at"),
+        before_id=request.args.get("before_id"),
+    )
     return jsonify({"sessions": sessions})
 
 
@@ -21,16 +44,43 @@ def get_sessions():
 def get_session_messages(session_id):
     """Return messages for a session after verifying ownership."""
     user_id = getattr(g, "user_id", None)
-    repo = ChatRepository()
 
-    session = repo.get_session(session_id)
+    session = _chat_repo.get_session(session_id)
     if not session:
         return jsonify({"error": "Session not found"}), 404
     if session.get("user_id") != user_id:
         return jsonify({"error": "Forbidden: session does not belong to user"}), 403
 
-    messages = repo.get_messages(session_id)
-    return jsonify({"session": session, "messages": messages})
+    # Fetch the first page up front: until the response starts, a database
+    # error can still become a proper 500
+    messages = _chat_repo.iter_messages(session_id, itersize=MESSAGES_PAGE_SIZE)
+    try:
+        first_page = list(islice(messages, MESSAGES_PAGE_SIZE))
+    except Exception as e:
+        messages.close()
+        logger.exception("Failed to load messages for session %s", session_id)
+        return jsonify({"error": str(e)}), 500
+    if len(first_page) < MESSAGES_PAGE_SIZE:
+        # Short history: return the connection before the client starts reading
+        messages.close()
+
+    def generate():
+        # Same JSON document as before, written one message at a time. Once
+        # the 200 has been sent, a database error can only cut the body short
+        # (the client sees invalid JSON); it is logged here.
+        try:
+            yield b'{"session":' + orjson.dumps(session) + b',"messages":['
+            for i, message in enumerate(first_page):
+                yield (b"," if i else b"") + orjson.dumps(message)
+            for message in messages:
+                yield b"," + orjson.dumps(message)
+            yield b"]}"
+        except Exception:
+            logger.exception("Streaming messages for session %s failed", session_id)
+        finally:
+            messages.close()
+
+    return Response(stream_with_context(generate()), mimetype="application/json")
 
 
 @chat_bp.route("/sessions/<session_id>", methods=["DELETE"])
@@ -38,15 +88,14 @@ def get_session_messages(session_id):
 def delete_session(session_id):
     """Delete a session (and cascade delete messages) after verifying ownership."""
     user_id = getattr(g, "user_id", None)
-    repo = ChatRepository()
 
-    session = repo.get_session(session_id)
+    session = _chat_repo.get_session(session_id)
     if not session:
         return jsonify({"error": "Session not found"}), 404
     if session.get("user_id") != user_id:
         return jsonify({"error": "Forbidden: session does not belong to user"}), 403
 
-    repo.delete_session(session_id)
+    _chat_repo.delete_session(session_id)
     return jsonify({"status": "deleted", "session_id": session_id})
 
 
@@ -1,22 +1,79 @@
 from flask import Blueprint, request, jsonify, url_for
 from agents.document_processor import DocumentProcessor
+import json
 import os
-import tempfile
+import re
+import orjson
 import requests
 from agents.policy_analyze_document_processor import AnalyzeDocumentProcessorTemp
 from agents.policy_analyze_chunk_retriever import PolicyAnalyzeRetriever
-from agents.international_policy_retriever import InternationalPolicyRetriever
-from google import genai
+from agents.gemini_client import get_client
 from middleware.auth import require_auth
 from agents.international_policy_processor import InternationalPolicyProcessor
 from urllib.parse import urlparse
+from utils.http_client import download_to_tempfile
 
-client = genai.Client(api_key=os.getenv("GEMINI_API_KEY"))
+# Strips a ```json ... ``` fence around the model's answer
+_CODE_FENCE_RE = re.compile(r"^```json\s*|```$")
+
+_SENTENCE_ENDS = frozenset(".!?")
+
+# Each selected policy adds a search branch to the retrieval query
+MAX_SELECTED_POLICIES = int(os.getenv("MAX_SELECTED_POLICIES", "10"))
+
+
+def _trim_to_sentence(text, max_len=400, min_cut=50):
+    """
+    Cut text to ``max_len`` characters, then back to the last sentence end
+    for nicer display, unless that would leave ``min_cut`` characters or
+    fewer. Scans right to left once, stopping at ``min_cut``.
+    """
+    snippet = text[:max_len]
+    for i in range(len(snippet) - 1, min_cut, -1):
+        if snippet[i] in _SENTENCE_ENDS:
+            return snippet[:i + 1]
+    return snippet
+
+
+def _build_paired_context(chunk_embeddings, results, policy_type, source_builder, attached_document, extra=None):
+    """
+    Yield one paired context per retrieved match, pairing the attached
+    document's chunk with the matched policy text.
+
+    Args:
+        chunk_embeddings: The processor's chunk_embeddings, indexed by chunk
+        results: Retriever results, {chunk index: [match, ...]}
+        policy_type: policy_type value for every pair
+        source_builder: Builds the provenance "source" dict from a policy id
+        attached_document: {"document_name", "document_url"} of the analyzed document
+        extra: Additional top-level fields for every pair
+    """
+    for idx, matches in results.items():
+        chunk_index = int(idx)
+        attached_chunk = chunk_embeddings[chunk_index]["chunk"]
+        for match in matches:
+            full_text = match.get("content") or ""
+            policy_id = match.get("id")
+            yield {
+                "attached_chunk": attached_chunk,
+                "matching_policy": full_text,
+                # short snippet to keep API responses compact for the UI
+                "paired_context_snippet": _trim_to_sentence(full_text),
+                "distance": match["distance"],
+                "policy_type": policy_type,
+                **(extra or {}),
+                # structured provenance
+                "policy_id": policy_id,
+                "source": source_builder(policy_id),
+                "attached": {**attached_document, "chunk_index": chunk_index},
+            }
+
+
+client = get_client()
 document_bp = Blueprint("documents", __name__)
 processor = DocumentProcessor()
 doc_processor = AnalyzeDocumentProcessorTemp()
 policyAnalyzeRetriever = PolicyAnalyzeRetriever()
-internationalPolicyRetriever = InternationalPolicyRetriever()
 int_processor = InternationalPolicyProcessor()
 
 @document_bp.route("/upload", methods=["POST"])
@@ -48,6 +105,13 @@ def analyze_document():
     if not document_url:
         return jsonify({"error": "No document URL provided"}), 400
 
+    if not isinstance(selected_policies, list):
+        return jsonify({"error": "selected_policies must be a list"}), 400
+    # Duplicates would only repeat the same search
+    selected_policies = list(dict.fromkeys(selected_policies))
+    if len(selected_policies) > MAX_SELECTED_POLICIES:
+        return jsonify({"error": f"At most {MAX_SELECTED_POLICIES} policies can be selected"}), 400
+
     # Derive a friendly analyzed document name from the URL (best-effort)
     try:
         parsed = urlparse(document_url)
@@ -55,11 +119,13 @@ def analyze_document():
     except Exception:
         analyzed_document_name = "document.pdf"
 
-    # Download file
-    res = requests.get(document_url).content
-    with tempfile.NamedTemporaryFile(delete=False) as tmp:
-        tmp.write(res)
-        tmp_file_path = tmp.name
+    # Download file, streamed to disk
+    try:
+        tmp_file_path = download_to_tempfile(document_url)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 413
+    except requests.RequestException as e:
+        return jsonify({"error": f"Failed to download document: {e}"}), 400
 
     try:
         # Process into chunks + embeddings
@@ -87,100 +153,74 @@ def analyze_document():
                 "result": "No text extracted from document"
             }), 400
 
-        retrieval_results = policyAnalyzeRetriever.retrieve_for_embeddings(
-            [c["embedding"] for c in chunk_embeddings],
-            safe_session_id,
-            top_k=1
-        )
+        # Company policies and every selected international policy are
+        # searched in a single query (per connection shard)
+        document_embeddings = [c["embedding"] for c in chunk_embeddings]
+        sources = [("documents", None)] + [
+            ("international_policy", {"policy": policy}) for policy in selected_policies
+        ]
+        multi_results = policyAnalyzeRetriever.retrieve_multi(document_embeddings, sources, top_k=1)
+        if multi_results["status"] == "success":
+            retrieval_results, *policy_results = (
+                {"status": "success", "results": results} for results in multi_results["results"]
+            )
+        else:
+            retrieval_results = multi_results
+            policy_results = [multi_results] * len(selected_policies)
 
         # Map back attached chunks to matching policies
         paired_contexts = []
+        attached_document = {"document_name": analyzed_document_name, "document_url": document_url}
         if retrieval_results["status"] == "success":
-            for idx, matches in retrieval_results["results"].items():
-                attached_chunk = chunk_embeddings[int(idx)]["chunk"]
-                for match in matches:
-                    # build a short snippet to keep API responses compact for the UI
-                    full_text = match.get("content") or ""
-                    snippet = full_text[:400]
-                    # try to cut at last sentence end for nicer display
-                    last_period = max(snippet.rfind('.'), snippet.rfind('!'), snippet.rfind('?'))
-                    if last_period and last_period > 50:
-                        snippet = snippet[: last_period + 1]
-
-                    paired_contexts.append({
-                        "attached_chunk": attached_chunk,
-                        "matching_policy": full_text,
-                        "paired_context_snippet": snippet,
-                        "distance": match["distance"],
-                        "policy_type": "company_policy",
-                        # structured provenance
-                        "policy_id": match.get("id"),
-                        "source": {
-                            "table": "documents",
-                            "policy_id": match.get("id"),
-                            "url": url_for(
-                                "policies.get_company_policy",
-                                policy_id=match.get("id"),
-                                _external=True
-                            ) if match.get("id") else None
-                        },
-                        "attached": {
-                            "document_name": analyzed_document_name,
-                            "document_url": document_url,
-                            "chunk_index": int(idx)
-                        }
-                    })
-                    
+            paired_contexts.extend(_build_paired_context(
+                chunk_embeddings,
+                retrieval_results["results"],
+                "company_policy",
+                lambda policy_id: {
+                    "table": "documents",
+                    "policy_id": policy_id,
+                    "url": url_for(
+                        "policies.get_company_policy",
+                        policy_id=policy_id,
+                        _external=True
+                    ) if policy_id else None
+                },
+                attached_document,
+            ))
+
         # Process international policies if selected
-        if selected_policies:
-            document_embeddings = [c["embedding"] for c in chunk_embeddings]
-            
-            for policy in selected_policies:
-                int_policy_results = internationalPolicyRetriever.retrieve_for_embeddings(
-                    document_embeddings,
-                    safe_session_id,
-                    policy,
-                    top_k=1
-                )
-                
-                if int_policy_results["status"] == "success":
-                    for idx, matches in int_policy_results["results"].items():
-                        attached_chunk = chunk_embeddings[int(idx)]["chunk"]
-                        for match in matches:
-                            full_text = match.get("content") or ""
-                            snippet = full_text[:400]
-                            last_period = max(snippet.rfind('.'), snippet.rfind('!'), snippet.rfind('?'))
-                            if last_period and last_period > 50:
-                                snippet = snippet[: last_period + 1]
-
-                            paired_contexts.append({
-                                "attached_chunk": attached_chunk,
-                                "matching_policy": full_text,
-                                "paired_context_snippet": snippet,
-                                "distance": match["distance"],
-                                "policy_type": f"international_policy_{policy}",
-                                # structured provenance
-                                "policy": policy,
-                                "policy_id": match.get("id"),
-                                "source": {
-                                    "table": "international_policy",
-                                    "policy": policy,
-                                    "policy_id": match.get("id"),
-                                    "url": url_for(
-                                        "policies.get_international_policy",
-                                        policy=policy,
-                                        policy_id=match.get("id"),
-                                        _external=True
-                                    ) if match.get("id") else None
-                                },
-                                "attached": {
-                                    "document_name": analyzed_document_name,
-                                    "document_url": document_url,
-                                    "chunk_index": int(idx)
-                                }
-                            })
+        for policy, int_policy_results in zip(selected_policies, policy_results):
+            if int_policy_results["status"] == "success":
+                paired_contexts.extend(_build_paired_context(
+                    chunk_embeddings,
+                    int_policy_results["results"],
+                    f"international_policy_{policy}",
+                    lambda policy_id, policy=policy: {
+                        "table": "international_policy",
+                        "policy": policy,
+                        "policy_id": policy_id,
+                        "url": url_for(
+                            "policies.get_international_policy",
+                            policy=policy,
+                            policy_id=policy_id,
+                            _external=True
+                        ) if policy_id else None
+                    },
+                    attached_document,
+                    extra={"policy": policy},
+                ))
 
         print(f"Total paired contexts: {paired_contexts}")
+        # The model only needs each clause, the matched policy snippet and its
+        # type; full policy text and provenance stay in the HTTP response
+        llm_contexts = orjson.dumps([
+            {
+                "chunk": p["attached_chunk"],
+                "policy_snippet": p["paired_context_snippet"],
+                "policy_type": p["policy_type"],
+            }
+            for p in paired_contexts
+        ]).decode()
         # Prompt Gemini
         prompt = f"""
         You are a compliance analyzer. Compare attached document clauses with both company policies and international regulations. 
@@ -199,7 +239,7 @@ def analyze_document():
         Note that each paired context includes a policy_type field indicating whether it's a company policy or an international policy (like GDPR, HIPAA, etc).
 
         Here are the pairs of context:
-        {paired_contexts}
+        {llm_contexts}
         """
 
         response = client.models.generate_content(
@@ -207,13 +247,10 @@ def analyze_document():
             contents=prompt
         )
 
-        import json
-        import re
-
         raw_text = response.text
 
         # Remove ```json or ``` code block if present
-        cleaned_text = re.sub(r"^```json\s*|```$", "", raw_text.strip())
+        cleaned_text = _CODE_FENCE_RE.sub("", raw_text.strip())
 
         try:
             violations = json.loads(cleaned_text)
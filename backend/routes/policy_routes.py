@@ -10,15 +10,14 @@ policy_bp = Blueprint("policies", __name__)
 def get_company_policy(policy_id):
     """Return a full company policy entry by ID."""
     try:
-        conn = get_db()
-        cur = conn.cursor()
-        cur.execute(
-            "SELECT id, content FROM documents WHERE id = %s",
-            (policy_id,)
-        )
-        row = cur.fetchone()
-        cur.close()
-        conn.close()
+        with get_db(autocommit=True) as conn:
+            cur = conn.cursor()
+            cur.execute(
+                "SELECT id, content FROM documents WHERE id = %s",
+                (policy_id,)
+            )
+            row = cur.fetchone()
+            cur.close()
 
         if not row:
             return jsonify({"error": "Policy not found"}), 404
@@ -37,15 +36,14 @@ def get_company_policy(policy_id):
 def get_international_policy(policy, policy_id):
     """Return a full international policy entry by policy name + ID."""
     try:
-        conn = get_db()
-        cur = conn.cursor()
-        cur.execute(
-            "SELECT id, policy, content FROM international_policy WHERE policy = %s AND id = %s",
-            (policy, policy_id)
-        )
-        row = cur.fetchone()
-        cur.close()
-        conn.close()
+        with get_db(autocommit=True) as conn:
+            cur = conn.cursor()
+            cur.execute(
+                "SELECT id, policy, content FROM international_policy WHERE policy = %s AND id = %s",
+                (policy, policy_id)
+            )
+            row = cur.fetchone()
+            cur.close()
 
         if not row:
             return jsonify({"error": "Policy not found"}), 404
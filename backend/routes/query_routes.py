@@ -8,6 +8,8 @@ load_dotenv()
 
 query_bp = Blueprint("queries", __name__)
 
+_chat_repo = ChatRepository()
+
 
 @query_bp.route("/analyze/stream", methods=["POST"])
 @require_auth  # Add authentication - extracts user_id from JWT
@@ -35,9 +37,8 @@ def analyze_stream():
             print(f"[ROUTE] Document URL provided: {document_url}")
 
         # Validate session ownership if session exists
-        repo = ChatRepository()
         user_id = getattr(g, 'user_id', None)
-        existing = repo.get_session(session_id)
+        existing = _chat_repo.get_session(session_id)
         if existing and existing.get('user_id') != user_id:
             return jsonify({"error": "Forbidden: session does not belong to user"}), 403
 
@@ -48,7 +49,8 @@ def analyze_stream():
         stream_generator = orchestrator.create_stream_generator(session_id, msg, document_url, user_id)
         print(f"[ROUTE] Stream generator created, returning SSE response")
 
-        # Return a Flask Response streaming SSE
+        # Return a Flask Response streaming SSE; frames are already bytes, so
+        # Werkzeug writes them without re-encoding
         return Response(stream_generator, mimetype='text/event-stream')
 
     except Exception as e:
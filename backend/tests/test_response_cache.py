@@ -0,0 +1,62 @@
+from orchestrator.response_cache import ResponseCache
+
+
+class FakeEmbedder:
+    """Maps known texts to fixed vectors and counts calls."""
+
+    def __init__(self, vectors):
+        self.vectors = vectors
+        self.calls = []
+
+    def __call__(self, text):
+        self.calls.append(text)
+        return self.vectors[text]
+
+
+def test_exact_hit_skips_embedding():
+    embed = FakeEmbedder({"what can you help me with today": [1.0, 0.0]})
+    cache = ResponseCache(embed=embed)
+    _, embedding = cache.lookup("What can you help me with today")
+    cache.store("What can you help me with today", embedding, "I can help with policies.")
+    embed.calls.clear()
+
+    cached, _ = cache.lookup("what can you  help me with today")
+
+    assert cached == "I can help with policies."
+    assert embed.calls == []
+
+
+def test_short_message_is_not_embedded():
+    embed = FakeEmbedder({})
+    cache = ResponseCache(embed=embed)
+
+    assert cache.lookup("what can you do") == (None, None)
+    assert embed.calls == []
+
+
+def test_paraphrase_hits_semantic_tier():
+    embed = FakeEmbedder({
+        "what can you help me with today": [1.0, 0.0],
+        "what could you help me with today": [1.0, 0.01],
+    })
+    cache = ResponseCache(embed=embed)
+    _, embedding = cache.lookup("what can you help me with today")
+    cache.store("what can you help me with today", embedding, "I can help with policies.")
+
+    cached, _ = cache.lookup("what could you help me with today")
+
+    assert cached == "I can help with policies."
+
+
+def test_negated_near_duplicate_misses():
+    embed = FakeEmbedder({
+        "what can you help me with today": [1.0, 0.0],
+        "what can't you help me with today": [1.0, 0.01],
+    })
+    cache = ResponseCache(embed=embed)
+    _, embedding = cache.lookup("what can you help me with today")
+    cache.store("what can you help me with today", embedding, "I can help with policies.")
+
+    cached, _ = cache.lookup("what can't you help me with today")
+
+    assert cached is None
@@ -0,0 +1,206 @@
+"""Batched embedding helpers for the google-genai client.
+
+The processors used to call ``embed_content`` once per chunk, paying a full
+HTTPS round-trip for every sentence window. ``contents`` already accepts a
+list, so we send up to ``EMBED_BATCH_SIZE`` chunks per request and retry a
+batch with exponential backoff when Gemini rate-limits us (HTTP 429).
+
+Batches are dispatched concurrently from a small thread pool; the calls are
+network-bound so the GIL is released while waiting on Gemini. A shared
+token bucket keeps the request rate under ``EMBED_MAX_RPM``.
+
+Vectors are returned as float32 NumPy arrays (converted once in C rather
+than 3072 ``float()`` calls per chunk); ``db.connection`` registers the
+pgvector adapter so psycopg2 sends them to ``vector`` columns directly.
+
+Recently embedded texts are memoized in a bounded LRU so repeated chunks
+(headers, boilerplate clauses) and repeated questions skip the API.
+"""
+
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+from typing import Iterable, Iterator, List, Sequence, Tuple
+
+import numpy as np
+
+# Gemini accepts at most 100 inputs per embedding request. Each chunk is a
+# window of ~15 sentences, which stays well inside the per-input token limit.
+EMBED_BATCH_SIZE = int(os.getenv("EMBED_BATCH_SIZE", "100"))
+EMBED_MAX_RETRIES = int(os.getenv("EMBED_MAX_RETRIES", "5"))
+EMBED_BACKOFF_SECONDS = float(os.getenv("EMBED_BACKOFF_SECONDS", "1.0"))
+EMBED_CONCURRENCY = int(os.getenv("EMBED_CONCURRENCY", "8"))
+EMBED_MAX_RPM = int(os.getenv("EMBED_MAX_RPM", "1500"))
+EMBED_CACHE_SIZE = int(os.getenv("EMBED_CACHE_SIZE", "4096"))
+# Chunks pulled from a stream per round: enough to keep every worker busy.
+EMBED_WINDOW_SIZE = EMBED_BATCH_SIZE * EMBED_CONCURRENCY
+
+
+class RateLimiter:
+    """Thread-safe token bucket allowing ``rate_per_minute`` acquisitions."""
+
+    def __init__(self, rate_per_minute: int):
+        self.capacity = max(1, rate_per_minute)
+        self.tokens = float(self.capacity)
+        self.refill_per_second = self.capacity / 60.0
+        self.updated_at = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(
+                    self.capacity,
+                    self.tokens + (now - self.updated_at) * self.refill_per_second
+                )
+                self.updated_at = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.refill_per_second
+            time.sleep(wait)
+
+
+_rate_limiter = RateLimiter(EMBED_MAX_RPM)
+
+
+class EmbeddingCache:
+    """Thread-safe LRU of (model, text) -> read-only embedding array."""
+
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            value = self.entries.get(key)
+            if value is not None:
+                self.entries.move_to_end(key)
+            return value
+
+    def put(self, key, value):
+        if self.maxsize <= 0:
+            return
+        with self.lock:
+            self.entries[key] = value
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+_embedding_cache = EmbeddingCache(EMBED_CACHE_SIZE)
+
+
+def make_batches(texts: Sequence[str], batch_size: int = EMBED_BATCH_SIZE) -> List[Sequence[str]]:
+    """Split texts into consecutive batches of at most ``batch_size`` items."""
+    batch_size = max(1, min(batch_size, 100))
+    return [texts[i:i + batch_size] for i in range(0, len(texts), batch_size)]
+
+
+def _is_rate_limited(exc: Exception) -> bool:
+    """Return True when the API error represents a 429 / quota response."""
+    code = getattr(exc, "code", None) or getattr(exc, "status_code", None)
+    if code == 429:
+        return True
+    message = str(exc)
+    return "429" in message or "RESOURCE_EXHAUSTED" in message
+
+
+def embed_batch(client, model: str, batch: Sequence[str]) -> List[np.ndarray]:
+    """Embed one batch of texts, retrying on rate limiting."""
+    attempt = 0
+    while True:
+        _rate_limiter.acquire()
+        try:
+            result = client.models.embed_content(model=model, contents=list(batch))
+            break
+        except Exception as exc:
+            if not _is_rate_limited(exc) or attempt >= EMBED_MAX_RETRIES:
+                raise
+            time.sleep(EMBED_BACKOFF_SECONDS * (2 ** attempt))
+            attempt += 1
+
+    if len(result.embeddings) != len(batch):
+        raise ValueError(
+            f"Embedding API returned {len(result.embeddings)} vectors for {len(batch)} inputs"
+        )
+    return [np.asarray(embedding.values, dtype=np.float32) for embedding in result.embeddings]
+
+
+def _embed_uncached(client, model: str, texts: Sequence[str], batch_size: int) -> List[np.ndarray]:
+    """Embed texts in batches, running batches concurrently."""
+    batches = make_batches(texts, batch_size)
+    if not batches:
+        return []
+    if len(batches) == 1:
+        return embed_batch(client, model, batches[0])
+
+    workers = max(1, min(EMBED_CONCURRENCY, len(batches)))
+    embeddings: List[np.ndarray] = []
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(embed_batch, client, model, batch) for batch in batches]
+        for future in futures:
+            embeddings.extend(future.result())
+    return embeddings
+
+
+def embed_texts(client, model: str, texts: Sequence[str], batch_size: int = EMBED_BATCH_SIZE) -> List[np.ndarray]:
+    """Embed all texts in order, sending ``batch_size`` texts per request.
+
+    Cached and duplicate texts are only embedded once. Batches run
+    concurrently on up to ``EMBED_CONCURRENCY`` threads; results are
+    reassembled in input order. The first failing batch re-raises.
+    Returned arrays are shared with the cache and must not be modified.
+    """
+    found = {}
+    missing = []
+    for text in texts:
+        if text in found:
+            continue
+        cached = _embedding_cache.get((model, text))
+        found[text] = cached
+        if cached is None:
+            missing.append(text)
+
+    for text, embedding in zip(missing, _embed_uncached(client, model, missing, batch_size)):
+        embedding.flags.writeable = False
+        found[text] = embedding
+        _embedding_cache.put((model, text), embedding)
+
+    return [found[text] for text in texts]
+
+
+def embed_in_windows(
+    client, model: str, texts: Iterable[str], window_size: int = EMBED_WINDOW_SIZE
+) -> Iterator[Tuple[List[str], List[np.ndarray]]]:
+    """Pull texts from an iterable window by window and yield (texts, embeddings).
+
+    Lets callers embed a large document as its chunks are generated instead
+    of materializing the chunk list first; nothing here touches the database,
+    so callers can write the results in a single short transaction.
+    """
+    iterator = iter(texts)
+    while True:
+        window = list(islice(iterator, window_size))
+        if not window:
+            return
+        yield window, embed_texts(client, model, window)
+
+
+def embed_query(client, model: str, text: str) -> np.ndarray:
+    """Embed a single text (e.g. a user question), using the shared cache."""
+    return embed_texts(client, model, [text])[0]
+
+
+def clear_embedding_cache():
+    """Drop all memoized embeddings."""
+    _embedding_cache.clear()
@@ -0,0 +1,75 @@
+"""Shared HTTP session for outbound downloads.
+
+Document downloads used to go through bare ``requests.get``, opening a new
+TCP/TLS connection every time. A single pooled ``requests.Session`` keeps
+connections to the same hosts (e.g. the storage bucket) alive between
+requests and retries transient failures with backoff.
+"""
+
+import os
+import tempfile
+from functools import lru_cache
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+# Connect / read timeout (seconds) for downloads
+DEFAULT_TIMEOUT = (5, 30)
+
+# Documents larger than this are rejected while downloading
+DOCUMENT_MAX_BYTES = int(os.getenv("DOCUMENT_MAX_BYTES", str(50 * 1024 * 1024)))
+DOWNLOAD_CHUNK_SIZE = 64 * 1024
+
+
+@lru_cache(maxsize=1)
+def get_http_session() -> requests.Session:
+    """Return the process-wide pooled session, creating it on first use."""
+    session = requests.Session()
+    adapter = HTTPAdapter(
+        pool_connections=20,
+        pool_maxsize=100,
+        max_retries=Retry(
+            total=3,
+            backoff_factor=0.3,
+            status_forcelist=(502, 503, 504),
+            allowed_methods=frozenset({"GET", "HEAD"}),
+        ),
+    )
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+def download_to_tempfile(url: str, max_bytes: int = DOCUMENT_MAX_BYTES) -> str:
+    """
+    Stream a document into a temp file in DOWNLOAD_CHUNK_SIZE pieces, so
+    memory use does not grow with the document size. The caller removes
+    the file.
+
+    Returns:
+        Path of the temp file
+
+    Raises:
+        requests.HTTPError: On an error status
+        ValueError: If the document is larger than ``max_bytes``
+    """
+    with get_http_session().get(url, stream=True, timeout=DEFAULT_TIMEOUT) as res:
+        res.raise_for_status()
+        declared = res.headers.get("Content-Length")
+        if declared and declared.isdigit() and int(declared) > max_bytes:
+            raise ValueError(f"Document too large: {declared} bytes (limit {max_bytes})")
+
+        size = 0
+        tmp = tempfile.NamedTemporaryFile(delete=False)
+        try:
+            with tmp:
+                for chunk in res.iter_content(DOWNLOAD_CHUNK_SIZE):
+                    size += len(chunk)
+                    if size > max_bytes:
+                        raise ValueError(f"Document too large: over {max_bytes} bytes")
+                    tmp.write(chunk)
+        except BaseException:
+            os.remove(tmp.name)
+            raise
+    return tmp.name
@@ -10,9 +10,10 @@ uploads without additional tooling.
 
 from __future__ import annotations
 
+import io
 import os
 from functools import lru_cache
-from typing import Any, Dict, Optional, Tuple
+from typing import Any, BinaryIO, Callable, Dict, List, Optional, Tuple, Union
 
 import PyPDF2
 from PyPDF2.errors import PdfReadError
@@ -21,11 +22,12 @@ from PyPDF2.errors import PdfReadError
 # so the rest of the system can operate even if OCR dependencies are missing.
 try:  # pragma: no cover - import guard
     import torch
-    from pdf2image import convert_from_path
+    from pdf2image import convert_from_bytes, convert_from_path
     from PIL import Image
     from transformers import TrOCRProcessor, VisionEncoderDecoderModel
 except ImportError:  # pragma: no cover - handled at runtime
     torch = None
+    convert_from_bytes = None
     convert_from_path = None
     Image = None
     TrOCRProcessor = None
@@ -86,35 +88,67 @@ def extract_text_from_pdf(file_path: str) -> str:
     return _extract_text_from_pdf(file_path)
 
 
+def extract_text_from_bytes(data: bytes) -> str:
+    """Like ``extract_text_from_pdf``, for a document already held in memory.
+
+    There is no file name to go by, so anything that does not parse as a PDF
+    is treated as an image.
+    """
+
+    return _extract_pdf_text(
+        io.BytesIO(data),
+        render_pages=lambda: convert_from_bytes(
+            data,
+            dpi=300,
+            poppler_path=POPPLER_PATH or None,
+        ),
+        image_fallback=lambda: _extract_text_from_image(io.BytesIO(data)),
+    )
+
+
 def _extract_text_from_pdf(file_path: str) -> str:
     """Extract text from a PDF, invoking OCR on image-only pages when needed."""
 
+    with open(file_path, "rb") as file_pointer:
+        return _extract_pdf_text(
+            file_pointer,
+            render_pages=lambda: convert_from_path(
+                file_path,
+                dpi=300,
+                poppler_path=POPPLER_PATH or None,
+            ),
+            image_fallback=lambda: _extract_text_from_image(file_path),
+        )
+
+
+def _extract_pdf_text(
+    file_pointer: BinaryIO,
+    render_pages: Callable[[], List[Any]],
+    image_fallback: Callable[[], str],
+) -> str:
+    """Shared PDF extraction; ``render_pages`` rasterises the document for OCR."""
+
     page_texts: Dict[int, str] = {}
     pages_requiring_ocr = []
 
-    with open(file_path, "rb") as file_pointer:
-        try:
-            reader = PyPDF2.PdfReader(file_pointer)
-        except (PdfReadError, Exception) as exc:
-            print(f"[OCR] Unable to parse as PDF, attempting image OCR: {exc}")
-            return _extract_text_from_image(file_path)
-        for index, page in enumerate(reader.pages, start=1):
-            extracted = page.extract_text() or ""
-            if extracted.strip():
-                page_texts[index] = extracted
-            else:
-                pages_requiring_ocr.append(index)
+    try:
+        reader = PyPDF2.PdfReader(file_pointer)
+    except (PdfReadError, Exception) as exc:
+        print(f"[OCR] Unable to parse as PDF, attempting image OCR: {exc}")
+        return image_fallback()
+    for index, page in enumerate(reader.pages, start=1):
+        extracted = page.extract_text() or ""
+        if extracted.strip():
+            page_texts[index] = extracted
+        else:
+            pages_requiring_ocr.append(index)
 
     if pages_requiring_ocr:
         ocr_components = _load_ocr_model()
         if ocr_components:
             processor, model, device = ocr_components
             try:
-                images = convert_from_path(
-                    file_path,
-                    dpi=300,
-                    poppler_path=POPPLER_PATH or None,
-                )
+                images = render_pages()
                 for index in pages_requiring_ocr:
                     try:
                         image = images[index - 1]
@@ -137,8 +171,8 @@ def _extract_text_from_pdf(file_path: str) -> str:
     return "\n\n".join(ordered_pages)
 
 
-def _extract_text_from_image(file_path: str) -> str:
-    """Run OCR directly on an image file."""
+def _extract_text_from_image(file_path: Union[str, BinaryIO]) -> str:
+    """Run OCR directly on an image file (a path or a binary file object)."""
 
     ocr_components = _load_ocr_model()
     if not ocr_components or Image is None:
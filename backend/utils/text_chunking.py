@@ -0,0 +1,84 @@
+"""Sentence splitting and chunking shared by the document processors.
+
+``nltk.sent_tokenize`` rebuilds a Punkt tokenizer on every call in recent NLTK
+releases, and the processors used to run ``nltk.download`` at import time.
+The tokenizer is now loaded once, lazily, and the Punkt data is only
+downloaded when it is genuinely missing.
+"""
+
+import re
+from collections import deque
+from functools import lru_cache
+from typing import Iterator, List, Tuple
+
+import nltk
+
+# NUL bytes are rejected by Postgres TEXT columns; drop them while cleaning.
+_CLEAN_TABLE = str.maketrans({"\x00": None})
+_WHITESPACE_RE = re.compile(r"\s+")
+
+
+def _ensure_nltk_resource(path: str, package: str) -> bool:
+    """Download an NLTK package only if ``path`` cannot be found locally."""
+    try:
+        nltk.data.find(path)
+        return True
+    except LookupError:
+        pass
+    try:
+        return bool(nltk.download(package, quiet=True))
+    except Exception:
+        return False
+
+
+@lru_cache(maxsize=1)
+def get_sentence_tokenizer():
+    """Return a cached English Punkt sentence tokenizer."""
+    # NLTK >= 3.8.2 ships the model as ``punkt_tab``
+    punkt_tokenizer = getattr(nltk.tokenize, "PunktTokenizer", None)
+    if punkt_tokenizer is not None and _ensure_nltk_resource("tokenizers/punkt_tab/english/", "punkt_tab"):
+        return punkt_tokenizer("english")
+
+    # Older NLTK releases load the pickled model
+    _ensure_nltk_resource("tokenizers/punkt", "punkt")
+    return nltk.data.load("tokenizers/punkt/english.pickle")
+
+
+def normalize_text(text: str) -> str:
+    """Remove NUL bytes and collapse whitespace runs into single spaces."""
+    return _WHITESPACE_RE.sub(" ", text.translate(_CLEAN_TABLE)).strip()
+
+
+def split_sentences(text: str) -> List[str]:
+    """Split text into sentences with the cached tokenizer."""
+    return get_sentence_tokenizer().tokenize(text)
+
+
+def sentence_spans(text: str) -> Iterator[Tuple[int, int]]:
+    """Yield (start, end) character offsets of each sentence in text."""
+    return get_sentence_tokenizer().span_tokenize(text)
+
+
+def chunk_text(text: str, sentences_per_chunk: int = 15, overlap: int = 3) -> Iterator[str]:
+    """Lazily yield overlapping chunks of sentences.
+
+    Chunks are sliced straight out of the normalized text using sentence
+    offsets, so overlapping sentences are never re-joined. Only the current
+    window of sentence offsets is held in memory.
+    """
+    text = normalize_text(text)
+    step = sentences_per_chunk - overlap  # move with overlap
+    window = deque()
+
+    for span in sentence_spans(text):
+        window.append(span)
+        if len(window) == sentences_per_chunk:
+            yield text[window[0][0]:window[-1][1]]
+            for _ in range(step):
+                window.popleft()
+
+    # Trailing (shorter) windows
+    while window:
+        yield text[window[0][0]:window[-1][1]]
+        for _ in range(min(step, len(window))):
+            window.popleft()